@@ -1,26 +1,55 @@
+import os
 import socket
 import json
 from datetime import datetime
 import time
 import threading
 
+from frontend_protocol import CommandReader, ProtocolError
+from log_pipeline import LogPipeline
+from dispatch import KeyedDispatcher
+from fleet import FleetRegistry, parse_ack_topic, ACK_SUBSCRIPTION, LEGACY_ACK_TOPIC, LEGACY_CAR_ID
+from latency import LatencyTracker
+import carcodec
+from carcodec import CODEC_JSON, CODEC_BINARY
+from payload_cache import PayloadCache
+from path_catalog import PathCatalog, CatalogError
+from planner import TrackMap, RoutePlanner, PlanError
+from scheduler import ReservationScheduler
+from metrics import Metrics
+
 # 定义 Socket 服务器参数
 HOST = "127.0.0.1"  # 本地 IP
 PORT = 12345     # 端口号
 
-# 小车路径指令
-car_path = [
-    ["end"],
-    ['right', 'straight', 'right', 'right', 'right', 'end'],
-    ['straight', 'left', 'end'],
-]
+# 小车路径目录（paths.json），文件变化时热加载
+catalog = PathCatalog()
+planner = None          # 赛道地图路线规划器，--track 指定地图后创建
+scheduler = None        # 路口预约调度，与 planner 一起创建
+departures = {}         # 小车编号 -> 等待出发的 threading.Timer
+departures_lock = threading.Lock() # departures 由分发线程和 Timer 线程同时修改
+
+broker_ip = "10.223.47.2"
+mqttc = None            # MQTT 客户端，由 start_mqtt 创建
+client_socket = None    # 前端日志出口：同步模式下是前端 socket，异步模式下是 FrontendHub
+log_pipeline = None     # 日志合并发送管道，为 None 时每条日志直接 sendall
+dispatcher = None       # 消息处理线程池，为 None 时在 paho 网络线程中直接处理
+fleet = FleetRegistry() # 车队登记表
+latency = LatencyTracker() # 指令往返延迟统计
+stale_timeout = 120     # 小车超过该时间（秒）没有任何消息时报告给前端，0 表示不检查
+stale_cars = set()      # 已报告过的失联小车，再次收到消息后移除
+metrics = Metrics()     # 运行指标，--metrics-port 指定的端口上以 Prometheus 格式暴露
+mqtt_connects = 0       # paho 连接成功的次数，大于 1 说明发生过重连
 
 def send_log(client_socket, log_type, message):
     """
     发送日志到前端，通过 Socket 通信。
     根据 log_type 来决定日志格式。
     直接发送格式化的字符串，不封装成 JSON。
+    启用 log_pipeline 时只入队，由管道合并后批量发送。
     """
+    if client_socket is None and log_pipeline is None:
+        return
     try:
         # 根据 log_type 修改日志消息格式
         if log_type == "log":
@@ -32,8 +61,17 @@ def send_log(client_socket, log_type, message):
         else:
             formatted_message = "[unknown] " + message  # 其他类型日志使用默认格式
         
+        if log_pipeline is not None:
+            log_pipeline.put(formatted_message)
+            return
+
         # 直接发送格式化的字符串
-        client_socket.sendall(formatted_message.encode() + b'\n')
+        data = formatted_message.encode() + b'\n'
+        start = time.perf_counter()
+        client_socket.sendall(data)
+        metrics.inc("frontend_write_seconds_total", time.perf_counter() - start)
+        metrics.inc("frontend_write_bytes_total", len(data))
+        metrics.inc("frontend_writes_total")
 
     except Exception as e:
         print(f"发送日志失败: {e}")
@@ -41,134 +79,591 @@ def send_log(client_socket, log_type, message):
 
 # MQTT 回调函数
 def on_connect(client, userdata, flags, reason_code, properties=None):
+    global mqtt_connects
     print(f"Connected with result code {reason_code}")
-    # 订阅主题
-    client.subscribe("server")
+    mqtt_connects += 1
+    metrics.inc("mqtt_connects_total")
+    if mqtt_connects > 1:
+        metrics.inc("mqtt_reconnects_total")
+    # 订阅所有小车的回复主题，以及旧固件使用的 server 主题
+    client.subscribe([(ACK_SUBSCRIPTION, 2), (LEGACY_ACK_TOPIC, 0)])
+
+
+def on_disconnect(client, userdata, flags, reason_code, properties=None):
+    print(f"Disconnected with result code {reason_code}")
+    metrics.inc("mqtt_disconnects_total")
 
 
 def on_message(client, userdata, msg):
     try:
-        # 解析收到的消息为 JSON 格式
-        message = json.loads(msg.payload.decode())
-
-        # 1. 接收到初始化回复指令，发送任务指令
-        if message['command-type'] == 'ack_init':
-            print(f"[Received][{datetime.now()}][topic {msg.topic}][type:{message['command-type']}]: {message}")
-            send_log(client_socket, "debug", f"[Received][{datetime.now()}][topic {msg.topic}][type:{message['command-type']}]: {message}")
-            car_path_id = message.get('path-id', 1)
-            send_task(car_path_id)
-            print(f"小车选择路径 {car_path[car_path_id]}")
-            send_log(client_socket, "log", f"小车选择路径 {car_path_id}")
+        # 解析收到的消息，支持二进制编码的小车回复二进制，其余为 JSON
+        binary = carcodec.is_binary(msg.payload)
+        if binary:
+            message = carcodec.decode(msg.payload)
+        else:
+            message = json.loads(msg.payload.decode())
+        command_type = message['command-type']
+        metrics.inc("mqtt_messages_received_total", topic=msg.topic, command_type=command_type)
+        car_id = parse_ack_topic(msg.topic) or LEGACY_CAR_ID
+        path_id = message.get('path-id')
+        if path_id is not None and (isinstance(path_id, bool) or not isinstance(path_id, (int, str))):
+            send_log(client_socket, "debug", f"小车 {car_id} 回复的 path-id 无效: {path_id!r}")
+            path_id = None      # 无效的 path-id 按未提供处理
+        car = fleet.record_ack(car_id, command_type, path_id)
+        if binary:
+            car.codec = CODEC_BINARY
+        elif command_type == 'online':
+            car.codec = message.get('codec', CODEC_JSON)  # 小车上线时声明支持的编码
+        cid = message.get('cid')
+        if cid is not None:
+            latency.ack(cid, car_id)
+        # 接收记录只格式化一次，同时用于终端打印和前端日志
+        received = f"[Received][{datetime.now()}][topic {msg.topic}][type:{command_type}]: {message}"
+        print(received)
+
+        # 1. 接收到初始化回复指令，给这辆车发送任务指令
+        if command_type == 'ack_init':
+            send_log(client_socket, "debug", received)
+            car_path_id = path_id if path_id is not None else 1
+            car.path_id = car_path_id
+            send_task(car_path_id, car_id, parent=cid)
+            print(f"小车 {car_id} 选择路径 {catalog.lookup(car_path_id)}")
+            send_log(client_socket, "log", f"小车 {car_id} 选择路径 {car_path_id}")
 
         # 2. 接收到任务回复指令，打印回复
-        elif message['command-type'] == 'ack_task':
-            print(f"[Received][{datetime.now()}][topic {msg.topic}][type:{message['command-type']}]: {message}")
-            print(f"小车正在路径{message['path-id']}上行进...")
-            send_log(client_socket, "debug", f"[Received][{datetime.now()}][topic {msg.topic}][type:{message['command-type']}]: {message}")
-            send_log(client_socket, "log", f"小车正在路径{message['path-id']}上行进...")
+        elif command_type == 'ack_task':
+            route = path_id if path_id is not None else '(规划路线)'
+            print(f"小车 {car_id} 正在路径{route}上行进...")
+            send_log(client_socket, "debug", received)
+            send_log(client_socket, "log", f"小车 {car_id} 正在路径{route}上行进...")
 
         # 3. 接收到停止回复指令，打印回复
-        elif message['command-type'] == 'ack_stop':
-            print(f"[Received][time:{datetime.now()}][topic {msg.topic}][type:{message['command-type']}]: {message}")
-            print(f"小车停止行进")
-            send_log(client_socket, "debug", f"[Received][time:{datetime.now()}][topic {msg.topic}][type:{message['command-type']}]: {message}")
-            send_log(client_socket, "log", f"小车停止行进")
+        elif command_type == 'ack_stop':
+            print(f"小车 {car_id} 停止行进")
+            send_log(client_socket, "debug", received)
+            send_log(client_socket, "log", f"小车 {car_id} 停止行进")
+            if scheduler is not None:
+                scheduler.finish(car_id)
+
+        # 5. 小车报告延误，后移它的路口预约，必要时推迟或停止其他小车
+        elif command_type == 'delay' and scheduler is not None:
+            handle_delay(car_id, float(message.get('seconds', 0)))
+
+        # 4. 小车上线
+        elif command_type == 'online':
+            send_log(client_socket, "log", f"小车 {car_id} 已上线")
         else:
-            print(f"[Received][time:{datetime.now()}][topic {msg.topic}][type:{message['command-type']}]: {message}")
             send_log(client_socket, "unkonwn", f"{message}")
-    except json.JSONDecodeError:
-        send_log(client_socket, "unknown", f"[解析消息失败]: {msg.payload.decode()}")
+    except ValueError:
+        metrics.inc("json_decode_errors_total", topic=msg.topic)
+        send_log(client_socket, "unknown", f"[解析消息失败]: {msg.payload.decode(errors='replace')}")
 
 # MQTT 消息发送函数
-def send_message(client, topic, payload):
+def send_message(client, topics, payload, codec=CODEC_JSON):
     """
-    发送 JSON 格式的 MQTT 消息。
+    发送 MQTT 消息，默认 JSON 格式，codec 为 CODEC_BINARY 时使用 carcodec 的二进制编码
+    （无法用二进制表示的消息退回 JSON）。
+    topics 可以是单个主题，也可以是主题列表（消息只序列化一次）。
     """
     try:
-        json_payload = json.dumps(payload)
-        client.publish(topic, json_payload)
-        send_log(client_socket, "debug", f"发送消息至 {topic}: {json_payload}")
+        encoded = carcodec.encode(payload) if codec == CODEC_BINARY else None
+        if encoded is None:
+            encoded = json.dumps(payload)
     except Exception as e:
         send_log(client_socket, "debug", f"发送消息失败: {e}")
+        return
+    publish_payload(client, topics, encoded, payload.get("command-type"))
+
+def publish_payload(client, topics, encoded, command_type):
+    """
+    把已编码的负载发布到一个或多个主题。
+    """
+    if isinstance(topics, str):
+        topics = [topics]
+    if not topics:
+        send_log(client_socket, "debug", "没有可发送的目标小车")
+        return
+    try:
+        for topic in topics:
+            client.publish(topic, encoded)
+            metrics.inc("mqtt_messages_published_total", topic=topic, command_type=command_type)
+        if isinstance(encoded, str):
+            shown = encoded
+        elif carcodec.is_binary(encoded):
+            shown = f"[二进制 {len(encoded)} 字节] {command_type}"
+        else:
+            shown = encoded.decode()
+        if len(topics) == 1:
+            send_log(client_socket, "debug", f"发送消息至 {topics[0]}: {shown}")
+        else:
+            send_log(client_socket, "debug", f"发送消息至 {len(topics)} 个主题: {shown}")
+    except Exception as e:
+        send_log(client_socket, "debug", f"发送消息失败: {e}")
+
+# 指令负载（不含关联 ID），由 payload_cache 编码一次后缓存
+# 路线已不可用（地图或路径目录在排队期间被替换）时抛出 ValueError，send_command 不发送该指令
+def build_payload(command_type, path_id=None):
+    if command_type == "task" and isinstance(path_id, tuple):
+        # 规划的路线：("plan", 地图版本, 起点, 终点, 初始方向)，没有路径 ID
+        plan = None
+        if planner is not None and planner.track.version == path_id[1]:
+            plan = planner.plan(*path_id[2:])
+        if plan is None:
+            raise ValueError(f"路线 {path_id[2]}->{path_id[3]} 在当前地图上不可用")
+        return {
+            "command-type": "task",
+            "tasks": list(plan.tasks),
+        }
+    if command_type == "init":
+        return {"command-type": "init"}
+    if command_type == "task":
+        route = catalog.get(path_id)
+        if route is None:
+            raise ValueError(f"路径不存在: {path_id}")
+        return {
+            "command-type": "task",
+            "tasks": list(route.tasks),
+            "path-id": path_id,
+        }
+    if command_type == "stop":
+        return {
+            "command-type": "stop",
+            "tasks": ['end'],
+        }
+    raise ValueError(f"未知指令类型: {command_type}")
+
+payload_cache = PayloadCache(build_payload)
+
+# 路径目录重新加载后，已缓存的 task 负载失效
+catalog.on_reload = lambda catalog: payload_cache.clear()
+try:
+    catalog.load()
+except (OSError, CatalogError) as e:
+    print(f"加载路径目录失败: {e}")
+
+# 发送小车指令
+def send_command(target, command_type, path_id=None, parent=None):
+    """
+    给目标小车发送指令，附加关联 ID（cid），小车回复时原样带回，用于统计往返延迟。
+    parent 为触发本指令的回复所带的关联 ID。
+    支持二进制编码的小车单独发送时使用二进制，广播和其他小车使用 JSON。
+    负载从 payload_cache 取出，发送时只拼接关联 ID，不再构造字典和 json.dumps。
+    """
+    cid = latency.start(command_type, fleet.cars_for(target), parent)
+    groups = fleet.topics_by_codec(target)
+    if not groups:
+        publish_payload(mqttc, [], b"", command_type)
+    try:
+        payloads = [(topics, payload_cache.get(command_type, path_id, codec, cid)) for codec, topics in groups.items()]
+    except ValueError as e:
+        latency.cancel(cid)
+        send_log(client_socket, "log", f"{command_type} 指令未发送: {e}")
+        return False
+    for topics, payload in payloads:
+        publish_payload(mqttc, topics, payload, command_type)
+    return True
 
 # 初始化任务
-def init_tasks():
-    message_payload = {"command-type": "init"}
-    send_message(mqttc, "data", message_payload)
+def init_tasks(target=None):
+    send_command(target, "init")
 
 # 发送任务指令
-def send_task(path_id=1):
-    message_payload = {
-        "command-type": "task",
-        "tasks": car_path[path_id],
-        "path-id": path_id,
-    }
-    send_message(mqttc, "data", message_payload)
+def send_task(path_id=1, target=None, parent=None):
+    """
+    path_id 可以是路径 ID、路径名称，或 "<起点>[/<方向>]-><终点>" 由赛道地图规划路线，
+    路径不存在时不发送并返回 False。
+    """
+    if isinstance(path_id, str) and "->" in path_id:
+        return send_planned_task(path_id, target, parent)
+    route = catalog.lookup(path_id)
+    if route is None:
+        send_log(client_socket, "debug", f"路径不存在: {path_id}")
+        return False
+    send_command(target, "task", route.id, parent)
+    return True
+
+# 发送规划的路线
+def send_planned_task(spec, target=None, parent=None):
+    if planner is None:
+        send_log(client_socket, "debug", "没有加载赛道地图，无法规划路线")
+        return False
+    source, _, goal = spec.partition("->")
+    start, _, heading = source.partition("/")
+    try:
+        heading = int(heading) % 360 if heading else None
+    except ValueError:
+        send_log(client_socket, "debug", f"无效的初始方向: {heading}")
+        return False
+    start, goal = start.strip(), goal.strip()
+    plan = planner.plan(start, goal, heading)
+    if plan is None:
+        send_log(client_socket, "debug", f"没有从 {start} 到 {goal} 的可行路线")
+        return False
+    send_log(client_socket, "debug", f"规划路线: {plan}")
+    key = ("plan", planner.track.version, start, goal, heading)
+    cars = fleet.cars_for(target) if scheduler is not None else []
+    if not cars:
+        send_command(target, "task", key, parent)
+        return True
+    # 逐车预约路口，按分配的出发时间发送任务，同一路口同一时间只有一辆车
+    for car_id in cars:
+        depart = scheduler.schedule(car_id, plan)
+        if depart is None:
+            send_log(client_socket, "log", f"小车 {car_id} 在 {scheduler.max_wait:.0f} 秒内没有无冲突的出发时间，未发送")
+            continue
+        dispatch_at(car_id, depart, key, parent)
+    return True
+
+def dispatch_at(car_id, depart, key, parent=None):
+    """
+    在 depart（time.monotonic）时给小车发送任务，替换它之前等待中的任务。
+    """
+    with departures_lock:
+        timer = departures.pop(car_id, None)
+    if timer is not None:
+        timer.cancel()
+    delay = depart - time.monotonic()
+    if delay <= 0.01:
+        send_departure(car_id, key, parent)
+        return
+    send_log(client_socket, "debug", f"小车 {car_id} 推迟 {delay:.2f} 秒出发以避让路口")
+
+    def depart_now():
+        # 只处理仍在登记中的这个 Timer；已被新任务替换的旧 Timer 不再发送
+        with departures_lock:
+            if departures.get(car_id) is not timer:
+                return
+            del departures[car_id]
+        send_departure(car_id, key, parent)
+
+    timer = threading.Timer(delay, depart_now)
+    timer.daemon = True
+    with departures_lock:
+        old = departures.pop(car_id, None)
+        departures[car_id] = timer
+    if old is not None:
+        old.cancel()
+    timer.start()
+
+def send_departure(car_id, key, parent=None):
+    # 按预约出发；路线已不可用而没有发出时取消这辆车的路口预约
+    if not send_command(car_id, "task", key, parent) and scheduler is not None:
+        scheduler.finish(car_id)
+
+def handle_delay(car_id, seconds):
+    """
+    小车报告延误：已出发的冲突车辆发送停止指令，未出发的按新的出发时间重新安排。
+    """
+    moved, conflicts = scheduler.report_delay(car_id, seconds)
+    for other in moved:
+        booking = scheduler.booking(other)
+        if booking is None:
+            continue        # 重新调度后预约已被取消（例如小车已停止）
+        plan, depart = booking
+        dispatch_at(other, depart, ("plan", planner.track.version, plan.start, plan.goal, plan.heading))
+    for other in conflicts:
+        send_log(client_socket, "log", f"小车 {car_id} 延误 {seconds:.1f} 秒，与行驶中的小车 {other} 冲突，停止 {other}")
+        send_stop(other)
+
+def load_track(path):
+    """
+    加载赛道地图并创建规划器（已有规划器时替换地图）。
+    """
+    global planner, scheduler
+    track = TrackMap.load(path)
+    if planner is None:
+        planner = RoutePlanner(track)
+    else:
+        planner.set_track(track)
+    scheduler = ReservationScheduler(track)
+    return planner
 
 # 发送停止指令
-def send_stop():
-    message_payload = {
-        "command-type": "stop",
-        "tasks": ['end'],
-    }
-    send_message(mqttc, "data", message_payload)
+def send_stop(target=None):
+    send_command(target, "stop")
+
+# 检查超时未回复的指令
+def watch_acks(interval=1.0):
+    """
+    后台线程：每 interval 秒清理一次超时的指令，把未回复的小车报告给前端。
+    """
+    while True:
+        time.sleep(interval)
+        for cid, command_type, car_id in latency.expire():
+            print(f"小车 {car_id} 未回复 {command_type} 指令 (cid {cid})")
+            send_log(client_socket, "log", f"小车 {car_id} 未回复 {command_type} 指令")
+        if scheduler is not None:
+            scheduler.expire()
+        if stale_timeout > 0:
+            report_stale(stale_timeout)
+
+def report_stale(timeout):
+    """
+    失联小车（超过 timeout 秒没有消息）每次失联只报告一次，重新收到消息的小车恢复检查。
+    """
+    stale = set(fleet.stale(timeout))
+    for car_id in sorted(stale - stale_cars):
+        print(f"小车 {car_id} 已超过 {timeout:.0f} 秒没有消息")
+        send_log(client_socket, "log", f"小车 {car_id} 已超过 {timeout:.0f} 秒没有消息，可能已离线")
+    stale_cars.intersection_update(stale)
+    stale_cars.update(stale)
 
 # 处理前端指令
 def process_command(command):
     """
     处理来自前端的指令。
+    指令后可以用 @ 指定目标：<指令>@<小车编号>、<指令>@group:<分组>、<指令>@all，
+    不指定时发送给所有小车。
     """
+    command, _, target = command.partition("@")
+    target = target or None
+
     if command.startswith("task:"):
         print(f'[前端][task]{command}')
-        if command.split(":")[1] == "":
-            path_id = 1
-        else:
-            path_id = int(command.split(":")[1])
-        send_task(path_id)
-        send_log(client_socket, "debug", f"处理任务指令，路径 ID: {path_id}")
+        # task:<路径 ID 或名称>，省略时使用路径 1
+        path_id = command[len("task:"):] or "1"
+        if send_task(path_id, target):
+            send_log(client_socket, "debug", f"处理任务指令，路径: {path_id}，目标: {target or 'all'}")
 
     elif command == "init":
         print(f'[前端][init]{command}')
-        init_tasks()
-        send_log(client_socket, "debug", "处理初始化指令")
+        init_tasks(target)
+        send_log(client_socket, "debug", f"处理初始化指令，目标: {target or 'all'}")
 
     elif command == "stop":
         print(f'[前端][stop]{command}')
-        send_stop()
-        send_log(client_socket, "debug", "处理停止指令")
+        send_stop(target)
+        send_log(client_socket, "debug", f"处理停止指令，目标: {target or 'all'}")
+
+    elif command.startswith("assign:"):
+        # assign:<分组>@<小车编号>，把小车加入分组
+        print(f'[前端][assign]{command}')
+        group = command[len("assign:"):] or None
+        if target is None:
+            send_log(client_socket, "debug", "分组指令需要指定小车编号")
+        else:
+            fleet.assign(target, group)
+            send_log(client_socket, "debug", f"小车 {target} 加入分组 {group}")
+
+    elif command == "paths":
+        print(f'[前端][paths]{command}')
+        send_log(client_socket, "debug", f"路径目录: {catalog.summary()}")
+
+    elif command == "fleet":
+        print(f'[前端][fleet]{command}')
+        send_log(client_socket, "debug", f"车队: {fleet.summary()}，失联: {sorted(stale_cars)}")
+
+    elif command == "latency":
+        # latency 查看各指令类型的延迟分位数，latency@<小车编号> 查看单辆车
+        print(f'[前端][latency]{command}')
+        send_log(client_socket, "debug", f"指令延迟(ms): {latency.summary(target)}")
+
+    elif command == "stats":
+        print(f'[前端][stats]{command}')
+        if log_pipeline is not None:
+            send_log(client_socket, "debug", f"日志管道: {log_pipeline.stats()}")
+        if dispatcher is not None:
+            send_log(client_socket, "debug", f"消息处理队列: {dispatcher.stats()}")
+        send_log(client_socket, "debug", f"指令负载缓存: {payload_cache.stats()}")
+        if planner is not None:
+            send_log(client_socket, "debug", f"路线规划: {planner.stats()}")
+            send_log(client_socket, "debug", f"路口预约: {scheduler.stats()}")
 
     else:
         print(f'[前端][unknown]{command}')
         send_log(client_socket, "debug", f"未知指令: {command}")
 
+# 每次抓取指标时读取的状态
+@metrics.collect
+def collect_metrics():
+    samples = [("fleet_cars", {}, len(fleet)), ("fleet_stale_cars", {}, len(stale_cars))]
+    if hasattr(client_socket, "writers"):
+        samples.append(("frontend_connections", {}, len(client_socket.writers)))
+        samples.append(("frontend_connections_accepted_total", {}, client_socket.accepted))
+        samples.append(("frontend_dropped_lines_total", {"reason": "slow_frontend"}, client_socket.dropped))
+        samples.append(("frontend_hub_dropped_calls_total", {}, client_socket.dropped_calls))
+    else:
+        samples.append(("frontend_connections", {}, int(client_socket is not None and client_socket.fileno() != -1)))
+    if log_pipeline is not None:
+        stats = log_pipeline.stats()
+        samples += [
+            ("log_queue_depth", {}, stats["queue_depth"]),
+            ("frontend_dropped_lines_total", {"reason": "log_pipeline"}, stats["dropped"]),
+            ("frontend_writes_total", {}, stats["flushes"]),
+            ("frontend_write_bytes_total", {}, stats["sent_bytes"]),
+            ("frontend_write_seconds_total", {}, stats["write_seconds"]),
+            ("frontend_write_max_seconds", {}, stats["write_max"]),
+        ]
+    if dispatcher is not None:
+        stats = dispatcher.stats()
+        for worker, depth in enumerate(stats["queue_depths"]):
+            samples.append(("dispatch_queue_depth", {"worker": worker}, depth))
+        samples.append(("dispatch_dropped_total", {}, stats["dropped"]))
+        samples.append(("dispatch_errors_total", {}, stats["errors"]))
+    stats = payload_cache.stats()
+    samples.append(("payload_cache_hits_total", {}, stats["hits"]))
+    samples.append(("payload_cache_misses_total", {}, stats["misses"]))
+    summary = latency.summary()
+    samples.append(("command_pending", {}, summary["pending"]))
+    for command_type, count in summary["timeouts"].items():
+        samples.append(("command_timeouts_total", {"command_type": command_type}, count))
+    for command_type, values in summary["types"].items():
+        samples.append(("command_acks_total", {"command_type": command_type}, values["n"]))
+        for quantile in ("p50", "p99", "max"):
+            samples.append(("command_latency_seconds", {"command_type": command_type, "quantile": quantile}, values[quantile] / 1000))
+    return samples
+
 # 初始化 MQTT 客户端
-import paho.mqtt.client as mqtt
-mqttc = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
-mqttc.on_connect = on_connect
-mqttc.on_message = on_message
-broker_ip = "10.223.47.2"
-mqttc.connect(broker_ip, 1883, 60)
-mqttc.loop_start()
+def start_mqtt(broker_ip, hub=None, broker_port=1883):
+    """
+    创建并启动 MQTT 客户端。
+    传入 hub 时，paho 回调只负责把消息交给事件循环；
+    启用 dispatcher 时按主题（即按小车）交给线程池，同一辆车的消息保持顺序；
+    两者都没有时在 paho 网络线程中直接处理。
+    """
+    global mqttc
+    import paho.mqtt.client as mqtt
+    mqttc = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    mqttc.on_connect = on_connect
+    mqttc.on_disconnect = on_disconnect
+    if hub is None and dispatcher is not None:
+        mqttc.on_message = lambda client, userdata, msg: dispatcher.submit(msg.topic, on_message, client, userdata, msg)
+    elif hub is None:
+        mqttc.on_message = on_message
+    else:
+        mqttc.on_message = lambda client, userdata, msg: hub.call_soon(on_message, client, userdata, msg)
+    mqttc.connect(broker_ip, broker_port, 60)
+    mqttc.loop_start()
+    return mqttc
+
+
+# 启动 Socket 服务器（同步模式，只接受一个前端）
+def run_server():
+    global client_socket
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
+        server_socket.bind((HOST, PORT))
+        server_socket.listen()
+
+        print(f"Socket 服务器已启动，监听地址: {HOST}:{PORT}")
+        client_socket, client_address = server_socket.accept()
+        print(f"前端已连接: {client_address}")
+        if log_pipeline is not None:
+            log_pipeline.sink = client_socket
+
+        # 主循环，按协议分帧读取指令，一次处理缓冲区中所有完整的指令
+        reader = CommandReader(on_negotiate=lambda version: send_log(client_socket, "debug", f"协议版本: {version}"))
+        try:
+            while True:
+                data = client_socket.recv(4096)
+                if not data:
+                    print("前端已断开")
+                    break
+                for command in reader.feed(data):
+                    print(f"收到前端指令: {command}")
+                    process_command(command)
+        except ProtocolError as e:
+            print(f"前端协议错误: {e}")
+        except KeyboardInterrupt:
+            mqttc.loop_stop()
+            print("服务器已停止")
+            client_socket.close()
+        finally:
+            client_socket.close()
+
+
+# 启动异步 Socket 服务器（可同时连接多个前端）
+async def run_async_server(hub):
+    await hub.start()
+    print(f"异步 Socket 服务器已启动，监听地址: {HOST}:{PORT}")
+    await hub.serve_forever()
 
-# 启动 Socket 服务器
-with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-    server_socket.bind((HOST, PORT))
-    server_socket.listen()
 
-    print(f"Socket 服务器已启动，监听地址: {HOST}:{PORT}")
-    client_socket, client_address = server_socket.accept()
-    print(f"前端已连接: {client_address}")
+def main():
+    global client_socket, log_pipeline, dispatcher, stale_timeout
+    import argparse
+    parser = argparse.ArgumentParser(description="小车 MQTT 后端")
+    parser.add_argument("--broker", default=broker_ip, help="MQTT Broker 地址")
+    parser.add_argument("--broker-port", type=int, default=1883, help="MQTT Broker 端口")
+    parser.add_argument("--embedded-broker", action="store_true", help="在本进程中启动 broker.py 并连接它，不需要外部 Broker")
+    parser.add_argument("--async", dest="async_mode", action="store_true", help="异步模式，允许多个前端同时连接")
+    parser.add_argument("--log-flush-ms", type=float, default=20, help="日志合并发送间隔（毫秒），0 表示每条日志立即发送")
+    parser.add_argument("--workers", type=int, default=4, help="同步模式下处理 MQTT 消息的线程数，0 表示在 paho 网络线程中处理")
+    parser.add_argument("--ack-timeout", type=float, default=5, help="指令超过该时间（秒）未收到回复视为超时")
+    parser.add_argument("--stale-s", type=float, default=stale_timeout, help="小车超过该时间（秒）没有消息时报告为失联，0 表示不检查")
+    parser.add_argument("--paths", default=catalog.path, help="路径目录文件")
+    parser.add_argument("--paths-reload-s", type=float, default=2, help="检查路径目录文件变化的间隔（秒），0 表示不热加载")
+    parser.add_argument("--track", default="track.json", help="赛道地图文件，用于 task:<起点>-><终点> 规划路线")
+    parser.add_argument("--precompute", action="store_true", help="启动时预先计算所有起终点的路线（适合小地图）")
+    parser.add_argument("--metrics-port", type=int, default=0, help="Prometheus 指标端口（只监听本机，例如 9100），默认 0 不启用")
+    args = parser.parse_args()
 
-    # 主循环，处理指令和日志更新
+    if args.metrics_port:
+        try:
+            metrics.serve("127.0.0.1", args.metrics_port)
+            print(f"指标服务已启动: http://127.0.0.1:{args.metrics_port}/metrics")
+        except OSError as e:
+            print(f"指标服务启动失败（端口 {args.metrics_port}），继续运行: {e}")
+
+    latency.timeout = args.ack_timeout
+    stale_timeout = args.stale_s
+    if args.paths != catalog.path:
+        catalog.path = args.paths
+        catalog.load()
+    if os.path.exists(args.track):
+        try:
+            load_track(args.track)
+            print(f"赛道地图已加载: {len(planner.track.nodes)} 个路口，版本 {planner.track.version}")
+            if args.precompute:
+                print(f"预先计算路线 {planner.precompute()} 条")
+        except (OSError, ValueError, PlanError) as e:
+            print(f"加载赛道地图失败: {e}")
+    if args.paths_reload_s > 0:
+        catalog.watch(args.paths_reload_s, on_error=lambda e: send_log(client_socket, "log", f"路径目录加载失败，继续使用旧目录: {e}"))
+    threading.Thread(target=watch_acks, name="ack-watch", daemon=True).start()
+
+    if args.embedded_broker:
+        from broker import run_in_thread
+        try:
+            embedded, _ = run_in_thread("127.0.0.1", args.broker_port)
+        except OSError as e:
+            print(f"内嵌 MQTT Broker 启动失败（端口 {args.broker_port}）: {e}")
+            return
+        args.broker, args.broker_port = "127.0.0.1", embedded.port
+        print(f"内嵌 MQTT Broker 已启动，监听地址: 127.0.0.1:{embedded.port}")
+
+    if args.log_flush_ms > 0:
+        log_pipeline = LogPipeline(flush_interval=args.log_flush_ms / 1000).start()
+
+    if not args.async_mode:
+        if args.workers > 0:
+            dispatcher = KeyedDispatcher(args.workers).start()
+        start_mqtt(args.broker, broker_port=args.broker_port)
+        try:
+            run_server()
+        finally:
+            if dispatcher is not None:
+                dispatcher.stop()
+            if log_pipeline is not None:
+                log_pipeline.stop()
+        return
+
+    import asyncio
+    from frontend_hub import FrontendHub
+    hub = FrontendHub(HOST, PORT, process_command)
+    client_socket = hub
+    if log_pipeline is not None:
+        log_pipeline.sink = hub
+    start_mqtt(args.broker, hub, args.broker_port)
     try:
-        while True:
-            data = client_socket.recv(1024).decode().strip()
-            if data:
-                print(f"收到前端指令: {data}")
-                process_command(data)
+        asyncio.run(run_async_server(hub))
     except KeyboardInterrupt:
-        mqttc.loop_stop()
         print("服务器已停止")
-        client_socket.close()
     finally:
-        client_socket.close()
+        mqttc.loop_stop()
+        if log_pipeline is not None:
+            log_pipeline.stop()
+        hub.close()
+
+
+if __name__ == "__main__":
+    main()
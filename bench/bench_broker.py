@@ -0,0 +1,119 @@
+"""
+以内嵌 broker.py 为目标的 MQTT 吞吐和延迟基准。
+
+分别测试：
+    paho 客户端（backend.py 使用）  QoS 0 / QoS 1 的发布->订阅吞吐，往返延迟
+    micro_py.MQTTClient（小车使用） QoS 0/1/2、不同在途窗口下的发布吞吐，往返延迟
+
+用法（在仓库根目录）：
+    python bench/bench_broker.py --count 20000
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import micro_py
+from broker import run_in_thread
+
+
+def percentiles(values):
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q / 100 * len(values)))] * 1e6
+    return f"p50={pick(50):7.1f}us p99={pick(99):7.1f}us max={values[-1] * 1e6:7.1f}us"
+
+
+def bench_paho(port, count, qos):
+    import paho.mqtt.client as mqtt
+
+    done = threading.Event()
+    received = [0]
+
+    def on_message(client, userdata, msg):
+        received[0] += 1
+        if received[0] == count:
+            done.set()
+
+    sub = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"bench-sub-{qos}")
+    sub.on_message = on_message
+    sub.connect("127.0.0.1", port)
+    sub.subscribe("bench/paho", qos)
+    sub.loop_start()
+    pub = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"bench-pub-{qos}")
+    pub.max_inflight_messages_set(1000)
+    pub.connect("127.0.0.1", port)
+    pub.loop_start()
+    time.sleep(0.2)
+
+    payload = b'{"command-type": "ack_task", "path-id": 1}'
+    start = time.perf_counter()
+    for _ in range(count):
+        pub.publish("bench/paho", payload, qos)
+    done.wait(60)
+    elapsed = time.perf_counter() - start
+    print(f"paho      QoS{qos} 吞吐: {received[0] / elapsed:10.0f} msg/s ({received[0]}/{count})")
+
+    # 往返延迟：发布后等待同一条消息被订阅者收到
+    rtt = []
+    arrived = threading.Event()
+    sub.on_message = lambda client, userdata, msg: arrived.set()
+    for _ in range(min(count, 2000)):
+        arrived.clear()
+        t0 = time.perf_counter()
+        pub.publish("bench/paho", payload, qos)
+        arrived.wait(5)
+        rtt.append(time.perf_counter() - t0)
+    print(f"paho      QoS{qos} 往返: {percentiles(rtt)}")
+    for client in (pub, sub):
+        client.loop_stop()
+        client.disconnect()
+
+
+def bench_micro_py(port, count, qos, window=1):
+    received = [0]
+    c = micro_py.MQTTClient(b"bench-micro-%d-%d" % (qos, window), "127.0.0.1", port, max_inflight=window)
+    c.set_callback(lambda topic, msg: received.__setitem__(0, received[0] + 1))
+    c.connect()
+    c.subscribe(b"bench/micro_py", qos)
+
+    payload = b'{"command-type": "ack_task", "path-id": 1}'
+    start = time.perf_counter()
+    for _ in range(count):
+        c.publish(b"bench/other", payload, qos=qos)
+    c.wait_inflight()
+    elapsed = time.perf_counter() - start
+    print(f"micro_py  QoS{qos} 窗口{window:3d} 发布: {count / elapsed:10.0f} msg/s")
+
+    rtt = []
+    for _ in range(min(count, 2000)):
+        before = received[0]
+        t0 = time.perf_counter()
+        c.publish(b"bench/micro_py", payload, qos=qos)
+        while received[0] == before:
+            c.wait_msg()
+        rtt.append(time.perf_counter() - t0)
+    print(f"micro_py  QoS{qos} 窗口{window:3d} 往返: {percentiles(rtt)}")
+    c.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="内嵌 Broker 的 MQTT 吞吐/延迟基准")
+    parser.add_argument("--count", type=int, default=20000, help="每项测试的消息数")
+    parser.add_argument("--port", type=int, default=0, help="连接已有 Broker 的端口，0 表示启动内嵌 Broker")
+    args = parser.parse_args()
+
+    port = args.port
+    if not port:
+        broker, _ = run_in_thread("127.0.0.1", 0)
+        port = broker.port
+    for qos in (0, 1):
+        bench_paho(port, args.count, qos)
+    for qos, window in ((0, 1), (1, 1), (1, 16), (2, 1), (2, 16)):
+        bench_micro_py(port, args.count, qos, window)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+legacy/mqtt_car.py 的 CPython 客户端基准：一个线程用 ClientLoop 驱动大量非阻塞客户端。
+
+先用阻塞模式校验大负载（超过接收缓冲区、需要多次 recv）完整收到；再让 --cars 个客户端
+在一个线程里连接内嵌 broker.py、订阅各自的主题，发布端给每辆车发 --rounds 条 QoS 1 指令，
+各客户端收到后回复，统计连接耗时和 指令->回复 吞吐。
+
+用法（在仓库根目录）：
+    python bench/bench_client_loop.py --cars 500 --rounds 20
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from broker import run_in_thread
+from legacy.mqtt_car import ClientLoop, MQTTClient
+
+
+def check_large_payload(port):
+    received = []
+    sub = MQTTClient(b"large-sub", "127.0.0.1", port, rx_buf_size=256)
+    sub.set_callback(lambda topic, msg: received.append((bytes(topic), bytes(msg))))
+    sub.connect()
+    sub.subscribe(b"bench/large", 1)
+    pub = MQTTClient(b"large-pub", "127.0.0.1", port)
+    pub.connect()
+    payload = os.urandom(300000)
+    pub.publish(b"bench/large", payload, qos=1)
+    while not received:
+        sub.wait_msg()
+    assert received == [(b"bench/large", payload)], "大负载没有完整收到"
+    pub.disconnect()
+    sub.disconnect()
+    print(f"大负载校验通过（{len(payload)} 字节，接收缓冲区扩大到 {len(sub.rx)} 字节）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ClientLoop 多客户端基准")
+    parser.add_argument("--cars", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    broker, _ = run_in_thread("127.0.0.1", 0)
+    port = broker.port
+    check_large_payload(port)
+
+    loop = ClientLoop()
+    acks = [0]
+    cars = []
+    for i in range(args.cars):
+        car = MQTTClient(b"car-%d" % i, "127.0.0.1", port, keepalive=60)
+        ack_topic = b"car/%d/ack" % i
+
+        def on_cmd(topic, msg, car=car, ack_topic=ack_topic):
+            car.publish(ack_topic, msg, qos=1)
+
+        car.set_callback(on_cmd)
+        cars.append(car)
+
+    start = time.perf_counter()
+    for car in cars:
+        loop.add(car)
+    loop.run(until=lambda: all(car.connected for car in cars))
+    for i, car in enumerate(cars):
+        car.subscribe(b"car/%d/cmd" % i, 1)
+    loop.run(until=lambda: all(car.suback is not None for car in cars))
+    print(f"{args.cars} 个客户端连接并订阅: {time.perf_counter() - start:.2f}s（单线程）")
+
+    center = MQTTClient(b"center", "127.0.0.1", port)
+    center.set_callback(lambda topic, msg: acks.__setitem__(0, acks[0] + 1))
+    loop.add(center)
+    loop.run(until=lambda: center.connected)
+    center.subscribe(b"car/+/ack", 1)
+    loop.run(until=lambda: center.suback is not None)
+
+    total = args.cars * args.rounds
+    start = time.perf_counter()
+    payload = b'{"command-type": "task", "tasks": ["right", "straight", "end"], "path-id": 1}'
+    for _ in range(args.rounds):
+        for i in range(args.cars):
+            center.publish(b"car/%d/cmd" % i, payload, qos=1)
+        loop.poll(0)
+    loop.run(until=lambda: acks[0] >= total, timeout=0.5)
+    elapsed = time.perf_counter() - start
+    print(f"指令->回复: {acks[0]}/{total}，{acks[0] / elapsed:.0f} 往返/s，剩余在途 {sum(len(c.inflight) for c in cars)}")
+    loop.close()
+    broker.loop.call_soon_threadsafe(broker.close)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+小车指令编码基准：JSON 与 carcodec 二进制编码的报文大小、编码和解码耗时对比。
+
+用后端实际发送的 init / task / stop 指令和小车的回复测试，并校验二进制编码往返后与原字典一致。
+设备上 ujson 与 CPython json 的差距不同，这里的耗时只用于相对比较。
+
+用法（在仓库根目录）：
+    python bench/bench_codec.py --count 100000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import carcodec
+from path_catalog import PathCatalog
+
+ROUTE = list(PathCatalog().load().get(1).tasks)
+
+MESSAGES = [
+    ("init", {"command-type": "init", "cid": "1a2b"}),
+    ("task", {"command-type": "task", "tasks": ROUTE, "path-id": 1, "cid": "1a2c"}),
+    ("stop", {"command-type": "stop", "tasks": ["end"], "cid": "1a2d"}),
+    ("ack_init", {"command-type": "ack_init", "cid": "1a2b", "path-id": 2}),
+    ("ack_task", {"command-type": "ack_task", "tasks": ROUTE, "path-id": 1, "cid": "1a2c"}),
+    ("长任务", {"command-type": "task", "tasks": ["straight", "left", "right", "tiny_left", "tiny_right"] * 10 + ["end"],
+               "path-id": 3, "cid": "1a2e"}),
+]
+
+
+def timeit(func, arg, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        func(arg)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON 与二进制指令编码基准")
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{'指令':10s} {'JSON 字节':>9s} {'二进制':>6s} {'JSON 编码':>10s} {'二进制编码':>10s} {'JSON 解码':>10s} {'二进制解码':>10s}")
+    for name, message in MESSAGES:
+        text = json.dumps(message).encode()
+        binary = carcodec.encode(message)
+        assert binary is not None and carcodec.decode(binary) == message, name
+        json_encode = timeit(json.dumps, message, args.count)
+        binary_encode = timeit(carcodec.encode, message, args.count)
+        json_decode = timeit(json.loads, text, args.count)
+        binary_decode = timeit(carcodec.decode, binary, args.count)
+        print(
+            f"{name:10s} {len(text):9d} {len(binary):6d}"
+            f" {json_encode:8.2f}us {binary_encode:8.2f}us {json_decode:8.2f}us {binary_decode:8.2f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()
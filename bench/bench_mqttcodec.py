@@ -0,0 +1,139 @@
+"""
+mqttcodec 编解码热路径基准：每种操作每秒的次数。
+
+编码：PUBLISH（短负载写入可复用缓冲区 / 只写报文头）、SUBSCRIBE、CONNECT、确认报文，
+与原来逐字段拼接 bytes 的写法（broker.py 原来的 publish_packet）对比。
+解码：一段连续的 PUBLISH 字节流用 frame() + parse_publish() 在 memoryview 上切分，
+与逐字段复制 bytes 的写法对比。设备上的绝对耗时不同，这里只用于相对比较。
+
+CPython 上 frame() + parse_publish() 比原来内联的逐字段复制慢（每条多两次函数调用和一个元组，
+memoryview 切片也比短 bytes 切片贵）。mqttcodec 的解码和 publish() 是为 MicroPython 写的：
+在预分配的接收/发送缓冲区上工作，不为每个字段分配对象，设备上减少的是堆分配和 GC 停顿，
+这在 CPython 的计时里体现不出来。CPython 一侧的发送使用 publish_packet()（拼接），不慢于原写法。
+
+用法（在仓库根目录）：
+    python bench/bench_mqttcodec.py --count 200000
+"""
+import argparse
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mqttcodec
+
+TOPIC = b"car/0123456789ab/cmd"
+PAYLOAD = b'{"command-type": "task", "tasks": ["right", "straight", "right", "right", "right", "end"], "path-id": 1}'
+
+
+def concat_publish(topic, payload, qos=0, retain=False, pid=0):
+    # 原来的写法：每个字段生成一个 bytes 再拼接
+    size = 2 + len(topic) + len(payload) + (2 if qos else 0)
+    length = bytearray()
+    while True:
+        b = size & 0x7F
+        size >>= 7
+        if size:
+            length.append(b | 0x80)
+        else:
+            length.append(b)
+            break
+    var = struct.pack("!H", len(topic)) + topic
+    if qos:
+        var += struct.pack("!H", pid)
+    return bytes((0x30 | qos << 1 | retain,)) + bytes(length) + var + payload
+
+
+def concat_parse(stream):
+    # 原来的写法：逐字段切片复制
+    pos = 0
+    count = 0
+    end = len(stream)
+    while pos < end:
+        op = stream[pos]
+        n = 0
+        sh = 0
+        pos += 1
+        while True:
+            b = stream[pos]
+            pos += 1
+            n |= (b & 0x7F) << sh
+            if not b & 0x80:
+                break
+            sh += 7
+        body = stream[pos:pos + n]
+        topic_len = body[0] << 8 | body[1]
+        topic = body[2:2 + topic_len]
+        start = 2 + topic_len
+        if op & 6:
+            start += 2
+        msg = body[start:]
+        pos += n
+        count += len(topic) > 0 and len(msg) >= 0
+    return count
+
+
+def codec_parse(stream, view=True):
+    view = memoryview(stream) if view else stream
+    pos = 0
+    count = 0
+    end = len(stream)
+    frame = mqttcodec.frame
+    parse_publish = mqttcodec.parse_publish
+    while True:
+        header = frame(view, pos, end)
+        if header is None:
+            break
+        op, start, pos = header
+        topic, pid, msg = parse_publish(op, view[start:pos])
+        count += len(topic) > 0 and len(msg) >= 0
+    return count
+
+
+def rate(func, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="mqttcodec 编解码基准")
+    parser.add_argument("--count", type=int, default=200000)
+    args = parser.parse_args()
+    count = args.count
+
+    buf = bytearray(256)
+    big = b"x" * 5000
+    encoders = (
+        ("PUBLISH 拼接 bytes（原写法）", lambda: concat_publish(TOPIC, PAYLOAD, 1, False, 7)),
+        ("PUBLISH 写入复用缓冲区", lambda: mqttcodec.publish(buf, TOPIC, PAYLOAD, 1, False, 7)),
+        ("PUBLISH 5000 字节只写报文头", lambda: mqttcodec.publish(buf, TOPIC, big, 1, False, 7, inline=False)),
+        ("PUBLISH publish_packet()", lambda: mqttcodec.publish_packet(TOPIC, PAYLOAD, 1, False, 7)),
+        ("SUBSCRIBE", lambda: mqttcodec.subscribe(buf, 7, TOPIC, 1)),
+        ("CONNECT（遗嘱 + 用户名）", lambda: mqttcodec.connect(
+            buf, b"car-0123456789ab", False, 60, b"user", b"pass", TOPIC, b'{"command-type": "offline"}', 1, True)),
+        ("PUBACK", lambda: mqttcodec.ack(mqttcodec.PUBACK, 7)),
+    )
+    assert concat_publish(TOPIC, PAYLOAD, 1, False, 7) == mqttcodec.publish_packet(TOPIC, PAYLOAD, 1, False, 7)
+    print("编码")
+    for name, func in encoders:
+        print(f"  {name:28s} {rate(func, count):12.0f} 次/s")
+
+    packets = 1000
+    stream = b"".join(mqttcodec.publish_packet(TOPIC, PAYLOAD, i % 2, False, i % 2) for i in range(packets))
+    assert concat_parse(stream) == codec_parse(stream) == packets
+    rounds = max(1, count // packets)
+    print(f"解码（{packets} 条 PUBLISH 的字节流）")
+    for name, func in (
+        ("逐字段复制 bytes（原写法）", concat_parse),
+        ("frame + memoryview 切片", codec_parse),
+        ("frame + bytes 切片", lambda stream: codec_parse(stream, False)),
+    ):
+        print(f"  {name:28s} {rate(lambda: func(stream), rounds) * packets:12.0f} 条/s")
+
+
+if __name__ == "__main__":
+    main()
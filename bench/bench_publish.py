@@ -0,0 +1,135 @@
+"""
+MQTTClient 发送路径基准：逐字段多次 write（legacy/umqttsimple.py 中原来的实现）
+与整包组装后一次 write（micro_py.MQTTClient）对比。
+
+先校验两条路径对 CONNECT / SUBSCRIBE / PUBLISH（QoS 0/1，长短负载）产生完全相同的字节，
+再统计每条 PUBLISH 的 write 次数和每秒发布数。每次 write 都真实写入 /dev/null，
+用来近似设备上每次 write 一次系统调用（lwIP 上往往还是一个 TCP 分段）的开销。
+
+用法（在仓库根目录）：
+    python bench/bench_publish.py --count 100000
+"""
+import argparse
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import micro_py
+from legacy import umqttsimple
+
+
+class RecordingSocket:
+    """
+    记录写出的字节和 write 次数，按顺序回放预先准备的应答。
+    """
+
+    def __init__(self, responses=b"", record=True):
+        self.responses = bytearray(responses)
+        self.record = record
+        self.out = bytearray()
+        self.writes = 0
+        self.null = os.open(os.devnull, os.O_WRONLY)
+        # 应答都已在内存中，poll 时总是可读
+        self.readable, writable = os.pipe()
+        os.write(writable, b"\0")
+        os.close(writable)
+
+    def fileno(self):
+        return self.readable
+
+    def connect(self, addr):
+        pass
+
+    def write(self, buf, n=None):
+        if n is not None:
+            buf = memoryview(buf)[:n]
+        self.writes += 1
+        os.write(self.null, buf)
+        if self.record:
+            self.out += buf
+        return len(buf)
+
+    def read(self, n):
+        data = bytes(self.responses[:n])
+        del self.responses[:n]
+        return data
+
+    def readinto(self, buf, n=0):
+        n = min(n or len(buf), len(self.responses))
+        buf[:n] = self.responses[:n]
+        del self.responses[:n]
+        return n
+
+    def setblocking(self, flag):
+        pass
+
+    def close(self):
+        os.close(self.null)
+        os.close(self.readable)
+
+
+def fake_socket_module(sock):
+    return SimpleNamespace(socket=lambda: sock, getaddrinfo=lambda host, port: [(None, None, None, None, (host, port))])
+
+
+def session(module, responses):
+    """
+    用给定客户端模块完成 connect（带遗嘱和用户名）、subscribe 和若干 publish，返回写出的字节。
+    """
+    sock = RecordingSocket(responses)
+    saved = module.socket
+    module.socket = fake_socket_module(sock)
+    try:
+        client = module.MQTTClient(b"car-0123456789ab", "127.0.0.1", user=b"user", password=b"pass", keepalive=60)
+        client.set_last_will(b"car/0123456789ab/ack", b'{"command-type": "offline"}', retain=True, qos=1)
+        client.set_callback(lambda topic, msg: None)
+        client.connect(clean_session=False)
+        client.subscribe(b"car/0123456789ab/cmd", qos=1)
+        client.publish(b"car/0123456789ab/ack", b'{"command-type": "ack_init", "path-id": 1}')
+        client.publish(b"car/0123456789ab/ack", b"x" * 300, retain=True)
+        client.publish(b"car/0123456789ab/ack", b"y" * 5000)
+        client.publish(b"car/0123456789ab/ack", b'{"command-type": "ack_task"}', qos=1)
+    finally:
+        module.socket = saved
+    return bytes(sock.out)
+
+
+def check_identical():
+    # CONNACK；SUBACK(pid=1)；PUBACK(pid=2)
+    responses = b"\x20\x02\x00\x00" + b"\x90\x03\x00\x01\x01" + b"\x40\x02\x00\x02"
+    old = session(umqttsimple, responses)
+    new = session(micro_py, responses)
+    assert old == new, "两条发送路径产生的字节不同"
+    print(f"字节一致性校验通过（{len(new)} 字节）")
+
+
+def bench(module, count, payload):
+    client = module.MQTTClient(b"car-0123456789ab", "127.0.0.1")
+    client.sock = RecordingSocket(record=False)
+    topic = b"car/0123456789ab/ack"
+    start = time.perf_counter()
+    for _ in range(count):
+        client.publish(topic, payload)
+    elapsed = time.perf_counter() - start
+    writes = client.sock.writes / count
+    client.sock.close()
+    return count / elapsed, writes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MQTTClient 发送路径基准")
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+
+    check_identical()
+    payload = b'{"command-type": "ack_task", "tasks": ["right", "straight", "right", "end"], "path-id": 1}'
+    for name, module in (("逐字段 write（原实现）", umqttsimple), ("整包一次 write", micro_py)):
+        rate, writes = bench(module, args.count, payload)
+        print(f"{name:22s} {rate:10.0f} publish/s  每条 PUBLISH write {writes:4.1f} 次")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+MQTTClient.wait_msg 的接收路径基准：逐字段 read() 与预分配缓冲区 readinto() 对比。
+
+用内存中的假 socket 回放一批 PUBLISH 报文，统计每条消息的读调用次数（对应设备上的
+系统调用）和每秒处理的消息数，不需要网络和 Broker。
+
+用法（在仓库根目录）：
+    python bench/bench_wait_msg.py --count 50000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mqttcodec import publish_packet
+from micro_py import MQTTClient
+
+
+class ReplaySocket:
+    """
+    回放固定字节流的假 socket，每次调用最多返回 chunk 字节（模拟 TCP 分段）。
+    """
+
+    def __init__(self, data, chunk=1460):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.chunk = chunk
+        self.reads = 0
+
+    def read(self, n):
+        self.reads += 1
+        n = min(n, self.chunk)
+        out = bytes(self.data[self.pos:self.pos + n])
+        self.pos += len(out)
+        return out
+
+    def readinto(self, buf, n=0):
+        self.reads += 1
+        n = min(n or len(buf), self.chunk, len(self.data) - self.pos)
+        buf[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def write(self, buf, n=None):
+        return n or len(buf)
+
+    def setblocking(self, flag):
+        pass
+
+
+def run(stream, count, rx_buf_size, copy):
+    client = MQTTClient(b"bench", "127.0.0.1", rx_buf_size=rx_buf_size)
+    received = [0]
+
+    def cb(topic, msg):
+        received[0] += 1
+
+    client.set_callback(cb, copy=copy)
+    client.sock = ReplaySocket(stream)
+    start = time.perf_counter()
+    while received[0] < count:
+        client.wait_msg()
+    elapsed = time.perf_counter() - start
+    return count / elapsed, client.sock.reads / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="wait_msg 接收路径基准")
+    parser.add_argument("--count", type=int, default=50000)
+    args = parser.parse_args()
+
+    payload = b'{"command-type": "task", "tasks": ["right", "straight", "right", "right", "right", "end"], "path-id": 1}'
+    packet = publish_packet(b"car/0123456789ab/cmd", payload)
+    stream = packet * args.count
+
+    for name, rx_buf_size, copy in (
+        ("逐字段 read()", 0, False),
+        ("缓冲区 + bytes 副本", 1024, True),
+        ("缓冲区 + memoryview", 1024, False),
+    ):
+        rate, reads = run(stream, args.count, rx_buf_size, copy)
+        print(f"{name:20s} {rate:10.0f} msg/s  每条消息读调用 {reads:5.2f} 次")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+frontend_protocol.CommandReader 的分帧校验：各协议版本下合并、拆分到达的指令都能完整取出。
+
+校验内容：
+    1. 版本 0：一次 recv 中换行分隔的多条指令；末尾被截断的 UTF-8 字符整条留到下一次，不拆成两条指令
+    2. 版本 1：指令按字节逐个到达、多条指令合并到达
+    3. 版本 2：长度前缀跨 recv 拆分
+    4. proto:<版本> 协商后同一次 recv 中的剩余数据按新版本解析，无效版本抛出 ProtocolError
+    5. 随机把指令流切成任意长度的片段（包括切在多字节字符中间），各版本得到的指令与原指令一致
+
+用法（在仓库根目录）：
+    python bench/check_frontend_protocol.py --count 2000 --seed 1
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from frontend_protocol import (PROTOCOL_LEGACY, PROTOCOL_LENGTH, PROTOCOL_LINE, CommandReader,
+                               ProtocolError)
+
+COMMANDS = ("init", "task:2", "task:A->F", "stop", "task:中", "task:路口🚗", "log:é")
+
+
+def feed_all(reader, chunks):
+    commands = []
+    for chunk in chunks:
+        commands += reader.feed(chunk)
+    return commands
+
+
+def check_legacy():
+    reader = CommandReader()
+    assert reader.feed(b"init\ntask:2\nstop") == ["init", "task:2", "stop"]
+    for command in ("task:中", "task:路口🚗"):
+        data = command.encode()
+        for cut in range(1, len(data)):
+            reader = CommandReader()
+            got = feed_all(reader, (data[:cut], data[cut:]))
+            # 切在字符中间时整条留到下一次；切在字符边界时按旧协议拆成两条
+            text = data[:cut].decode("utf-8", "replace")
+            if "�" in text:
+                assert got == [command], (cut, got)
+            else:
+                assert got == [part for part in (text.strip(), data[cut:].decode().strip()) if part], (cut, got)
+
+
+def check_line():
+    reader = CommandReader(PROTOCOL_LINE)
+    data = "".join(command + "\n" for command in COMMANDS).encode()
+    assert feed_all(reader, (data[i:i + 1] for i in range(len(data)))) == list(COMMANDS)
+    assert reader.feed(data) == list(COMMANDS)
+    assert reader.feed(b"partial") == [] and reader.feed(b"\n") == ["partial"]
+
+
+def length_frame(command):
+    data = command.encode()
+    return bytes((len(data) >> 8, len(data) & 0xFF)) + data
+
+
+def check_length():
+    reader = CommandReader(PROTOCOL_LENGTH)
+    data = b"".join(length_frame(command) for command in COMMANDS)
+    assert feed_all(reader, (data[:1], data[1:5], data[5:])) == list(COMMANDS)
+
+
+def check_negotiate():
+    versions = []
+    reader = CommandReader(on_negotiate=versions.append)
+    assert reader.feed(b"proto:2\n" + length_frame("init") + length_frame("stop")) == ["init", "stop"]
+    assert versions == [PROTOCOL_LENGTH]
+    try:
+        CommandReader().feed(b"proto:9\n")
+    except ProtocolError:
+        pass
+    else:
+        raise AssertionError("无效协议版本没有抛出 ProtocolError")
+
+
+def check_random(rng):
+    commands = [rng.choice(COMMANDS) for _ in range(rng.randint(1, 10))]
+    version = rng.choice((PROTOCOL_LEGACY, PROTOCOL_LINE, PROTOCOL_LENGTH))
+    if version == PROTOCOL_LENGTH:
+        data = b"".join(length_frame(command) for command in commands)
+    else:
+        data = "".join(command + "\n" for command in commands).encode()
+    chunks = []
+    pos = 0
+    while pos < len(data):
+        step = rng.randint(1, 8)
+        chunks.append(data[pos:pos + step])
+        pos += step
+    if version == PROTOCOL_LEGACY:
+        # 旧协议把没有换行结尾的片段视为完整指令，只校验不会出现被截断字符产生的乱码
+        got = feed_all(CommandReader(version), chunks)
+        assert all("�" not in command for command in got), got
+        assert "".join(got) == "".join(commands), got
+    else:
+        assert feed_all(CommandReader(version), chunks) == commands
+
+
+def main():
+    parser = argparse.ArgumentParser(description="前端指令分帧校验")
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else random.randrange(1 << 30)
+    rng = random.Random(seed)
+    print(f"种子 {seed}")
+    for name, check in (
+        ("版本 0 截断的 UTF-8 字符", check_legacy),
+        ("版本 1 换行分帧", check_line),
+        ("版本 2 长度前缀", check_length),
+        ("协议协商", check_negotiate),
+    ):
+        check()
+        print(f"{name:24s} 通过")
+    for _ in range(args.count):
+        check_random(rng)
+    print(f"{'随机分段':24s} {args.count} 次通过")
+
+
+if __name__ == "__main__":
+    main()
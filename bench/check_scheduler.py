@@ -0,0 +1,108 @@
+"""
+scheduler.ReservationScheduler 的冲突校验：预约后任意两辆车不会同时占用同一个路口或同一条边。
+
+校验内容：
+    1. 相向行驶：car0 A->B->C->F 与 car1 C->B->A->D（晚 1.5 秒请求）不会同时在 A-B 或 B-C 上
+    2. 随机路线、随机请求时间的多辆车，两两之间路口和边（不分方向）的占用区间没有重叠
+    3. report_delay 后预约表中每辆车的时间片都仍归它自己，没有被其他车覆盖
+
+用法（在仓库根目录）：
+    python bench/check_scheduler.py --cars 20 --seed 1
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from planner import Plan, RoutePlanner, TrackMap
+from scheduler import ReservationScheduler
+
+TRACK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "track.json")
+
+
+def intervals(scheduler, plan, depart):
+    # 各路口和边的占用区间（绝对时间）；边的区间由前后两个路口推出，不依赖 timeline 中的边
+    spans = {}
+    previous = None
+    for key, enter, duration in scheduler.timeline(plan):
+        if not isinstance(key, str):
+            continue
+        if previous is not None:
+            spans[tuple(sorted((previous[0], key)))] = (previous[1], depart + enter)
+        spans[key] = (depart + enter, depart + enter + duration)
+        previous = (key, depart + enter + duration)
+    return spans
+
+
+def check_no_overlap(scheduler, booked):
+    cars = sorted(booked)
+    for i, a in enumerate(cars):
+        for b in cars[i + 1:]:
+            spans_a = intervals(scheduler, *booked[a])
+            spans_b = intervals(scheduler, *booked[b])
+            for key in spans_a.keys() & spans_b.keys():
+                (a0, a1), (b0, b1) = spans_a[key], spans_b[key]
+                assert a1 <= b0 or b1 <= a0, f"{a} 与 {b} 同时占用 {key}: {spans_a[key]} {spans_b[key]}"
+
+
+def check_head_on(track):
+    scheduler = ReservationScheduler(track)
+    plan0 = Plan("A", "F", None, ["A", "B", "C", "F"], ["straight", "left", "end"], 3.0)
+    plan1 = Plan("C", "D", None, ["C", "B", "A", "D"], ["straight", "right", "end"], 3.0)
+    depart0 = scheduler.schedule("car0", plan0)
+    depart1 = scheduler.schedule("car1", plan1, earliest=depart0 + 1.5)
+    assert depart0 is not None and depart1 is not None
+    check_no_overlap(scheduler, {"car0": (plan0, depart0), "car1": (plan1, depart1)})
+    print(f"相向行驶: car1 推迟到 car0 出发后 {depart1 - depart0:.2f} 秒")
+
+
+def check_random(track, cars, rng):
+    planner = RoutePlanner(track)
+    scheduler = ReservationScheduler(track, max_wait=600.0)
+    nodes = sorted(track.nodes)
+    now = time.monotonic()
+    booked = {}
+    for i in range(cars):
+        start, goal = rng.sample(nodes, 2)
+        plan = planner.plan(start, goal)
+        if plan is None:
+            continue
+        car_id = f"car{i}"
+        depart = scheduler.schedule(car_id, plan, earliest=now + rng.uniform(0, 10))
+        assert depart is not None, f"{car_id} 没有可用的出发时间"
+        booked[car_id] = (plan, depart)
+    check_no_overlap(scheduler, booked)
+    print(f"随机路线: {len(booked)} 辆车，{scheduler.stats()}")
+    return scheduler
+
+
+def check_delay(scheduler, rng):
+    car_id = rng.choice(sorted(scheduler.bookings))
+    moved, conflicts = scheduler.report_delay(car_id, rng.uniform(0.5, 5))
+    for booking in scheduler.bookings.values():
+        for key, s in booking.slots:
+            owner = scheduler.table.get(key, {}).get(s)
+            assert owner == booking.car_id, f"{booking.car_id} 的时间片 {key}@{s} 被 {owner} 占用"
+    print(f"延误: {car_id} 重新调度 {len(moved)} 辆，冲突 {len(conflicts)} 辆")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--track", default=TRACK)
+    parser.add_argument("--cars", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    track = TrackMap.load(args.track)
+    check_head_on(track)
+    scheduler = check_random(track, args.cars, rng)
+    check_delay(scheduler, rng)
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
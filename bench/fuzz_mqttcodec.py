@@ -0,0 +1,267 @@
+"""
+mqttcodec 的随机性质校验：与原来的客户端实现（legacy/umqttsimple.py）对照，并用随机报文和随机字节测试解码。
+
+校验内容：
+    1. 随机参数的 CONNECT / SUBSCRIBE / PUBLISH（QoS 0/1，短负载和跨越剩余长度字节数边界的长负载），
+       mqttcodec 编码的字节与 umqttsimple 逐字段 write 的字节完全一致
+    2. mqttcodec 编码的 PUBLISH 交给 umqttsimple.wait_msg 解析，回调收到的主题和负载与原值一致
+    3. 随机报文拼接成字节流后按随机长度分段到达，frame() 增量切分、parse_*() 解析得到的字段与编码前一致
+    4. 剩余长度在各字节数边界上的编码往返、len_size 与实际字节数一致
+    5. 随机字节和随机截断的报文：frame() / parse_*() 只会返回结果或抛出 MQTTCodecError
+
+用法（在仓库根目录）：
+    python bench/fuzz_mqttcodec.py --count 2000 --seed 1
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mqttcodec
+from bench_publish import RecordingSocket, fake_socket_module
+from legacy import umqttsimple
+
+LENGTH_EDGES = (0, 1, 127, 128, 16383, 16384, 2097151)
+
+
+def rand_bytes(rng, low=0, high=40):
+    return bytes(rng.getrandbits(8) for _ in range(rng.randint(low, high)))
+
+
+def rand_payload(rng):
+    # 大多数是短负载，少数长度落在剩余长度字节数的边界附近
+    if rng.random() < 0.1:
+        return bytes(max(0, rng.choice(LENGTH_EDGES[1:6]) + rng.randint(-3, 3)))
+    return rand_bytes(rng, 0, 200)
+
+
+def legacy_bytes(responses, action):
+    """
+    用 umqttsimple 执行 action(client)，返回写出的字节。
+    """
+    sock = RecordingSocket(responses)
+    saved = umqttsimple.socket
+    umqttsimple.socket = fake_socket_module(sock)
+    try:
+        client = umqttsimple.MQTTClient(b"", "127.0.0.1")
+        client.set_callback(lambda topic, msg: None)
+        client.sock = sock
+        action(client)
+    finally:
+        umqttsimple.socket = saved
+        sock.close()
+    return bytes(sock.out)
+
+
+def check_connect(rng):
+    client_id = rand_bytes(rng, 0, 30)
+    clean = rng.random() < 0.5
+    keepalive = rng.choice((0, 30, 60, 65535, rng.randint(0, 65535)))
+    user = password = None
+    if rng.random() < 0.5:
+        user, password = rand_bytes(rng), rand_bytes(rng)
+    will = None
+    if rng.random() < 0.5:
+        will = (rand_bytes(rng, 1), rand_payload(rng), rng.randint(0, 2), rng.random() < 0.5)
+
+    def action(client):
+        client.client_id = client_id
+        client.keepalive = keepalive
+        client.user, client.pswd = user, password
+        if will:
+            topic, msg, qos, retain = will
+            client.set_last_will(topic, msg, retain=retain, qos=qos)
+        client.connect(clean)
+
+    expected = legacy_bytes(b"\x20\x02\x00\x00", action)
+    args = will or (None, None, 0, False)
+    buf, n = mqttcodec.connect(None, client_id, clean, keepalive, user, password, *args)
+    assert bytes(buf[:n]) == expected, "CONNECT 与 umqttsimple 不一致"
+    op, start, end = mqttcodec.frame(buf, 0, n)
+    level, flags, ka, cid, will_topic, will_msg, u, p = mqttcodec.parse_connect(memoryview(buf)[start:end])
+    assert (op, level, ka, bytes(cid)) == (mqttcodec.CONNECT, 4, keepalive, client_id)
+    assert bool(flags & 0x02) == clean
+    assert (u is None) == (user is None) and (user is None or (bytes(u), bytes(p)) == (user, password))
+    assert (will_topic is None) == (will is None)
+    if will:
+        assert (bytes(will_topic), bytes(will_msg), flags >> 3 & 3, bool(flags & 0x20)) == will
+
+
+def check_subscribe(rng):
+    topic = rand_bytes(rng, 1, 60)
+    qos = rng.randint(0, 2)
+    pid = rng.randint(1, 65534)
+
+    def action(client):
+        client.pid = pid - 1
+        client.subscribe(topic, qos)
+
+    expected = legacy_bytes(bytes((0x90, 3, pid >> 8, pid & 0xFF, qos)), action)
+    buf, n = mqttcodec.subscribe(None, pid, topic, qos)
+    assert bytes(buf[:n]) == expected, "SUBSCRIBE 与 umqttsimple 不一致"
+    op, start, end = mqttcodec.frame(buf, 0, n)
+    got_pid, topics = mqttcodec.parse_subscribe(buf[start:end])
+    assert op == 0x82 and got_pid == pid and [(bytes(t), q) for t, q in topics] == [(topic, qos)]
+
+
+def check_publish(rng):
+    topic = rand_bytes(rng, 1, 60)
+    msg = rand_payload(rng)
+    qos = rng.randint(0, 1)
+    retain = rng.random() < 0.5
+    pid = rng.randint(1, 65534)
+
+    def action(client):
+        client.pid = pid - 1
+        client.publish(topic, msg, retain, qos)
+
+    expected = legacy_bytes(bytes((0x40, 2, pid >> 8, pid & 0xFF)), action)
+    buf, n = mqttcodec.publish(None, topic, msg, qos, retain, pid if qos else 0)
+    assert bytes(buf[:n]) == expected, "PUBLISH 与 umqttsimple 不一致"
+    # 大负载不复制：报文头 + 单独发送的负载与整包相同
+    head, m = mqttcodec.publish(None, topic, msg, qos, retain, pid if qos else 0, inline=False)
+    assert bytes(head[:m]) + msg == expected
+
+    # umqttsimple 作为接收方解析 mqttcodec 编码的报文（QoS 0，不需要回复）
+    packet = mqttcodec.publish_packet(topic, msg, 0, retain)
+    received = []
+    sock = RecordingSocket(packet)
+    client = umqttsimple.MQTTClient(b"", "127.0.0.1")
+    client.set_callback(lambda t, m: received.append((t, m)))
+    client.sock = sock
+    client.wait_msg()
+    sock.close()
+    assert received == [(topic, msg)], "umqttsimple 解析 mqttcodec 的 PUBLISH 结果不同"
+
+
+def random_packet(rng):
+    """
+    返回 (报文字节, 期望的解析结果)。
+    """
+    kind = rng.randrange(5)
+    pid = rng.randint(1, 65535)
+    if kind == 0:
+        topic, msg, qos = rand_bytes(rng, 1), rand_payload(rng), rng.randint(0, 2)
+        buf, n = mqttcodec.publish(None, topic, msg, qos, rng.random() < 0.5, pid if qos else 0, rng.random() < 0.5)
+        return bytes(buf[:n]), ("publish", topic, pid if qos else 0, msg)
+    if kind == 1:
+        op = rng.choice((0x40, 0x50, 0x62, 0x70, 0xB0))
+        return mqttcodec.ack(op, pid), ("ack", op, pid)
+    if kind == 2:
+        topic = rand_bytes(rng, 1)
+        buf, n = mqttcodec.unsubscribe(None, pid, topic)
+        return bytes(buf[:n]), ("unsubscribe", pid, topic)
+    if kind == 3:
+        granted = bytes(rng.randint(0, 2) for _ in range(rng.randint(1, 5)))
+        return mqttcodec.suback(pid, granted), ("suback", pid, granted)
+    return mqttcodec.PINGRESP_PACKET, ("ping",)
+
+
+def parse(op, body):
+    kind = op & 0xF0
+    if kind == mqttcodec.PUBLISH:
+        topic, pid, msg = mqttcodec.parse_publish(op, body)
+        return ("publish", bytes(topic), pid, bytes(msg))
+    if kind in (0x40, 0x50, 0x60, 0x70, 0xB0):
+        return ("ack", op, mqttcodec.parse_ack(body))
+    if kind == mqttcodec.UNSUBSCRIBE:
+        pid, topics = mqttcodec.parse_unsubscribe(body)
+        return ("unsubscribe", pid, bytes(topics[0]))
+    if kind == mqttcodec.SUBACK:
+        pid, granted = mqttcodec.parse_suback(body)
+        return ("suback", pid, bytes(granted))
+    return ("ping",)
+
+
+def check_stream(rng):
+    packets = [random_packet(rng) for _ in range(rng.randint(1, 20))]
+    stream = b"".join(data for data, _ in packets)
+    # 模拟按随机长度分段到达的 TCP 数据，接收缓冲区只在数据不够时追加
+    rx = bytearray()
+    pos = 0
+    got = []
+    fed = 0
+    while fed < len(stream) or pos < len(rx):
+        step = rng.choice((1, 2, 3, 7, 64, 1460))
+        rx += stream[fed:fed + step]
+        fed += step
+        view = memoryview(rx)
+        while True:
+            header = mqttcodec.frame(view, pos, len(rx))
+            if header is None:
+                break
+            op, start, end = header
+            got.append(parse(op, view[start:end]))
+            pos = end
+        view.release()
+        if fed >= len(stream) and mqttcodec.frame(rx, pos, len(rx)) is None:
+            break
+    assert pos == len(stream), "字节流没有完整切分"
+    assert got == [expected for _, expected in packets], "增量解码结果与编码前不同"
+
+
+def check_lengths():
+    for edge in LENGTH_EDGES + (268435455,):
+        for n in (edge - 1, edge, edge + 1):
+            if not 0 <= n <= mqttcodec.MAX_LENGTH:
+                continue
+            field = mqttcodec.encode_length(n)
+            assert len(field) == mqttcodec.len_size(n)
+            assert mqttcodec.get_len(field, 0, len(field)) == (n, len(field))
+            assert mqttcodec.get_len(field, 0, len(field) - 1) is None
+            chunks = iter(bytes((b,)) for b in field)
+            assert mqttcodec.read_len(lambda size: next(chunks)) == n
+
+
+def check_garbage(rng):
+    data = rand_bytes(rng, 0, 64)
+    if rng.random() < 0.5:
+        packet, _ = random_packet(rng)
+        data = packet[:rng.randint(0, len(packet))] + data[:rng.randint(0, 4)]
+    try:
+        header = mqttcodec.frame(data, 0, len(data))
+    except mqttcodec.MQTTCodecError:
+        return
+    body = memoryview(data)[2:] if header is None else memoryview(data)[header[1]:header[2]]
+    op = data[0] if data else 0x30
+    for func in (
+        lambda: mqttcodec.parse_publish(op, body),
+        lambda: mqttcodec.parse_ack(body),
+        lambda: mqttcodec.parse_connack(body),
+        lambda: mqttcodec.parse_suback(body),
+        lambda: mqttcodec.parse_subscribe(body),
+        lambda: mqttcodec.parse_unsubscribe(body),
+        lambda: mqttcodec.parse_connect(body),
+    ):
+        try:
+            func()
+        except mqttcodec.MQTTCodecError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="mqttcodec 随机性质校验")
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else random.randrange(1 << 30)
+    rng = random.Random(seed)
+    print(f"种子 {seed}")
+    check_lengths()
+    for name, check in (
+        ("CONNECT 与原实现一致", check_connect),
+        ("SUBSCRIBE 与原实现一致", check_subscribe),
+        ("PUBLISH 与原实现一致", check_publish),
+        ("分段字节流增量解码", check_stream),
+        ("随机字节只抛出 MQTTCodecError", check_garbage),
+    ):
+        for _ in range(args.count):
+            check(rng)
+        print(f"{name:28s} {args.count} 次通过")
+
+
+if __name__ == "__main__":
+    main()
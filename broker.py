@@ -0,0 +1,470 @@
+"""
+内嵌的 MQTT 3.1.1 Broker（asyncio 实现），用于本地开发、测试和性能基准。
+
+支持：CONNECT/CONNACK、SUBSCRIBE/UNSUBSCRIBE（+ / # 通配符）、QoS 0/1/2、
+保留消息、遗嘱消息、keepalive 超时断开、clean_session=False 的持久会话
+（保存订阅、离线 QoS>0 消息，重连后重发未确认的消息）。
+
+用法：
+    python broker.py --port 1883
+或在其他程序中：
+    broker, thread = run_in_thread("127.0.0.1", 0)
+"""
+import argparse
+import asyncio
+import threading
+from collections import deque
+
+import mqttcodec
+from mqttcodec import (
+    CONNECT, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP, SUBSCRIBE, UNSUBSCRIBE, PINGREQ, DISCONNECT,
+    PINGRESP_PACKET, publish_packet,
+)
+
+MAX_OFFLINE_MESSAGES = 1000           # 每个离线持久会话最多缓存的 QoS>0 消息数
+MAX_WRITE_BUFFER = 8 * 1024 * 1024    # 订阅者发送缓冲超过该值时丢弃 QoS 0 消息
+
+
+def topic_matches(pattern, topic):
+    """
+    判断主题是否匹配订阅（支持 + 和 # 通配符）。
+    """
+    if pattern == topic:
+        return True
+    p_parts = pattern.split("/")
+    t_parts = topic.split("/")
+    if t_parts[0].startswith("$") and p_parts[0] in ("+", "#"):
+        return False
+    for i, p in enumerate(p_parts):
+        if p == "#":
+            return True
+        if i >= len(t_parts):
+            return False
+        if p != "+" and p != t_parts[i]:
+            return False
+    return len(p_parts) == len(t_parts)
+
+
+class _Node:
+    __slots__ = ("children", "subscribers")
+
+    def __init__(self):
+        self.children = {}
+        self.subscribers = {}   # Session -> QoS
+
+
+class SubscriptionTree:
+    """
+    按主题层级组织的订阅树，匹配一条主题的开销只与主题层数和通配符分支有关，
+    与订阅总数无关。
+    """
+
+    def __init__(self):
+        self.root = _Node()
+
+    def add(self, pattern, session, qos):
+        node = self.root
+        for level in pattern.split("/"):
+            child = node.children.get(level)
+            if child is None:
+                child = node.children[level] = _Node()
+            node = child
+        node.subscribers[session] = qos
+
+    def remove(self, pattern, session):
+        path = []
+        node = self.root
+        for level in pattern.split("/"):
+            child = node.children.get(level)
+            if child is None:
+                return
+            path.append((node, level))
+            node = child
+        node.subscribers.pop(session, None)
+        # 清理空节点
+        while path and not node.subscribers and not node.children:
+            parent, level = path.pop()
+            del parent.children[level]
+            node = parent
+
+    def match(self, topic):
+        """
+        返回 {Session: 最大授权 QoS}。
+        """
+        result = {}
+        levels = topic.split("/")
+        self._match(self.root, levels, 0, result, topic.startswith("$"))
+        return result
+
+    def _match(self, node, levels, i, result, system):
+        if i == len(levels):
+            self._merge(node.subscribers, result)
+            hash_node = node.children.get("#")
+            if hash_node is not None:
+                self._merge(hash_node.subscribers, result)
+            return
+        wildcard = not (system and i == 0)
+        if wildcard:
+            hash_node = node.children.get("#")
+            if hash_node is not None:
+                self._merge(hash_node.subscribers, result)
+            plus_node = node.children.get("+")
+            if plus_node is not None:
+                self._match(plus_node, levels, i + 1, result, system)
+        child = node.children.get(levels[i])
+        if child is not None:
+            self._match(child, levels, i + 1, result, system)
+
+    @staticmethod
+    def _merge(subscribers, result):
+        for session, qos in subscribers.items():
+            if result.get(session, -1) < qos:
+                result[session] = qos
+
+
+class Session:
+    """
+    一个客户端会话。clean_session=False 时连接断开后会话保留。
+    """
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.clean = True
+        self.writer = None
+        self.subscriptions = {}     # 订阅主题 -> QoS
+        self.pid = 0
+        self.inflight = {}          # 发出的 QoS>0 报文 pid -> 报文（等待 PUBACK/PUBREC/PUBCOMP）
+        self.inbound_qos2 = set()   # 收到但尚未 PUBREL 的 QoS 2 报文 pid
+        self.offline = deque(maxlen=MAX_OFFLINE_MESSAGES)
+        self.will = None            # (topic, payload, qos, retain)
+        self.dropped = 0
+
+    def next_pid(self):
+        while True:
+            self.pid = self.pid % 65535 + 1
+            if self.pid not in self.inflight:
+                return self.pid
+
+    def send(self, data):
+        writer = self.writer
+        if writer is None or writer.is_closing():
+            return False
+        writer.write(data)
+        return True
+
+
+class Broker:
+    def __init__(self, host="127.0.0.1", port=1883):
+        self.host = host
+        self.port = port
+        self.server = None
+        self.loop = None
+        self.sessions = {}
+        self.subscriptions = SubscriptionTree()
+        self.retained = {}          # 主题 -> (payload, qos)
+        self.auto_id = 0
+        # 统计信息
+        self.connections = 0
+        self.received = 0
+        self.delivered = 0
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.server
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        for session in self.sessions.values():
+            if session.writer is not None:
+                session.writer.close()
+
+    # ---------------------------------------------------------------- 连接处理
+    async def _handle_client(self, reader, writer):
+        session = None
+        clean_exit = False
+        watchdog = None
+        try:
+            first = await reader.readexactly(1)
+            if first[0] & 0xF0 != CONNECT:
+                return
+            body = await reader.readexactly(await self._read_length(reader))
+            session, keepalive = self._connect(body, writer)
+            if session is None:
+                return
+            self.connections += 1
+
+            # keepalive：1.5 倍时间内没有收到任何报文则断开
+            last_seen = [self.loop.time()]
+            if keepalive:
+                def check():
+                    nonlocal watchdog
+                    idle = self.loop.time() - last_seen[0]
+                    if idle > keepalive * 1.5:
+                        writer.close()
+                    else:
+                        watchdog = self.loop.call_later(keepalive * 1.5 - idle, check)
+                watchdog = self.loop.call_later(keepalive * 1.5, check)
+
+            while True:
+                header = await reader.readexactly(1)
+                length = await self._read_length(reader)
+                body = await reader.readexactly(length) if length else b""
+                last_seen[0] = self.loop.time()
+                packet_type = header[0] & 0xF0
+                if packet_type == PUBLISH:
+                    self._on_publish(session, header[0], body)
+                elif packet_type == PUBACK or packet_type == PUBCOMP:
+                    session.inflight.pop(mqttcodec.parse_ack(body), None)
+                elif packet_type == PUBREC:
+                    pid = mqttcodec.parse_ack(body)
+                    rel = mqttcodec.ack(PUBREL | 0x02, pid)
+                    session.inflight[pid] = rel
+                    session.send(rel)
+                elif packet_type == PUBREL:
+                    pid = mqttcodec.parse_ack(body)
+                    session.inbound_qos2.discard(pid)
+                    session.send(mqttcodec.ack(PUBCOMP, pid))
+                elif packet_type == SUBSCRIBE:
+                    self._on_subscribe(session, body)
+                elif packet_type == UNSUBSCRIBE:
+                    self._on_unsubscribe(session, body)
+                elif packet_type == PINGREQ:
+                    session.send(PINGRESP_PACKET)
+                elif packet_type == DISCONNECT:
+                    clean_exit = True
+                    return
+                else:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError, IndexError, ValueError):
+            pass
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            writer.close()
+            if session is not None and session.writer is writer:
+                self._disconnect(session, clean_exit)
+
+    @staticmethod
+    async def _read_length(reader):
+        # 剩余长度最多 4 字节，逐字节读到最高位为 0 为止
+        field = bytearray()
+        while True:
+            field += await reader.readexactly(1)
+            got = mqttcodec.get_len(field, 0, len(field))
+            if got is not None:
+                return got[0]
+
+    def _connect(self, body, writer):
+        level, flags, keepalive, client_id, will_topic, will_msg, _, _ = mqttcodec.parse_connect(body)
+        if level not in (3, 4):
+            writer.write(mqttcodec.connack(False, 1))     # 不支持的协议版本
+            return None, 0
+        client_id = bytes(client_id).decode()
+        clean = bool(flags & 0x02)
+        if not client_id:
+            if not clean:
+                writer.write(mqttcodec.connack(False, 2))  # 空 client_id 必须 clean_session
+                return None, 0
+            self.auto_id += 1
+            client_id = f"auto-{self.auto_id}"
+        will = None
+        if will_topic is not None:
+            will = (bytes(will_topic).decode(), bytes(will_msg), (flags >> 3) & 0x03, bool(flags & 0x20))
+
+        session = self.sessions.get(client_id)
+        if session is not None and session.writer is not None:
+            # 同一 client_id 再次连接，断开旧连接
+            session.writer.close()
+            session.writer = None
+        if session is not None and clean:
+            self._drop_session(session)
+            session = None
+        present = session is not None
+        if session is None:
+            session = self.sessions[client_id] = Session(client_id)
+        session.clean = clean
+        session.will = will
+        session.writer = writer
+        writer.write(mqttcodec.connack(present))
+
+        if present:
+            # 恢复会话：先重发未确认的报文（置 DUP），再发送离线期间的消息
+            for pid, packet in list(session.inflight.items()):
+                if packet[0] & 0xF0 == PUBLISH:
+                    packet = bytes((packet[0] | 0x08,)) + packet[1:]
+                session.send(packet)
+            while session.offline:
+                topic, payload, qos, retain = session.offline.popleft()
+                self._send_publish(session, topic, payload, qos, retain)
+        return session, keepalive
+
+    def _disconnect(self, session, clean_exit):
+        session.writer = None
+        will = session.will
+        session.will = None
+        if will is not None and not clean_exit:
+            topic, payload, qos, retain = will
+            self.publish(topic, payload, qos, retain)
+        if session.clean:
+            self._drop_session(session)
+
+    def _drop_session(self, session):
+        for pattern in session.subscriptions:
+            self.subscriptions.remove(pattern, session)
+        if self.sessions.get(session.client_id) is session:
+            del self.sessions[session.client_id]
+
+    # ---------------------------------------------------------------- 报文处理
+    def _on_publish(self, session, header, body):
+        qos = (header >> 1) & 0x03
+        retain = bool(header & 0x01)
+        topic, pid, payload = mqttcodec.parse_publish(header, body)
+        topic = topic.decode()
+        self.received += 1
+        if qos == 1:
+            session.send(mqttcodec.ack(PUBACK, pid))
+        elif qos == 2:
+            session.send(mqttcodec.ack(PUBREC, pid))
+            if pid in session.inbound_qos2:
+                return          # 重发的 QoS 2 报文只投递一次
+            session.inbound_qos2.add(pid)
+        self.publish(topic, payload, qos, retain)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """
+        把一条消息投递给所有匹配的订阅者（也可以由 Broker 所在进程直接调用）。
+        """
+        if retain:
+            if payload:
+                self.retained[topic] = (payload, qos)
+            else:
+                self.retained.pop(topic, None)
+        matches = self.subscriptions.match(topic)
+        if not matches:
+            return
+        topic_bytes = topic.encode()
+        qos0_packet = None
+        for session, granted in matches.items():
+            effective = min(qos, granted)
+            if effective == 0:
+                # QoS 0 报文对所有订阅者都相同，只组装一次
+                if qos0_packet is None:
+                    qos0_packet = publish_packet(topic_bytes, payload)
+                writer = session.writer
+                if writer is None or writer.is_closing():
+                    continue
+                if writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+                    session.dropped += 1
+                    continue
+                writer.write(qos0_packet)
+                self.delivered += 1
+            elif session.writer is None:
+                session.offline.append((topic_bytes, payload, effective, False))
+            else:
+                self._send_publish(session, topic_bytes, payload, effective, False)
+
+    def _send_publish(self, session, topic, payload, qos, retain):
+        pid = session.next_pid() if qos else 0
+        packet = publish_packet(topic, payload, qos, retain, pid)
+        if qos:
+            session.inflight[pid] = packet
+        if session.send(packet):
+            self.delivered += 1
+
+    def _on_subscribe(self, session, body):
+        pid, topics = mqttcodec.parse_subscribe(body)
+        granted = bytearray()
+        patterns = []
+        for pattern, qos in topics:
+            pattern = pattern.decode()
+            qos = min(qos, 2)
+            session.subscriptions[pattern] = qos
+            self.subscriptions.add(pattern, session, qos)
+            granted.append(qos)
+            patterns.append((pattern, qos))
+        session.send(mqttcodec.suback(pid, granted))
+        # 发送匹配的保留消息
+        for pattern, qos in patterns:
+            for topic, (payload, msg_qos) in list(self.retained.items()):
+                if topic_matches(pattern, topic):
+                    self._send_publish(session, topic.encode(), payload, min(qos, msg_qos), True)
+
+    def _on_unsubscribe(self, session, body):
+        pid, topics = mqttcodec.parse_unsubscribe(body)
+        for pattern in topics:
+            pattern = pattern.decode()
+            session.subscriptions.pop(pattern, None)
+            self.subscriptions.remove(pattern, session)
+        session.send(mqttcodec.ack(mqttcodec.UNSUBACK, pid))
+
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "online": sum(1 for s in self.sessions.values() if s.writer is not None),
+            "connections": self.connections,
+            "received": self.received,
+            "delivered": self.delivered,
+            "retained": len(self.retained),
+        }
+
+
+def run_in_thread(host="127.0.0.1", port=1883):
+    """
+    在后台线程中启动 Broker，返回 (broker, thread)。port 为 0 时使用随机端口，
+    实际端口见 broker.port。启动失败（例如端口已被占用）时在调用线程中抛出原来的异常。
+    """
+    broker = Broker(host, port)
+    started = threading.Event()
+    errors = []
+
+    async def serve():
+        await broker.start()
+        started.set()
+        await broker.serve_forever()
+
+    def target():
+        try:
+            asyncio.run(serve())
+        except asyncio.CancelledError:
+            pass
+        except BaseException as e:
+            errors.append(e)
+            if started.is_set():
+                raise
+        finally:
+            started.set()
+
+    thread = threading.Thread(target=target, name="mqtt-broker", daemon=True)
+    thread.start()
+    started.wait()
+    if errors:
+        thread.join()
+        raise errors[0]
+    return broker, thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="内嵌 MQTT 3.1.1 Broker")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+
+    broker = Broker(args.host, args.port)
+    print(f"MQTT Broker 已启动，监听地址: {args.host}:{args.port}")
+    try:
+        asyncio.run(broker.serve_forever())
+    except KeyboardInterrupt:
+        print("Broker 已停止")
+
+
+if __name__ == "__main__":
+    main()
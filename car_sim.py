@@ -0,0 +1,375 @@
+"""
+巡线小车的运动学仿真：在电脑上用虚拟时钟运行 legacy/main.py 的控制逻辑，不需要实车。
+
+legacy/main.py 的源码不做修改，执行时把 machine / ST_VL6180 / time 等模块换成仿真实现：
+    Pin(输入)   五个巡线传感器，按传感器位置是否压在赛道黑线上返回 0/1
+    PWM.duty() 四个电机的占空比，左右两侧轮速差决定转向（差速运动学）
+    Sensor     测距传感器，返回到最近障碍物的距离（毫米）
+    time       虚拟时钟，sleep() 只推进仿真时间并积分小车位姿，因此运行速度远快于实时
+赛道由 planner.TrackMap 的路口坐标生成，每条边是一条黑线，路口处的交叉线触发 cross()。
+
+参数扫描：把 main.py 中某个函数里的 time.sleep 时长或 duty 占空比（按比例）替换成候选值，
+各组参数在多个进程中并行仿真，输出是否走完路线、用时和最大偏离距离。
+
+用法：
+    python car_sim.py --route "A/90->F"
+    python car_sim.py --route "A/90->F" --sweep turn_left.sleep=0.55,0.65,0.75 --sweep turn_right.scale=0.9,1.0 --workers 4
+    python car_sim.py --check        # 自检：CHECK_ROUTES 中的路线都应走完，否则返回非零
+"""
+import argparse
+import ast
+import builtins
+import itertools
+import math
+import os
+import sys
+import types
+from multiprocessing import Pool
+
+from planner import TrackMap, RoutePlanner
+
+PROGRAM = os.path.join(os.path.dirname(os.path.abspath(__file__)), "legacy", "main.py")
+
+# 引脚编号（与 legacy/main.py 一致）
+SENSOR_PINS = {32: -2, 34: -1, 35: 0, 12: 1, 13: 2}   # 巡线传感器 -> 位置序号（负数在左）
+LEFT_WHEELS = (25, 18)     # BAIN2 / FBIN2
+RIGHT_WHEELS = (26, 4)     # BBIN2 / FAIN2
+MAX_DUTY = 1023
+
+# 自检路线：带初始方向驶入起点，以及停在起点上出发（后端 task:A->F 的形式）
+CHECK_ROUTES = ("A/90->F", "A->C", "A->F")
+
+DEFAULTS = {
+    "scale": 0.6,           # 地图长度单位对应的米数
+    "vmax": 0.5,            # 占空比满时的轮速（米/秒）
+    "width": 0.2,           # 左右轮距（米）
+    "line": 0.0125,         # 黑线半宽（米）
+    "inner": 0.02,          # l2 / r2 传感器到中心的距离（米）
+    "outer": 0.045,         # l1 / r1 传感器到中心的距离（米）
+    "ahead": 0.08,          # 传感器阵列在车轴前方的距离（米）
+    "lead_in": 0.3,         # 起点前的引导线长度（米）
+    "lost": 0.15,           # 偏离黑线超过该距离视为脱线（米）
+    "max_time": 120.0,      # 仿真时间上限（秒）
+    "dt": 0.005,            # 运动学积分步长（秒）
+}
+
+
+class SimStop(Exception):
+    pass
+
+
+class SimCar:
+    """
+    小车状态和赛道。位姿 (x, y, heading)，heading 为罗盘角度（弧度，0 北，顺时针为正）。
+    """
+
+    def __init__(self, segments, pose, nodes, params):
+        self.segments = segments
+        self.x, self.y, self.heading = pose
+        self.nodes = nodes              # 路口名 -> (x, y)，用于记录经过的路口
+        self.p = params
+        self.t = 0.0
+        self.duty = {}
+        self.visited = []
+        self.max_offset = 0.0
+        self.led = 0
+
+    # 传感器
+    def offset(self, x, y):
+        best = math.inf
+        for ax, ay, bx, by in self.segments:
+            dx, dy = bx - ax, by - ay
+            k = max(0.0, min(1.0, ((x - ax) * dx + (y - ay) * dy) / (dx * dx + dy * dy)))
+            best = min(best, math.hypot(x - ax - k * dx, y - ay - k * dy))
+        return best
+
+    def sensor(self, pin):
+        slot = SENSOR_PINS[pin]
+        lateral = 0 if slot == 0 else math.copysign(self.p["inner"] if abs(slot) == 1 else self.p["outer"], slot)
+        sin, cos = math.sin(self.heading), math.cos(self.heading)
+        x = self.x + self.p["ahead"] * sin + lateral * cos
+        y = self.y + self.p["ahead"] * cos - lateral * sin
+        return int(self.offset(x, y) <= self.p["line"])
+
+    def range(self):
+        return 255
+
+    # 运动学
+    def wheel(self, pins):
+        return sum(self.duty.get(pin, 0) for pin in pins) / len(pins) / MAX_DUTY * self.p["vmax"]
+
+    def advance(self, seconds):
+        p = self.p
+        vl = self.wheel(LEFT_WHEELS)
+        vr = self.wheel(RIGHT_WHEELS)
+        v = (vl + vr) / 2
+        omega = (vl - vr) / p["width"]
+        remaining = seconds
+        while remaining > 1e-12:
+            dt = min(p["dt"], remaining)
+            self.heading += omega * dt
+            self.x += v * math.sin(self.heading) * dt
+            self.y += v * math.cos(self.heading) * dt
+            remaining -= dt
+        self.t += seconds
+        for name, (nx, ny) in self.nodes.items():
+            if math.hypot(self.x - nx, self.y - ny) < 0.1 and (not self.visited or self.visited[-1] != name):
+                self.visited.append(name)
+        offset = self.offset(self.x, self.y)
+        self.max_offset = max(self.max_offset, offset)
+        if offset > p["lost"]:
+            raise SimStop("lost")
+        if self.t > p["max_time"]:
+            raise SimStop("timeout")
+
+
+def fake_modules(car):
+    """
+    构造 legacy/main.py 导入的模块的仿真版本。
+    """
+    class Pin:
+        IN = 1
+        OUT = 3
+
+        def __init__(self, pin, mode=None):
+            self.pin = pin
+
+        def value(self, v=None):
+            if v is None:
+                return car.sensor(self.pin) if self.pin in SENSOR_PINS else 0
+
+        def on(self):
+            if self.pin == 2:
+                car.led = 1
+
+        def off(self):
+            if self.pin == 2:
+                car.led = 0
+
+    class PWM:
+        def __init__(self, pin, freq=None, duty=None):
+            self.pin = pin.pin
+
+        def duty(self, value=None):
+            if value is not None:
+                car.duty[self.pin] = max(0, min(MAX_DUTY, value))
+            return car.duty.get(self.pin, 0)
+
+    class Sensor:
+        def __init__(self, i2c):
+            pass
+
+        def range(self):
+            return car.range()
+
+    class MQTTClient:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def set_callback(self, f):
+            pass
+
+        def connect(self, *args):
+            return 0
+
+        def subscribe(self, *args):
+            pass
+
+        def check_msg(self):
+            return None
+
+    def sleep(seconds):
+        car.advance(seconds)
+
+    def module(name, **attrs):
+        mod = types.ModuleType(name)
+        mod.__dict__.update(attrs)
+        return mod
+
+    noop = lambda *args, **kwargs: None
+    return {
+        "machine": module("machine", Pin=Pin, PWM=PWM, SoftI2C=noop, ADC=noop,
+                          unique_id=lambda: b"simcar", reset=noop),
+        "ST_VL6180": module("ST_VL6180", Sensor=Sensor),
+        "legacy.umqttsimple": module("legacy.umqttsimple", MQTTClient=MQTTClient),
+        "ubinascii": module("ubinascii", hexlify=lambda b: b.hex().encode()),
+        "micropython": module("micropython"),
+        "network": module("network"),
+        "esp": module("esp", osdebug=noop),
+        "time": module("time", sleep=sleep, sleep_ms=lambda ms: sleep(ms / 1000),
+                       ticks_ms=lambda: int(car.t * 1000), ticks_diff=lambda a, b: a - b,
+                       time=lambda: car.t),
+    }
+
+
+class _Override(ast.NodeTransformer):
+    """
+    在语法树上替换参数：函数内 time.sleep 的时长、duty 占空比按比例缩放，以及模块级变量的初始值。
+    """
+
+    def __init__(self, functions, names):
+        self.functions = functions      # 函数名 -> {"sleep": 秒, "scale": 比例}
+        self.names = names              # 模块级变量 -> 值
+
+    def visit_FunctionDef(self, node):
+        override = self.functions.get(node.name)
+        if override:
+            for call in ast.walk(node):
+                if not isinstance(call, ast.Call) or not isinstance(call.func, ast.Attribute) or not call.args:
+                    continue
+                arg = call.args[0]
+                if call.func.attr == "sleep" and "sleep" in override:
+                    call.args[0] = ast.copy_location(ast.Constant(override["sleep"]), arg)
+                elif call.func.attr == "duty" and "scale" in override and isinstance(arg, ast.Constant):
+                    value = min(MAX_DUTY, int(round(arg.value * override["scale"])))
+                    call.args[0] = ast.copy_location(ast.Constant(value), arg)
+        return node
+
+    def visit_Module(self, node):
+        for stmt in node.body:
+            if (isinstance(stmt, ast.Assign) and len(stmt.targets) == 1
+                    and isinstance(stmt.targets[0], ast.Name) and stmt.targets[0].id in self.names):
+                value = ast.parse(repr(self.names[stmt.targets[0].id]), mode="eval").body
+                stmt.value = ast.copy_location(value, stmt.value)
+        self.generic_visit(node)
+        return node
+
+
+def compile_program(path=PROGRAM, functions=None, names=None):
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    tree = ast.fix_missing_locations(_Override(functions or {}, names or {}).visit(tree))
+    return compile(tree, path, "exec")
+
+
+def build_track(track, plan, params):
+    """
+    由地图生成黑线线段，返回 (线段, 起始位姿, 路口坐标)。
+    路线带初始方向时，小车从起点前 lead_in 米处沿该方向驶入起点路口；
+    不带方向（planner 中 heading=None，起点不执行动作）时小车停在起点路口上，
+    沿第一条边的出发方向行驶，不经过起点的交叉线。
+    """
+    scale = params["scale"]
+    nodes = {name: (pos[0] * scale, pos[1] * scale) for name, pos in track.nodes.items()}
+    segments = set()
+    for src, edges in track.out.items():
+        for dst, _, _, _ in edges:
+            a, b = sorted((nodes[src], nodes[dst]))
+            segments.add((a[0], a[1], b[0], b[1]))
+    sx, sy = nodes[plan.start]
+    if plan.heading is None:
+        depart = 0
+        if len(plan.nodes) > 1:
+            depart = next(h for dst, _, h, _ in track.out[plan.start] if dst == plan.nodes[1])
+        return sorted(segments), (sx, sy, math.radians(depart)), nodes
+    heading = math.radians(plan.heading)
+    lead = params["lead_in"]
+    x, y = sx - lead * math.sin(heading), sy - lead * math.cos(heading)
+    segments.add((x, y, sx, sy))
+    return sorted(segments), (x, y, heading), nodes
+
+
+def simulate(config):
+    """
+    运行一次仿真，返回结果字典。config 包含 track（地图文件）、route、params、functions。
+    """
+    params = dict(DEFAULTS, **config.get("params", {}))
+    track = TrackMap.load(config["track"])
+    source, _, goal = config["route"].partition("->")
+    start, _, heading = source.partition("/")
+    plan = RoutePlanner(track).plan(start.strip(), goal.strip(), int(heading) % 360 if heading else None)
+    if plan is None:
+        return dict(config, reason="no-route", finished=False)
+    segments, pose, nodes = build_track(track, plan, params)
+    car = SimCar(segments, pose, nodes, params)
+    code = compile_program(config.get("program", PROGRAM), config.get("functions"), {"m": list(plan.tasks)})
+    fakes = fake_modules(car)
+    real_import = builtins.__import__
+
+    def sim_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if name in fakes:
+            return fakes[name]
+        return real_import(name, globals, locals, fromlist, level)
+
+    sandbox = dict(vars(builtins), __import__=sim_import, print=lambda *args, **kwargs: None)
+    scope = {"__builtins__": sandbox, "__name__": "__main__"}
+    reason = "end"
+    try:
+        exec(code, scope)
+    except SimStop as e:
+        reason = str(e)
+    visited = [name for name in car.visited if name in plan.nodes]
+    return {
+        "route": config["route"],
+        "functions": config.get("functions", {}),
+        "params": config.get("params", {}),
+        "reason": reason,
+        "finished": reason == "end" and visited == list(plan.nodes),
+        "crossings": scope.get("cross_counter", 0),
+        "sim_time": round(car.t, 3),
+        "max_offset": round(car.max_offset, 4),
+        "visited": visited,
+    }
+
+
+def parse_sweep(items):
+    """
+    把 ["turn_left.sleep=0.5,0.6", "vmax=0.4,0.5"] 展开为参数组合列表。
+    带点号的是函数参数（sleep / scale），不带点号的是 DEFAULTS 中的物理参数。
+    """
+    axes = []
+    for item in items:
+        key, _, values = item.partition("=")
+        axes.append([(key, float(v)) for v in values.split(",")])
+    combos = []
+    for combo in itertools.product(*axes):
+        functions, params = {}, {}
+        for key, value in combo:
+            if "." in key:
+                func, _, field = key.partition(".")
+                functions.setdefault(func, {})[field] = value
+            else:
+                params[key] = value
+        combos.append((functions, params))
+    return combos or [({}, {})]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="legacy/main.py 巡线控制逻辑的虚拟时钟仿真")
+    parser.add_argument("--track", default="track.json", help="赛道地图文件")
+    parser.add_argument("--route", action="append", help="路线，格式 <起点>/<方向>-><终点>，可重复")
+    parser.add_argument("--sweep", action="append", default=[], help="扫描参数，例如 turn_left.sleep=0.55,0.65 或 vmax=0.4,0.5")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="并行仿真的进程数")
+    parser.add_argument("--check", action="store_true", help="自检：用默认参数仿真 CHECK_ROUTES，有路线没走完时返回 1")
+    args = parser.parse_args()
+
+    routes = args.route or ["A/90->F"]
+    if args.check:
+        routes, args.sweep = list(CHECK_ROUTES), []
+    configs = [
+        {"track": args.track, "route": route, "functions": functions, "params": params}
+        for route in routes
+        for functions, params in parse_sweep(args.sweep)
+    ]
+    import time
+    start = time.perf_counter()
+    if args.workers > 1 and len(configs) > 1:
+        with Pool(args.workers) as pool:
+            results = pool.map(simulate, configs)
+    else:
+        results = [simulate(config) for config in configs]
+    elapsed = time.perf_counter() - start
+
+    results.sort(key=lambda r: (not r["finished"], r.get("sim_time", 0)))
+    for r in results:
+        print(f"{'完成' if r['finished'] else '失败':4s} {r['reason']:8s} {r['route']:10s} 用时 {r.get('sim_time', 0):7.2f}s"
+              f"  路口 {r.get('crossings', 0):2d}  最大偏离 {r.get('max_offset', 0) * 100:5.1f}cm"
+              f"  {r['functions'] or ''} {r['params'] or ''}")
+    sim_total = sum(r.get("sim_time", 0) for r in results)
+    print(f"{len(results)} 次仿真，仿真时间 {sim_total:.1f}s，实际耗时 {elapsed:.2f}s，约 {sim_total / elapsed:.0f} 倍实时")
+    if args.check and not all(r["finished"] for r in results):
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+小车指令和回复的二进制编码，后端和单片机共用（需要与 micro_py.py 一起上传到小车）。
+
+报文格式：
+    版本字节 VERSION（0xB1，JSON 以 '{' 开头，首字节即可区分两种编码）
+    指令类型 1 字节：init=1 task=2 stop=3 online=4 car-message=5，回复为 0x80 | 指令类型
+    标志     1 字节：F_PATH / F_TASKS / F_CID
+    [path-id 1 字节]
+    [动作数 1 字节 + 动作码，每字节两个，低 4 位在前]
+    [cid 长度 1 字节 + ASCII]（放在最后，缓存的指令编码只需在末尾追加）
+
+只包含上述字段、且字段值可以表示时才能编码，否则 encode 返回 None，由调用方退回 JSON。
+小车在 online 消息中带 "codec": CODEC_BINARY 表示支持该编码，后端之后给它单独发送的指令使用二进制。
+"""
+
+CODEC_JSON = 0
+CODEC_BINARY = 1
+VERSION = 0xB1
+
+COMMANDS = ("init", "task", "stop", "online", "car-message")
+MANEUVERS = ("straight", "left", "right", "tiny_left", "tiny_right", "end")
+ACK = 0x80
+
+F_PATH = 0x01
+F_TASKS = 0x02
+F_CID = 0x04
+
+_FIELDS = ("command-type", "path-id", "tasks", "cid")
+
+
+def _command_code(command_type):
+    code = 0
+    if command_type.startswith("ack_"):
+        code = ACK
+        command_type = command_type[4:]
+    try:
+        return code | (COMMANDS.index(command_type) + 1)
+    except ValueError:
+        return -1
+
+
+def encode(data):
+    """
+    把指令字典编码为 bytes，无法表示时返回 None。
+    """
+    for key in data:
+        if key not in _FIELDS:
+            return None
+    code = _command_code(data.get("command-type", ""))
+    if code < 0:
+        return None
+    out = bytearray(3)
+    out[0] = VERSION
+    out[1] = code
+    flags = 0
+    path_id = data.get("path-id")
+    if path_id is not None:
+        if not isinstance(path_id, int) or not 0 <= path_id <= 255:
+            return None
+        flags |= F_PATH
+        out.append(path_id)
+    tasks = data.get("tasks")
+    if tasks is not None:
+        if len(tasks) > 255:
+            return None
+        flags |= F_TASKS
+        out.append(len(tasks))
+        packed = 0
+        for i in range(len(tasks)):
+            try:
+                op = MANEUVERS.index(tasks[i])
+            except ValueError:
+                return None
+            if i & 1:
+                out.append(packed | op << 4)
+            else:
+                packed = op
+        if len(tasks) & 1:
+            out.append(packed)
+    cid = data.get("cid")
+    if cid is not None:
+        cid = cid.encode() if isinstance(cid, str) else cid
+        if len(cid) > 255:
+            return None
+        flags |= F_CID
+        out.append(len(cid))
+        out.extend(cid)
+    out[2] = flags
+    return bytes(out)
+
+
+def decode(buf):
+    """
+    把二进制报文解码为与 JSON 相同的字典，格式错误时抛出 ValueError。
+    """
+    if len(buf) < 3 or buf[0] != VERSION:
+        raise ValueError("not a binary command")
+    code = buf[1]
+    index = (code & 0x7F) - 1
+    if not 0 <= index < len(COMMANDS):
+        raise ValueError("unknown command type")
+    command_type = COMMANDS[index]
+    data = {"command-type": "ack_" + command_type if code & ACK else command_type}
+    flags = buf[2]
+    pos = 3
+    try:
+        if flags & F_PATH:
+            data["path-id"] = buf[pos]
+            pos += 1
+        if flags & F_TASKS:
+            n = buf[pos]
+            pos += 1
+            if pos + (n + 1) // 2 > len(buf):
+                raise ValueError("truncated tasks")
+            tasks = []
+            for i in range(n):
+                op = buf[pos + (i >> 1)]
+                op = op >> 4 if i & 1 else op & 0x0F
+                if op >= len(MANEUVERS):
+                    raise ValueError("unknown maneuver")
+                tasks.append(MANEUVERS[op])
+            data["tasks"] = tasks
+            pos += (n + 1) // 2
+        if flags & F_CID:
+            n = buf[pos]
+            if pos + 1 + n > len(buf):
+                raise ValueError("truncated cid")
+            data["cid"] = bytes(buf[pos + 1:pos + 1 + n]).decode()
+            pos += 1 + n
+    except IndexError:
+        raise ValueError("truncated command")
+    return data
+
+
+def is_binary(payload):
+    return len(payload) > 0 and payload[0] == VERSION
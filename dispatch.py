@@ -0,0 +1,79 @@
+import queue
+import threading
+import time
+
+
+class KeyedDispatcher:
+    """
+    按 key 分发任务的有界线程池。
+    同一个 key（例如同一辆小车的主题）的任务总是交给同一个工作线程，保证按到达顺序处理；
+    不同 key 的任务在多个工作线程间并行。每个工作线程最多积压 max_queue 个任务，
+    超过时 submit 立即丢弃并计数，不阻塞调用方（paho 网络线程阻塞会耽误保活和其他小车的消息）；
+    put_timeout > 0 时改为最多等待 put_timeout 秒（反压，需要显式开启）。
+    """
+
+    def __init__(self, workers=4, max_queue=1000, put_timeout=0, name="dispatch"):
+        # 队列本身不设上限，上限在 submit 中检查，stop() 的结束标记总能放进去
+        self.queues = [queue.Queue() for _ in range(workers)]
+        self.max_queue = max_queue
+        self.put_timeout = put_timeout
+        self.name = name
+        self.threads = []
+        self.lock = threading.Lock()    # 保护 dropped / errors，多个线程同时计数
+        self.dropped = 0
+        self.errors = 0
+
+    def start(self):
+        for i, q in enumerate(self.queues):
+            thread = threading.Thread(target=self._run, args=(q,), name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        """
+        等待队列中已有的任务处理完后停止工作线程。
+        """
+        for q in self.queues:
+            q.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def submit(self, key, func, *args):
+        """
+        提交任务，返回是否成功入队。
+        """
+        q = self.queues[hash(key) % len(self.queues)]
+        if q.qsize() >= self.max_queue and self.put_timeout > 0:
+            deadline = time.monotonic() + self.put_timeout
+            while q.qsize() >= self.max_queue and time.monotonic() < deadline:
+                time.sleep(0.001)
+        if q.qsize() >= self.max_queue:
+            with self.lock:
+                self.dropped += 1
+            return False
+        q.put((func, args))
+        return True
+
+    def stats(self):
+        with self.lock:
+            dropped, errors = self.dropped, self.errors
+        return {
+            "queue_depths": [q.qsize() for q in self.queues],
+            "dropped": dropped,
+            "errors": errors,
+        }
+
+    def _run(self, q):
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            func, args = item
+            try:
+                func(*args)
+            except Exception as e:
+                with self.lock:
+                    self.errors += 1
+                print(f"[{threading.current_thread().name}] 处理任务失败: {e}")
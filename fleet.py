@@ -0,0 +1,167 @@
+"""
+小车车队：按车寻址的主题和车辆状态登记表。
+
+主题约定：
+    car/<id>/cmd   后端 -> 指定小车的指令
+    car/all/cmd    后端 -> 所有小车的广播指令
+    car/<id>/ack   小车 -> 后端的回复
+旧固件仍使用全局的 data / server 主题，后端同时兼容。
+"""
+import threading
+import time
+
+from carcodec import CODEC_JSON
+
+CMD_TOPIC = "car/{}/cmd"
+ACK_TOPIC = "car/{}/ack"
+BROADCAST_ID = "all"
+BROADCAST_TOPIC = CMD_TOPIC.format(BROADCAST_ID)
+ACK_SUBSCRIPTION = ACK_TOPIC.format("+")
+
+LEGACY_CMD_TOPIC = "data"
+LEGACY_ACK_TOPIC = "server"
+LEGACY_CAR_ID = "legacy"   # 通过旧主题通信、无法区分编号的小车
+
+
+def cmd_topic(car_id):
+    return CMD_TOPIC.format(car_id)
+
+
+def ack_topic(car_id):
+    return ACK_TOPIC.format(car_id)
+
+
+def parse_ack_topic(topic):
+    """
+    从回复主题中取出小车编号，旧的 server 主题返回 LEGACY_CAR_ID，其他主题返回 None。
+    """
+    if topic == LEGACY_ACK_TOPIC:
+        return LEGACY_CAR_ID
+    parts = topic.split("/")
+    if len(parts) == 3 and parts[0] == "car" and parts[2] == "ack" and parts[1]:
+        return parts[1]
+    return None
+
+
+class CarState:
+    """
+    单辆小车的状态，使用 __slots__ 保持上千辆车时的内存占用较小。
+    """
+    __slots__ = ("car_id", "group", "path_id", "last_ack", "last_seen", "acks", "codec")
+
+    def __init__(self, car_id):
+        self.car_id = car_id
+        self.group = None
+        self.path_id = None      # 当前行驶的路径 ID
+        self.last_ack = None     # 最近一次回复的指令类型
+        self.last_seen = 0.0     # 最近一次收到回复的时间（time.monotonic）
+        self.acks = 0
+        self.codec = CODEC_JSON  # 小车支持的指令编码，见 carcodec
+
+    def __repr__(self):
+        return f"CarState({self.car_id}, group={self.group}, path={self.path_id}, last_ack={self.last_ack})"
+
+
+class FleetRegistry:
+    """
+    车队登记表：记录每辆车的状态和分组，并把指令目标解析为要发布的主题。
+    指令目标可以是：
+        None / "all"       所有小车（一次广播发布）
+        "group:<名称>"     某个分组内的小车（逐车发布）
+        "<小车编号>"       单辆小车
+    """
+
+    def __init__(self):
+        self.cars = {}
+        self.groups = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.cars)
+
+    def get(self, car_id):
+        car = self.cars.get(car_id)
+        if car is None:
+            with self.lock:
+                car = self.cars.get(car_id)
+                if car is None:
+                    car = self.cars[car_id] = CarState(car_id)
+        return car
+
+    def record_ack(self, car_id, command_type, path_id=None):
+        """
+        记录一次小车回复，返回该车的状态。
+        """
+        car = self.get(car_id)
+        car.last_ack = command_type
+        car.last_seen = time.monotonic()
+        car.acks += 1
+        if path_id is not None:
+            car.path_id = path_id
+        return car
+
+    def assign(self, car_id, group):
+        car = self.get(car_id)
+        with self.lock:
+            if car.group is not None:
+                self.groups.get(car.group, set()).discard(car_id)
+            car.group = group
+            if group is not None:
+                self.groups.setdefault(group, set()).add(car_id)
+
+    def topics_for(self, target=None):
+        """
+        返回发送给目标所需发布的主题列表。
+        """
+        if target is None or target == BROADCAST_ID:
+            return [BROADCAST_TOPIC, LEGACY_CMD_TOPIC]
+        if target.startswith("group:"):
+            with self.lock:
+                members = sorted(self.groups.get(target[len("group:"):], ()))
+            return [self.topic_for_car(car_id) for car_id in members]
+        return [self.topic_for_car(target)]
+
+    def topics_by_codec(self, target=None):
+        """
+        按小车支持的编码把目标主题分组，返回 {编码: 主题列表}。
+        广播主题所有小车都会收到，总是使用 JSON。
+        """
+        if target is None or target == BROADCAST_ID:
+            return {CODEC_JSON: self.topics_for(target)}
+        result = {}
+        for car_id in self.cars_for(target):
+            car = self.cars.get(car_id)
+            codec = car.codec if car is not None else CODEC_JSON
+            result.setdefault(codec, []).append(self.topic_for_car(car_id))
+        return result
+
+    def cars_for(self, target=None):
+        """
+        返回目标包含的小车编号（广播时为当前登记的所有小车），用于统计哪些车应当回复。
+        """
+        if target is None or target == BROADCAST_ID:
+            return list(self.cars)
+        if target.startswith("group:"):
+            with self.lock:
+                return sorted(self.groups.get(target[len("group:"):], ()))
+        return [target]
+
+    def topic_for_car(self, car_id):
+        if car_id == LEGACY_CAR_ID:
+            return LEGACY_CMD_TOPIC
+        return cmd_topic(car_id)
+
+    def stale(self, timeout):
+        """
+        返回超过 timeout 秒没有回复的小车编号。
+        """
+        deadline = time.monotonic() - timeout
+        return [car.car_id for car in list(self.cars.values()) if car.last_seen < deadline]
+
+    def summary(self, limit=20):
+        cars = list(self.cars.values())
+        return {
+            "cars": len(cars),
+            "groups": {name: len(members) for name, members in self.groups.items()},
+            "sample": [repr(car) for car in cars[:limit]],
+        }
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+
+from frontend_protocol import CommandReader, ProtocolError
+
+
+class FrontendHub:
+    """
+    异步前端服务器。
+    接受任意数量的前端连接，把日志广播给所有前端，并接收任意前端发来的指令。
+    对外提供与 socket 相同的 sendall 接口，send_log 不需要区分同步/异步模式；
+    sendall 可以在任意线程（例如 paho 的网络线程）中调用，实际写入在事件循环中完成。
+    """
+
+    def __init__(self, host, port, on_command, max_buffer=1 << 20, max_pending=10000):
+        self.host = host
+        self.port = port
+        self.on_command = on_command      # 收到一条前端指令时的回调（在事件循环中调用）
+        self.max_buffer = max_buffer      # 单个前端允许积压的最大字节数，超过后丢弃日志
+        self.loop = None
+        # 事件循环启动前（例如 MQTT 先于前端服务器连接）交来的任务暂存在 pending 中，
+        # start() 时按顺序交给事件循环；超过 max_pending 条时丢弃并打印
+        self.max_pending = max_pending
+        self.pending = []
+        self.lock = threading.Lock()
+        self.dropped_calls = 0            # 事件循环未启动或已关闭而丢弃的任务数
+        self.server = None
+        self.writers = set()
+        self.dropped = 0                  # 因前端过慢而丢弃的日志条数
+        self.accepted = 0                 # 累计接受的前端连接数
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            self.loop = loop
+            for func, args in self.pending:
+                loop.call_soon(func, *args)
+            self.pending = []
+        self.server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        return self.server
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    def call_soon(self, func, *args):
+        """
+        把任务交给事件循环执行，供 paho 回调线程使用。
+        事件循环启动前的任务先暂存，启动后按顺序执行；事件循环已关闭时丢弃并打印。
+        """
+        with self.lock:
+            if self.loop is None:
+                if len(self.pending) < self.max_pending:
+                    self.pending.append((func, args))
+                    return
+            else:
+                try:
+                    self.loop.call_soon_threadsafe(func, *args)
+                    return
+                except RuntimeError:
+                    pass
+            self.dropped_calls += 1
+        print(f"事件循环不可用，丢弃任务: {getattr(func, '__name__', func)}")
+
+    def sendall(self, data):
+        """
+        线程安全地把数据广播给所有前端。
+        """
+        self.call_soon(self.broadcast, data)
+
+    def broadcast(self, data):
+        """
+        在事件循环中把数据写给所有前端。
+        慢前端的发送缓冲超过 max_buffer 时丢弃本条数据，不阻塞其他前端。
+        """
+        for writer in tuple(self.writers):
+            if writer.is_closing():
+                self.writers.discard(writer)
+                continue
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                self.dropped += 1
+                continue
+            writer.write(data)
+
+    async def _handle_client(self, reader, writer):
+        address = writer.get_extra_info("peername")
+        print(f"前端已连接: {address}")
+        self.writers.add(writer)
+        self.accepted += 1
+        commands = CommandReader(on_negotiate=lambda version: writer.write(f"[debug] 协议版本: {version}\n".encode()))
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                for command in commands.feed(data):
+                    print(f"收到前端指令: {command}")
+                    try:
+                        self.on_command(command)
+                    except Exception as e:
+                        print(f"处理前端指令失败: {e}")
+        except ProtocolError as e:
+            print(f"前端协议错误: {e}")
+        except ConnectionError:
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+            print(f"前端已断开: {address}")
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        for writer in tuple(self.writers):
+            writer.close()
+        self.writers.clear()
@@ -0,0 +1,111 @@
+"""
+前端 Socket 指令的分帧读取。
+
+协议版本：
+    0 (PROTOCOL_LEGACY) 旧前端，指令之间没有分隔符，每次 recv 到的数据按换行拆分，
+                        末尾不带换行的部分也视为一条完整指令
+    1 (PROTOCOL_LINE)   每条指令以 '\\n' 结尾，跨多次 recv 的指令会被拼接
+    2 (PROTOCOL_LENGTH) 每条指令前带 2 字节大端长度前缀
+
+连接建立后默认使用版本 0，前端发送 "proto:<版本>" 协商新版本，
+协商指令之后的数据按新版本解析（同一次 recv 中的剩余数据也是如此）。
+"""
+
+PROTOCOL_LEGACY = 0
+PROTOCOL_LINE = 1
+PROTOCOL_LENGTH = 2
+PROTOCOL_VERSIONS = (PROTOCOL_LEGACY, PROTOCOL_LINE, PROTOCOL_LENGTH)
+
+MAX_COMMAND_SIZE = 64 * 1024   # 单条指令的最大字节数
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def _utf8_complete_end(data, start):
+    """
+    返回 data[start:] 中以完整 UTF-8 字符结尾的最长前缀的结束位置，
+    末尾的多字节字符被 recv 截断时小于 len(data)。
+    """
+    end = len(data)
+    i = end - 1
+    while i >= start and i >= end - 4:
+        b = data[i]
+        if b & 0xC0 != 0x80:         # 找到字符的首字节
+            if b >= 0xF0:
+                need = 4
+            elif b >= 0xE0:
+                need = 3
+            elif b >= 0xC0:
+                need = 2
+            else:
+                need = 1
+            return end if end - i >= need else i
+        i -= 1
+    return end
+
+
+class CommandReader:
+    """
+    每个前端连接一个 CommandReader，内部保存接收缓冲。
+    feed() 一次处理缓冲区中所有完整的指令，返回解码后的指令列表。
+    """
+
+    def __init__(self, version=PROTOCOL_LEGACY, on_negotiate=None, max_size=MAX_COMMAND_SIZE):
+        self.version = version
+        self.on_negotiate = on_negotiate   # 协商成功后的回调 on_negotiate(version)
+        self.max_size = max_size
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        buf = self.buffer
+        buf += data
+        commands = []
+        pos = 0
+        end = len(buf)
+        while pos < end:
+            if self.version == PROTOCOL_LENGTH:
+                if end - pos < 2:
+                    break
+                size = buf[pos] << 8 | buf[pos + 1]
+                if end - pos - 2 < size:
+                    break
+                frame = buf[pos + 2:pos + 2 + size]
+                pos += 2 + size
+            else:
+                nl = buf.find(b"\n", pos)
+                if nl >= 0:
+                    frame = buf[pos:nl]
+                    pos = nl + 1
+                elif self.version == PROTOCOL_LEGACY:
+                    # 末尾的字符被截断时整段留到下一次，不能只交出前缀（"task:中" 会被拆成两条指令）
+                    if _utf8_complete_end(buf, pos) < end:
+                        break
+                    frame = buf[pos:end]
+                    pos = end
+                else:
+                    break
+            command = frame.decode("utf-8", "replace").strip()
+            if not command:
+                continue
+            if command.startswith("proto:"):
+                self._negotiate(command)
+                continue
+            commands.append(command)
+        del buf[:pos]
+        if len(buf) > self.max_size:
+            buf.clear()
+            raise ProtocolError(f"指令超过最大长度 {self.max_size} 字节")
+        return commands
+
+    def _negotiate(self, command):
+        try:
+            version = int(command[len("proto:"):])
+        except ValueError:
+            raise ProtocolError(f"无效的协议协商指令: {command}")
+        if version not in PROTOCOL_VERSIONS:
+            raise ProtocolError(f"不支持的协议版本: {version}")
+        self.version = version
+        if self.on_negotiate is not None:
+            self.on_negotiate(version)
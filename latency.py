@@ -0,0 +1,191 @@
+"""
+指令往返延迟统计。
+
+后端发出的每条指令带一个关联 ID（payload 中的 "cid" 字段），小车回复时原样带回，
+LatencyTracker 据此算出 指令->回复 的延迟，按指令类型和小车分别记入直方图，
+并找出超时未回复的小车。
+"""
+import itertools
+import threading
+import time
+
+SUB_BITS = 7               # 每个 2 的幂区间分成 2^(SUB_BITS-1) 个桶，相对误差约 1%
+SUB_COUNT = 1 << SUB_BITS
+HALF_COUNT = SUB_COUNT >> 1
+
+
+def bucket_index(value):
+    """
+    HDR 风格的对数-线性分桶：小于 SUB_COUNT 的值每个值一个桶，
+    更大的值按最高 SUB_BITS 位分桶。
+    """
+    if value < SUB_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BITS
+    return SUB_COUNT + (shift - 1) * HALF_COUNT + (value >> shift) - HALF_COUNT
+
+
+def bucket_high(index):
+    """
+    返回桶内的最大值。
+    """
+    if index < SUB_COUNT:
+        return index
+    shift, sub = divmod(index - SUB_COUNT, HALF_COUNT)
+    return ((sub + HALF_COUNT + 1) << (shift + 1)) - 1
+
+
+class Histogram:
+    """
+    延迟直方图，以微秒为单位记录，桶稀疏地保存在字典中，
+    上千辆车每车一个直方图时内存占用仍然很小。
+    """
+    __slots__ = ("buckets", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    def record(self, value):
+        value = max(0, int(value))
+        index = bucket_index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        if not self.count or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+
+    def percentile(self, q):
+        if not self.count:
+            return 0
+        rank = max(1, int(q / 100 * self.count + 0.5))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(bucket_high(index), self.max)
+        return self.max
+
+    def summary(self):
+        """
+        返回 n / p50 / p99 / max，时间单位为毫秒。
+        """
+        return {
+            "n": self.count,
+            "p50": self.percentile(50) / 1000,
+            "p99": self.percentile(99) / 1000,
+            "max": self.max / 1000,
+        }
+
+
+class _Pending:
+    __slots__ = ("command_type", "sent", "cars", "acked", "root")
+
+    def __init__(self, command_type, sent, cars, root):
+        self.command_type = command_type
+        self.sent = sent
+        self.cars = cars        # 应当回复的小车编号
+        self.acked = set()
+        self.root = root        # 由另一条指令的回复触发时，为 (起始指令类型, 起始发送时间)
+
+
+class LatencyTracker:
+    """
+    关联 ID 的登记表和延迟直方图，可以在多个线程中同时使用。
+    start() 在发送指令前登记并返回关联 ID，ack() 在收到回复时记录延迟，
+    expire() 清理超过 timeout 秒的指令，返回未回复的 (关联 ID, 指令类型, 小车编号)。
+    收齐回复的指令也保留到超时，之后由它的回复触发的指令仍能找到起始时间。
+    """
+
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+        self.pending = {}
+        self.by_type = {}       # 指令类型 -> Histogram，"init>task" 表示 init 到 task 回复的整个流程
+        self.by_car = {}        # 小车编号 -> Histogram
+        self.timeouts = {}      # 指令类型 -> 超时未回复的次数
+        self.unknown = 0        # 关联 ID 不存在（已超时或重复）的回复数
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def start(self, command_type, cars=(), parent=None):
+        """
+        登记一条即将发出的指令，返回关联 ID。
+        parent 为触发本指令的回复所携带的关联 ID，用于统计整个流程的耗时。
+        """
+        now = time.monotonic()
+        with self.lock:
+            cid = format(next(self.ids), "x")
+            root = None
+            origin = self.pending.get(parent)
+            if origin is not None:
+                root = origin.root or (origin.command_type, origin.sent)
+            self.pending[cid] = _Pending(command_type, now, list(cars), root)
+        return cid
+
+    def ack(self, cid, car_id):
+        """
+        记录一次回复，返回延迟（秒），关联 ID 未登记时返回 None。
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.pending.get(cid)
+            if entry is None or car_id in entry.acked:
+                self.unknown += 1
+                return None
+            entry.acked.add(car_id)
+            elapsed = now - entry.sent
+            self._histogram(self.by_type, entry.command_type).record(elapsed * 1e6)
+            self._histogram(self.by_car, car_id).record(elapsed * 1e6)
+            if entry.root is not None:
+                root_type, root_sent = entry.root
+                self._histogram(self.by_type, f"{root_type}>{entry.command_type}").record((now - root_sent) * 1e6)
+        return elapsed
+
+    def cancel(self, cid):
+        """
+        撤销一条没有发出的指令，它不会被计为超时。
+        """
+        with self.lock:
+            self.pending.pop(cid, None)
+
+    def expire(self):
+        """
+        清理超时的指令，返回未回复的 (关联 ID, 指令类型, 小车编号) 列表。
+        """
+        deadline = time.monotonic() - self.timeout
+        missing = []
+        with self.lock:
+            for cid in [cid for cid, entry in self.pending.items() if entry.sent < deadline]:
+                entry = self.pending.pop(cid)
+                for car_id in entry.cars:
+                    if car_id not in entry.acked:
+                        missing.append((cid, entry.command_type, car_id))
+                        self.timeouts[entry.command_type] = self.timeouts.get(entry.command_type, 0) + 1
+        return missing
+
+    def summary(self, car_id=None):
+        """
+        返回各指令类型（或指定小车）的延迟分位数。
+        """
+        with self.lock:
+            if car_id is not None:
+                histogram = self.by_car.get(car_id)
+                return {car_id: histogram.summary() if histogram else None}
+            return {
+                "types": {name: h.summary() for name, h in sorted(self.by_type.items())},
+                "timeouts": dict(self.timeouts),
+                "pending": sum(1 for entry in self.pending.values() if len(entry.acked) < len(entry.cars)),
+                "unknown": self.unknown,
+            }
+
+    @staticmethod
+    def _histogram(table, key):
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = Histogram()
+        return histogram
@@ -1,14 +1,23 @@
 # TODO 所有的socketwrite都改成了send  read都改成了recv； 
 
 
+import errno
+import os
+import selectors
 import socket                        # TODO
-import struct                      # TODO
+import sys
 from binascii import hexlify        # TODO
 import time
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mqttcodec
+
 client_id = "yuanxinyu"            # TODO
 client_id = client_id.encode('utf-8')
 
+RX_BUF_SIZE = 4096   # 接收缓冲区初始大小，收到更大的报文时自动扩大
+
 class MQTTException(Exception):
     pass
 
@@ -78,9 +87,20 @@ class MQTTException(Exception):
 #             assert self.keepalive < 65536
 
 class MQTTClient:
+    """
+    CPython 上的 MQTT 客户端。
+
+    接收：recv_into 读入可复用的接收缓冲区，mqttcodec.frame() 判断报文是否完整，recv 返回的字节
+    再少也会继续读，不会截断主题和负载；回调收到的 topic / msg 是接收缓冲区的 memoryview，
+    只在回调期间有效，需要保存时自行复制。
+    发送：阻塞模式用 sendall 整包写出；非阻塞模式写不完的部分排队，由 ClientLoop 在可写时继续发送。
+
+    阻塞模式的接口与原来相同（connect / subscribe / publish / wait_msg / check_msg）；
+    交给 ClientLoop.add() 后为非阻塞模式，subscribe / publish 只发送不等待回复。
+    """
 
     def __init__(self, client_id, server, port=0, user=None, password=None, keepalive=0,
-                 ssl=False, ssl_params={}):
+                 ssl=False, ssl_params={}, rx_buf_size=RX_BUF_SIZE):
         if port == 0:
             port = 8883 if ssl else 1883
         self.client_id = client_id
@@ -98,20 +118,126 @@ class MQTTClient:
         self.lw_msg = None
         self.lw_qos = 0
         self.lw_retain = False
+        self.tx = bytearray(128)
+        self.rx = bytearray(rx_buf_size)
+        self.rxmv = memoryview(self.rx)
+        self.rx_start = 0
+        self.rx_end = 0
+        self.out = bytearray()      # 非阻塞模式下还没写出的数据
+        self.loop = None            # 非阻塞模式下所属的 ClientLoop
+        self.connected = False
+        self.session_present = False
+        self.inflight = set()       # 等待 PUBACK 的报文 ID
+        self.rx_qos2 = set()        # 已收到、尚未收到 PUBREL 的入站 QoS 2 报文 ID
+        self.suback = None          # 最近一次 SUBACK 的 (报文 ID, 返回码)
+        self.last_tx = 0.0
+
+    def _fill(self):
+        # 把未处理的数据移到缓冲区开头，再 recv_into 读入；非阻塞模式下没有数据时返回 None
+        start = self.rx_start
+        end = self.rx_end
+        if start:
+            if start < end:
+                self.rxmv[0:end - start] = self.rxmv[start:end]
+            end -= start
+            self.rx_start = 0
+            self.rx_end = end
+        if end == len(self.rx):
+            # 单个报文超过接收缓冲区，扩大一倍（之前交给回调的切片仍指向旧缓冲区）
+            rx = bytearray(2 * len(self.rx))
+            rx[:end] = self.rxmv[:end]
+            self.rx = rx
+            self.rxmv = memoryview(rx)
+        try:
+            n = self.sock.recv_into(self.rxmv[end:])
+        except BlockingIOError:
+            return None
+        if n == 0:
+            raise OSError(-1)
+        self.rx_end = end + n
+        return n
+
+    def _read_packet(self):
+        """
+        返回下一个完整报文 (固定头首字节, 报文体)，数据不够时继续接收直到收全；
+        非阻塞模式下还没有收全时返回 None，已收到的部分留在缓冲区里。
+        """
+        while 1:
+            header = mqttcodec.frame(self.rxmv, self.rx_start, self.rx_end)
+            if header is not None:
+                op, start, end = header
+                self.rx_start = end
+                return op, self.rxmv[start:end]
+            if self._fill() is None:
+                return None
+
+    def _send(self, data):
+        self.last_tx = time.monotonic()
+        if self.loop is None:
+            self.sock.sendall(data)
+            return
+        if not self.out:
+            try:
+                n = self.sock.send(data)
+            except BlockingIOError:
+                n = 0
+            if n == len(data):
+                return
+            data = memoryview(data)[n:]
+            self.loop._want_write(self, True)
+        self.out += data
+
+    def _flush(self):
+        # 非阻塞模式：socket 可写时继续发送排队的数据
+        try:
+            n = self.sock.send(self.out)
+        except BlockingIOError:
+            return
+        del self.out[:n]
+        if not self.out:
+            self.loop._want_write(self, False)
+
+    def _handle(self, op, body):
+        # 处理一个收到的报文，返回报文类型；PUBLISH 交给回调并按 QoS 回复确认
+        kind = op & 0xF0
+        if kind == mqttcodec.PUBLISH:
+            topic, pid, msg = mqttcodec.parse_publish(op, body)
+            qos = op & 6
+            if qos == 4:
+                self._send(mqttcodec.ack(mqttcodec.PUBREC, pid))
+                if pid in self.rx_qos2:
+                    return None     # 重发的 QoS 2 报文只交给回调一次
+                self.rx_qos2.add(pid)
+            self.cb(topic, msg)
+            if qos == 2:
+                self._send(mqttcodec.ack(mqttcodec.PUBACK, pid))
+            return None
+        if kind == mqttcodec.CONNACK:
+            present, code = mqttcodec.parse_connack(body)
+            if code != 0:
+                raise MQTTException(code)
+            self.connected = True
+            self.session_present = bool(present)
+        elif kind == mqttcodec.PUBACK:
+            self.inflight.discard(mqttcodec.parse_ack(body))
+        elif kind == mqttcodec.PUBREL:
+            pid = mqttcodec.parse_ack(body)
+            self.rx_qos2.discard(pid)
+            self._send(mqttcodec.ack(mqttcodec.PUBCOMP, pid))
+        elif kind == mqttcodec.SUBACK:
+            pid, granted = mqttcodec.parse_suback(body)
+            self.suback = (pid, granted[0])
+        elif kind == mqttcodec.PINGRESP:
+            return None
+        return op
 
-    def _send_str(self, s):
-        self.sock.send(struct.pack("!H", len(s)))
-        self.sock.send(s)
-
-    def _recv_len(self):
-        n = 0
-        sh = 0
+    def _on_readable(self):
+        # 非阻塞模式：处理缓冲区和 socket 中所有已收全的报文
         while 1:
-            b = self.sock.recv(1)[0]
-            n |= (b & 0x7f) << sh
-            if not b & 0x80:
-                return n
-            sh += 7
+            packet = self._read_packet()
+            if packet is None:
+                return
+            self._handle(*packet)
 
     def set_callback(self, f):
         self.cb = f
@@ -124,113 +250,68 @@ class MQTTClient:
         self.lw_qos = qos
         self.lw_retain = retain
 
+    def _connect_packet(self, clean_session):
+        self.rx_start = self.rx_end = 0
+        self.connected = False
+        self.tx, n = mqttcodec.connect(
+            self.tx, self.client_id, clean_session, self.keepalive, self.user, self.pswd,
+            self.lw_topic, self.lw_msg, self.lw_qos, self.lw_retain,
+        )
+        return memoryview(self.tx)[:n]
+
     def connect(self, clean_session=True):
         self.sock = socket.socket()
         addr = socket.getaddrinfo(self.server, self.port)[0][-1]
         self.sock.connect(addr)
+        # 报文整包发送，关闭 Nagle 避免与延迟 ACK 叠加产生等待
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         if self.ssl:
             import ssl as ussl
             self.sock = ussl.wrap_socket(self.sock, **self.ssl_params)
-        premsg = bytearray(b"\x10\0\0\0\0\0")
-        msg = bytearray(b"\x04MQTT\x04\x02\0\0")
-
-        sz = 10 + 2 + len(self.client_id)
-        msg[6] = clean_session << 1
-        if self.user is not None:
-            sz += 2 + len(self.user) + 2 + len(self.pswd)
-            msg[6] |= 0xC0
-        if self.keepalive:
-            assert self.keepalive < 65536
-            msg[7] |= self.keepalive >> 8
-            msg[8] |= self.keepalive & 0x00FF
-        if self.lw_topic:
-            sz += 2 + len(self.lw_topic) + 2 + len(self.lw_msg)
-            msg[6] |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
-            msg[6] |= self.lw_retain << 5
-
-        i = 1
-        while sz > 0x7f:
-            premsg[i] = (sz & 0x7f) | 0x80
-            sz >>= 7
-            i += 1
-        premsg[i] = sz
-
-        self.sock.send(premsg, i + 2)
-        self.sock.send(msg)
-        #print(hex(len(msg)), hexlify(msg, ":"))
-        self._send_str(self.client_id)
-        if self.lw_topic:
-            self._send_str(self.lw_topic)
-            self._send_str(self.lw_msg)
-        if self.user is not None:
-            self._send_str(self.user)
-            self._send_str(self.pswd)
-        resp = self.sock.recv(4)
-        print("CONNACK response:", resp)  # 添加调试信息
-        # assert resp[0] == 0x20 and resp[1] == 0x02
-        # if resp[3] != 0:
-        #     raise MQTTException(resp[3])      # TODO
-        # return resp[2] & 1
+        self._send(self._connect_packet(clean_session))
+        while not self.connected:
+            self.wait_msg()
+        return self.session_present
 
     def disconnect(self):
-        self.sock.send(b"\xe0\0")
+        self._send(mqttcodec.DISCONNECT_PACKET)
+        if self.loop is not None:
+            self.loop.remove(self)
         self.sock.close()
 
     def ping(self):
-        self.sock.send(b"\xc0\0")
+        self._send(mqttcodec.PINGREQ_PACKET)
 
     def publish(self, topic, msg, retain=False, qos=0):
-        pkt = bytearray(b"\x30\0\0\0")
-        pkt[0] |= qos << 1 | retain
-        sz = 2 + len(topic) + len(msg)
+        if isinstance(msg, str):
+            msg = msg.encode()
+        assert 2 + len(topic) + len(msg) < 2097152
+        assert qos < 2
+        pid = 0
         if qos > 0:
-            sz += 2
-        assert sz < 2097152
-        i = 1
-        while sz > 0x7f:
-            pkt[i] = (sz & 0x7f) | 0x80
-            sz >>= 7
-            i += 1
-        pkt[i] = sz
-        #print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.send(pkt, i + 1)
-        self._send_str(topic)
-        if qos > 0:
-            self.pid += 1
+            self.pid = self.pid % 65535 + 1
             pid = self.pid
-            struct.pack_into("!H", pkt, 0, pid)
-            self.sock.send(pkt, 2)
-        self.sock.send(msg)
-        if qos == 1:
-            while 1:
-                op = self.wait_msg()
-                if op == 0x40:
-                    sz = self.sock.recv(1)
-                    assert sz == b"\x02"
-                    rcv_pid = self.sock.recv(2)
-                    rcv_pid = rcv_pid[0] << 8 | rcv_pid[1]
-                    if pid == rcv_pid:
-                        return
-        elif qos == 2:
-            assert 0
+            self.inflight.add(pid)
+        self._send(mqttcodec.publish_packet(topic, msg, qos, retain, pid))
+        if qos == 1 and self.loop is None:
+            while pid in self.inflight:
+                self.wait_msg()
 
     def subscribe(self, topic, qos=0):
         assert self.cb is not None, "Subscribe callback is not set"
-        pkt = bytearray(b"\x82\0\0\0")
-        self.pid += 1
-        struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic) + 1, self.pid)
-        #print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.send(pkt)
-        self._send_str(topic)
-        self.sock.send(qos.to_bytes(1, "little"))
+        self.pid = self.pid % 65535 + 1
+        self.suback = None
+        self.tx, n = mqttcodec.subscribe(self.tx, self.pid, topic, qos)
+        self._send(memoryview(self.tx)[:n])
+        if self.loop is not None:
+            return
         while 1:
             op = self.wait_msg()
-            if op == 0x90:
-                resp = self.sock.recv(4)
-                #print(resp)
-                assert resp[1] == pkt[2] and resp[2] == pkt[3]
-                if resp[3] == 0x80:
-                    raise MQTTException(resp[3])
+            if op == mqttcodec.SUBACK:
+                pid, code = self.suback
+                assert pid == self.pid
+                if code == 0x80:
+                    raise MQTTException(code)
                 return
 
     # Wait for a single incoming MQTT message and process it.
@@ -238,48 +319,124 @@ class MQTTClient:
     # set by .set_callback() method. Other (internal) MQTT
     # messages processed internally.
     def wait_msg(self):
-        res = self.sock.recv(1)
-        self.sock.setblocking(True)
-        if res is None:
-            return None
-        if res == b"":
-            raise OSError(-1)
-        if res == b"\xd0":  # PINGRESP
-            sz = self.sock.recv(1)[0]
-            assert sz == 0
+        packet = self._read_packet()
+        if packet is None:
             return None
-        op = res[0]
-        if op & 0xf0 != 0x30:
-            return op
-        sz = self._recv_len()
-        topic_len = self.sock.recv(2)
-        topic_len = (topic_len[0] << 8) | topic_len[1]
-        topic = self.sock.recv(topic_len)
-        sz -= topic_len + 2
-        if op & 6:
-            pid = self.sock.recv(2)
-            pid = pid[0] << 8 | pid[1]
-            sz -= 2
-        msg = self.sock.recv(sz)
-        self.cb(topic, msg)
-        if op & 6 == 2:
-            pkt = bytearray(b"\x40\x02\0\0")
-            struct.pack_into("!H", pkt, 2, pid)
-            self.sock.send(pkt)
-        elif op & 6 == 4:
-            assert 0
+        return self._handle(*packet)
 
     # Checks whether a pending message from server is available.
     # If not, returns immediately with None. Otherwise, does
     # the same processing as wait_msg.
     def check_msg(self):
         self.sock.setblocking(False)
-        return self.wait_msg()
+        try:
+            packet = self._read_packet()
+        finally:
+            self.sock.setblocking(True)
+        if packet is None:
+            return None
+        return self._handle(*packet)
+
+
+class ClientLoop:
+    """
+    用 selectors 在一个线程里驱动很多非阻塞的 MQTTClient（服务器上模拟车队、压测客户端）。
+    add() 发起非阻塞连接，poll() 处理一轮读写事件并按 keepalive 发送 PINGREQ；
+    连接出错的客户端从循环中移除并交给 on_error(client, exc)。非阻塞模式不支持 ssl。
+    """
+
+    def __init__(self, on_error=None):
+        self.selector = selectors.DefaultSelector()
+        self.clients = set()
+        self.on_error = on_error
+        self.next_ping = 0.0
+
+    def __len__(self):
+        return len(self.clients)
+
+    def add(self, client, clean_session=True):
+        assert not client.ssl, "非阻塞模式不支持 ssl"
+        sock = socket.socket()
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        addr = socket.getaddrinfo(client.server, client.port)[0][-1]
+        err = sock.connect_ex(addr)
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            raise OSError(err, os.strerror(err))
+        client.sock = sock
+        client.loop = self
+        # 连接建立前不能发送，CONNECT 先排队，socket 可写（连接完成）时发出
+        client.out += client._connect_packet(clean_session)
+        client.last_tx = time.monotonic()
+        self.selector.register(sock, selectors.EVENT_READ | selectors.EVENT_WRITE, client)
+        self.clients.add(client)
+        return client
+
+    def remove(self, client):
+        if client in self.clients:
+            self.clients.discard(client)
+            self.selector.unregister(client.sock)
+        client.loop = None
+
+    def _want_write(self, client, flag):
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if flag else 0)
+        self.selector.modify(client.sock, events, client)
+
+    def poll(self, timeout=None):
+        """
+        处理一轮就绪的读写事件，返回事件数。
+        """
+        events = self.selector.select(timeout)
+        for key, mask in events:
+            client = key.data
+            try:
+                if mask & selectors.EVENT_WRITE:
+                    client._flush()
+                if mask & selectors.EVENT_READ:
+                    client._on_readable()
+            except (OSError, ValueError, MQTTException) as e:
+                self._fail(client, e)
+        now = time.monotonic()
+        if now >= self.next_ping:
+            self.next_ping = now + 1.0
+            for client in list(self.clients):
+                if client.connected and client.keepalive and now - client.last_tx >= client.keepalive / 2:
+                    try:
+                        client.ping()
+                    except OSError as e:
+                        self._fail(client, e)
+        return len(events)
+
+    def run(self, until=None, timeout=0.1):
+        """
+        循环 poll()，直到 until() 返回 True 或没有客户端。
+        """
+        while self.clients and not (until is not None and until()):
+            self.poll(timeout)
+
+    def _fail(self, client, exc):
+        if client not in self.clients:
+            return
+        self.remove(client)
+        client.connected = False
+        client.sock.close()
+        if self.on_error is not None:
+            self.on_error(client, exc)
+        else:
+            print("连接断开:", client.client_id, exc)
+
+    def close(self):
+        for client in list(self.clients):
+            self.remove(client)
+            client.sock.close()
+        self.selector.close()
+
 
 def sub_cb(topic, msg):
     print(msg)
     if msg != b'0':
-        message = bytes.decode(msg)
+        message = bytes(msg).decode()
         global m
         m = message.split(',')
 
@@ -318,19 +475,19 @@ m = ['straight', 'straight', 'left', 'left', 'left', 'straight', 'straight', 'le
      'tiny_right', 'tiny_left', 'tiny_left', 'tiny_right', 'left', 'left', 'straight', 'straight', 'straight', 'left',
      'straight', 'straight', 'end']
 
-# 连接网络与MQTT客户端
-client = MQTT_start()
-try:
-    client.check_msg()
-except OSError as e:
-    restart_and_reconnect()
-
-while(1):
+if __name__ == "__main__":
+    # 连接网络与MQTT客户端
+    client = MQTT_start()
     try:
         client.check_msg()
     except OSError as e:
         restart_and_reconnect()
-    if m:
-        print(m)
-        cross_num = len(m);
-        
+
+    while(1):
+        try:
+            client.check_msg()
+        except OSError as e:
+            restart_and_reconnect()
+        if m:
+            print(m)
+            cross_num = len(m);
@@ -0,0 +1,216 @@
+"""
+车队负载生成器：在一个进程内模拟 N 辆小车，对 backend.py 的消息处理逻辑做压力测试。
+
+模拟小车实现与 micro_py.sub_cb 相同的协议：
+    init -> ack_init（带 path-id），task -> ack_task，stop -> ack_stop
+后端使用 backend.py 中真实的 on_message / init_tasks / send_task，
+MQTT Broker 由进程内的 LocalBroker 代替，完全离线运行。
+
+用法：
+    python loadgen.py --cars 1000 --rounds 5 --delay-ms 5 --jitter-ms 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+from broker import topic_matches
+from fleet import cmd_topic, ack_topic, parse_ack_topic, BROADCAST_TOPIC
+
+
+class LocalBroker:
+    """
+    进程内的 Broker 替身：按主题把消息投递给订阅者。
+    精确主题用字典直接查找，带通配符的订阅逐个匹配。
+    投递通过 loop.call_soon 异步进行，模拟消息经过网络的顺序语义。
+    """
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.exact = {}
+        self.wildcard = []
+        self.messages = 0
+
+    def subscribe(self, pattern, callback):
+        if "+" in pattern or "#" in pattern:
+            self.wildcard.append((pattern, callback))
+        else:
+            self.exact.setdefault(pattern, []).append(callback)
+
+    def publish(self, topic, payload):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.messages += 1
+        for callback in self.exact.get(topic, ()):
+            self.loop.call_soon(callback, topic, payload)
+        for pattern, callback in self.wildcard:
+            if topic_matches(pattern, topic):
+                self.loop.call_soon(callback, topic, payload)
+
+
+class BrokerClient:
+    """
+    提供 paho 客户端 publish 接口的适配器，让 backend.py 直接发布到 LocalBroker。
+    """
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.broker.publish(topic, payload)
+
+
+class SimCar:
+    """
+    一辆模拟小车，回复逻辑与 micro_py.sub_cb 相同。
+    """
+
+    def __init__(self, car_id, broker, delay=0.0, jitter=0.0):
+        self.car_id = car_id
+        self.broker = broker
+        self.delay = delay
+        self.jitter = jitter
+        self.ack_topic = ack_topic(car_id)
+        self.path_id = 1
+        self.tasks = []
+        broker.subscribe(cmd_topic(car_id), self.on_command)
+        broker.subscribe(BROADCAST_TOPIC, self.on_command)
+
+    def on_command(self, topic, payload):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return
+        command_type = data.get("command-type")
+        if command_type == "init":
+            self.path_id = 2 if self.path_id == 1 else 1
+            data["path-id"] = self.path_id
+        elif command_type in ("task", "stop"):
+            self.tasks = data.get("tasks", [])
+        else:
+            return
+        data["command-type"] = "ack_" + command_type
+        delay = self.delay
+        if self.jitter:
+            delay = max(0.0, delay + random.uniform(-self.jitter, self.jitter))
+        self.broker.loop.call_later(delay, self.broker.publish, self.ack_topic, json.dumps(data))
+
+
+class LatencyProbe:
+    """
+    旁路监听所有指令和回复，统计每辆车 指令->回复 的延迟。
+    """
+
+    def __init__(self, broker):
+        self.sent = {}          # (车号, 指令类型) -> 发送时间
+        self.broadcast = {}     # 指令类型 -> 最近一次广播时间
+        self.latencies = {}     # 指令类型 -> 延迟列表（秒）
+        self.counts = {}
+        self.waiting = None
+        self.expected = None
+        broker.subscribe("car/+/cmd", self.on_command)
+        broker.subscribe("car/+/ack", self.on_ack)
+
+    def on_command(self, topic, payload):
+        command_type = json.loads(payload).get("command-type")
+        car_id = topic.split("/")[1]
+        if topic == BROADCAST_TOPIC:
+            self.broadcast[command_type] = time.perf_counter()
+        else:
+            self.sent[(car_id, command_type)] = time.perf_counter()
+
+    def on_ack(self, topic, payload):
+        now = time.perf_counter()
+        ack_type = json.loads(payload).get("command-type", "")
+        command_type = ack_type[len("ack_"):]
+        car_id = parse_ack_topic(topic)
+        sent = self.sent.pop((car_id, command_type), None)
+        if sent is None:
+            sent = self.broadcast.get(command_type)
+        if sent is not None:
+            self.latencies.setdefault(command_type, []).append(now - sent)
+        self.counts[ack_type] = self.counts.get(ack_type, 0) + 1
+        if self.waiting is not None and self.counts.get(self.expected[0], 0) >= self.expected[1]:
+            self.waiting.set()
+
+    async def wait_for(self, ack_type, count, timeout):
+        self.expected = (ack_type, count)
+        self.waiting = asyncio.Event()
+        if self.counts.get(ack_type, 0) < count:
+            try:
+                await asyncio.wait_for(self.waiting.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(q / 100 * len(sorted_values)))
+    return sorted_values[index]
+
+
+def report(probe, broker, elapsed, cars, rounds):
+    print(f"小车数量: {cars}，轮数: {rounds}，耗时: {elapsed:.3f}s")
+    print(f"消息总数: {broker.messages}，吞吐: {broker.messages / elapsed:.0f} msg/s")
+    for command_type, values in sorted(probe.latencies.items()):
+        values.sort()
+        print(
+            f"  {command_type:5s} n={len(values):7d}"
+            f"  p50={percentile(values, 50) * 1000:8.3f}ms"
+            f"  p90={percentile(values, 90) * 1000:8.3f}ms"
+            f"  p99={percentile(values, 99) * 1000:8.3f}ms"
+            f"  max={values[-1] * 1000:8.3f}ms"
+        )
+
+
+async def run(args):
+    import backend
+
+    broker = LocalBroker()
+    backend.mqttc = BrokerClient(broker)
+    for i in range(args.cars):
+        SimCar(f"sim{i:05d}", broker, args.delay_ms / 1000, args.jitter_ms / 1000)
+    probe = LatencyProbe(broker)
+
+    # 后端订阅所有小车的回复，消息以 paho MQTTMessage 的形式交给 backend.on_message
+    def to_backend(topic, payload):
+        backend.on_message(backend.mqttc, None, SimpleNamespace(topic=topic, payload=payload))
+    broker.subscribe("car/+/ack", to_backend)
+
+    start = time.perf_counter()
+    for r in range(1, args.rounds + 1):
+        backend.init_tasks()
+        if not await probe.wait_for("ack_task", r * args.cars, args.timeout):
+            print(f"第 {r} 轮超时，收到 ack_task {probe.counts.get('ack_task', 0)}/{r * args.cars}")
+            break
+    elapsed = time.perf_counter() - start
+    return probe, broker, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟小车车队，测试后端吞吐和延迟")
+    parser.add_argument("--cars", type=int, default=100, help="模拟小车数量")
+    parser.add_argument("--rounds", type=int, default=3, help="init -> task 的轮数")
+    parser.add_argument("--delay-ms", type=float, default=0, help="小车回复延迟（毫秒）")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="回复延迟的随机抖动（毫秒）")
+    parser.add_argument("--timeout", type=float, default=30, help="每轮等待回复的超时时间（秒）")
+    parser.add_argument("--verbose", action="store_true", help="显示后端的打印输出")
+    args = parser.parse_args()
+
+    if args.verbose:
+        probe, broker, elapsed = asyncio.run(run(args))
+    else:
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            probe, broker, elapsed = asyncio.run(run(args))
+    report(probe, broker, elapsed, args.cars, args.rounds)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import threading
+import time
+
+
+class LogPipeline:
+    """
+    前端日志的合并发送管道。
+    put() 只把日志放入队列，由后台线程按刷新间隔或积压字节数把多条日志
+    拼接成一个缓冲区，编码一次并调用一次 sink.sendall() 写出，
+    MQTT 网络线程不再为每条日志做一次编码和系统调用。
+    """
+
+    def __init__(self, sink=None, flush_interval=0.02, max_batch_bytes=64 * 1024, max_queue=10000):
+        self.sink = sink                        # 具有 sendall 方法的对象（socket 或 FrontendHub）
+        self.flush_interval = flush_interval    # 收到第一条日志后最多等待多久再写出（秒）
+        self.max_batch_bytes = max_batch_bytes  # 积压超过该字节数立即写出
+        self.max_queue = max_queue              # 队列最多容纳的日志条数，超出则丢弃
+        self.queue = []
+        self.queued_bytes = 0
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+        # 统计信息
+        self.dropped = 0
+        self.flushes = 0
+        self.sent_lines = 0
+        self.sent_bytes = 0
+        self.write_seconds = 0.0    # sendall 累计耗时
+        self.write_max = 0.0        # 单次 sendall 的最长耗时
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="log-pipeline", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        停止后台线程，队列中剩余的日志会在退出前写出。
+        """
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def put(self, line):
+        """
+        放入一条日志（不含换行），队列已满时丢弃并返回 False。
+        """
+        with self.cond:
+            if len(self.queue) >= self.max_queue:
+                self.dropped += 1
+                return False
+            self.queue.append(line)
+            self.queued_bytes += len(line) + 1
+            if len(self.queue) == 1 or self.queued_bytes >= self.max_batch_bytes:
+                self.cond.notify()
+        return True
+
+    def stats(self):
+        with self.cond:
+            return {
+                "queue_depth": len(self.queue),
+                "dropped": self.dropped,
+                "flushes": self.flushes,
+                "sent_lines": self.sent_lines,
+                "sent_bytes": self.sent_bytes,
+                "write_seconds": self.write_seconds,
+                "write_max": self.write_max,
+            }
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and not self.queue:
+                    self.cond.wait()
+                # 等待一个刷新间隔，把这段时间内的日志合并成一次写入
+                if self.running and self.queued_bytes < self.max_batch_bytes:
+                    self.cond.wait(self.flush_interval)
+                lines = self.queue
+                self.queue = []
+                self.queued_bytes = 0
+                running = self.running
+            if lines:
+                self._write(lines)
+            if not running:
+                return
+
+    def _write(self, lines):
+        # 计数器与 put() 共用 cond 的锁，sendall 在锁外进行
+        sink = self.sink
+        if sink is None:
+            with self.cond:
+                self.dropped += len(lines)
+            return
+        data = ("\n".join(lines) + "\n").encode()
+        start = time.perf_counter()
+        try:
+            sink.sendall(data)
+        except Exception as e:
+            with self.cond:
+                self.dropped += len(lines)
+            print(f"发送日志失败: {e}")
+            return
+        elapsed = time.perf_counter() - start
+        with self.cond:
+            self.write_seconds += elapsed
+            self.write_max = max(self.write_max, elapsed)
+            self.flushes += 1
+            self.sent_lines += len(lines)
+            self.sent_bytes += len(data)
@@ -69,6 +69,7 @@ class SocketCommunicator: ObservableObject {
             switch state {
             case .ready:
                 print("✅ 已成功连接到 \(host):\(port)")
+                self.send(message: "proto:1") // 协商换行分隔的指令协议
                 self.receive() // 开始监听消息
             case .failed(let error):
                 print("❌ 连接失败: \(error)")
@@ -87,7 +88,7 @@ class SocketCommunicator: ObservableObject {
             print("⚠️ 连接未建立")
             return
         }
-        let data = message.data(using: .utf8) ?? Data()
+        let data = (message + "\n").data(using: .utf8) ?? Data() // 每条指令以换行结尾
         connection.send(content: data, completion: .contentProcessed { error in
             if let error = error {
                 print("❌ 消息发送失败: \(error)")
@@ -0,0 +1,143 @@
+"""
+后端运行指标，以 Prometheus 文本格式通过 HTTP 暴露（只依赖标准库）。
+
+    metrics.inc("mqtt_messages_received_total", topic="car/1/ack", command_type="ack_task")
+    metrics.collect(lambda: [("log_queue_depth", {}, pipeline.stats()["queue_depth"])])
+    metrics.serve("127.0.0.1", 9100)   # GET /metrics
+
+计数器在事件发生处累加；队列深度等状态由 collect 注册的函数在每次抓取时读取。
+"""
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def process_rss_bytes():
+    """
+    当前进程的常驻内存。Linux 读 /proc/self/statm，其他系统退回到 ru_maxrss（峰值）。
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if os.uname().sysname == "Darwin" else rss * 1024
+    except (ImportError, AttributeError):
+        return 0
+
+
+class Metrics:
+    """
+    指标登记表。inc() 可以在任意线程中调用；collect() 注册的函数返回
+    (指标名, 标签字典, 值) 的列表，在渲染时调用。
+    """
+
+    def __init__(self):
+        self.counters = {}      # (指标名, 标签元组) -> 值
+        self.types = {}         # 指标名 -> (类型, 说明)
+        self.collectors = []
+        self.lock = threading.Lock()
+        self.server = None
+        self.start_time = time.time()
+        self.collect(self._process)
+
+    def describe(self, name, kind, help_text):
+        self.types[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def collect(self, func):
+        self.collectors.append(func)
+        return func
+
+    def render(self):
+        """
+        按 Prometheus 文本格式输出所有指标，同名指标的样本放在一起。
+        """
+        families = {}
+        with self.lock:
+            items = list(self.counters.items())
+        for (name, labels), value in items:
+            families.setdefault(name, []).append((labels, value))
+        for func in self.collectors:
+            try:
+                samples = func()
+            except Exception as e:
+                print(f"读取指标失败: {e}")
+                continue
+            for name, labels, value in samples:
+                families.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+        lines = []
+        for name in sorted(families):
+            kind, help_text = self.types.get(name, ("counter" if name.endswith("_total") else "gauge", ""))
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(families[name]):
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host="127.0.0.1", port=9100):
+        """
+        在后台线程中启动 HTTP 服务，GET /metrics 返回指标文本。
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # 不为每次抓取打印访问日志
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def _process(self):
+        return [
+            ("process_cpu_seconds_total", {}, time.process_time()),
+            ("process_resident_memory_bytes", {}, process_rss_bytes()),
+            ("process_start_time_seconds", {}, self.start_time),
+            ("process_threads", {}, threading.active_count()),
+        ]
@@ -0,0 +1,428 @@
+"""
+asyncio / uasyncio 版的 MQTT 客户端，小车上的传感器采样、电机控制和 MQTT 可以作为协作任务同时运行。
+
+与 micro_py.MQTTClient 相比：
+    connect / publish / subscribe / disconnect 都是协程，QoS 1 的 publish 和 subscribe 等待确认时不阻塞其他任务
+    connect 后后台读取任务持续接收报文，回复确认、处理 PINGRESP，按 keepalive 发送 PINGREQ
+    收到的消息放入固定容量的队列，用 async for topic, msg in client 逐条取出；读取任务从不等待队列
+    （否则等待确认的 publish 收不到 PUBACK），队列满时丢弃最早的消息并计入 dropped
+连接断开后等待中的协程和消息迭代抛出 OSError，由调用方决定是否重新 connect。
+
+报文编解码使用 mqttcodec.py，上传到小车时与本文件一起上传。
+main() 是小车程序的示例：动作用 await 等待，stop 指令在动作进行中立即生效。
+"""
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+try:
+    import ujson
+except ImportError:
+    import json as ujson
+
+import mqttcodec
+
+# 指令的二进制编码（carcodec.py 与本文件一起上传），没有该模块时只使用 JSON
+try:
+    import carcodec
+except ImportError:
+    carcodec = None
+
+QUEUE_SIZE = 16     # 收到但尚未取出的消息数上限
+
+
+class MQTTException(Exception):
+    pass
+
+
+class _Waiter:
+    # 等待某个报文 ID 的确认：Event 加上确认内容
+    __slots__ = ("event", "value")
+
+    def __init__(self):
+        self.event = asyncio.Event()
+        self.value = None
+
+
+class AsyncMQTTClient:
+    def __init__(self, client_id, server, port=1883, user=None, password=None, keepalive=0, queue_size=QUEUE_SIZE):
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.user = user
+        self.pswd = password
+        self.keepalive = keepalive
+        self.lw_topic = None
+        self.lw_msg = None
+        self.lw_qos = 0
+        self.lw_retain = False
+        self.reader = None
+        self.writer = None
+        self.lock = asyncio.Lock()      # 整包写出，多个任务发送时报文不会交错
+        self.tx = bytearray(128)
+        self.pid = 0
+        self.waiters = {}               # 报文 ID（CONNACK 为 0）-> _Waiter
+        self.rx_qos2 = set()
+        # 消息队列：固定容量的环形缓冲区，uasyncio 没有 Queue
+        self.queue = [None] * queue_size
+        self.q_head = 0
+        self.q_len = 0
+        self.q_put = asyncio.Event()    # 有新消息
+        self.dropped = 0                # 队列满时丢弃的消息数
+        self.error = None
+        self.tasks = []
+        self.ping_sent = False
+        self.connected = False
+
+    def set_last_will(self, topic, msg, retain=False, qos=0):
+        assert 0 <= qos <= 2
+        assert topic
+        self.lw_topic = topic
+        self.lw_msg = msg
+        self.lw_qos = qos
+        self.lw_retain = retain
+
+    # ---------------------------------------------------------------- 连接
+    async def connect(self, clean_session=True):
+        """
+        建立连接并启动后台任务，返回 Broker 是否保留了会话。
+        """
+        self.reader, self.writer = await asyncio.open_connection(self.server, self.port)
+        self.error = None
+        self.ping_sent = False
+        waiter = self.waiters[0] = _Waiter()
+        self.tasks = [asyncio.create_task(self._read_loop())]
+        if self.keepalive:
+            self.tasks.append(asyncio.create_task(self._ping_loop()))
+        async with self.lock:
+            self.tx, n = mqttcodec.connect(
+                self.tx, self.client_id, clean_session, self.keepalive, self.user, self.pswd,
+                self.lw_topic, self.lw_msg, self.lw_qos, self.lw_retain,
+            )
+            await self._write(memoryview(self.tx)[:n])
+        present, code = await self._wait(waiter)
+        if code != 0:
+            self._fail(MQTTException(code))
+            raise MQTTException(code)
+        self.connected = True
+        return present
+
+    async def disconnect(self):
+        try:
+            await self._send(mqttcodec.DISCONNECT_PACKET)
+        finally:
+            self._fail(OSError(-1))
+
+    def _fail(self, error):
+        # 关闭连接并停止其他后台任务，唤醒所有等待者，它们将抛出 error
+        if self.error is None:
+            self.error = error
+        self.connected = False
+        current = asyncio.current_task()
+        for task in self.tasks:
+            if task is not current:
+                task.cancel()
+        self.tasks = []
+        for waiter in self.waiters.values():
+            waiter.event.set()
+        self.waiters = {}
+        self.q_put.set()
+        if self.writer is not None:
+            try:
+                self.writer.close()
+            except OSError:
+                pass
+            self.writer = None
+
+    # ---------------------------------------------------------------- 发送
+    # 发送缓冲区 tx 被所有任务共用，组装报文和写出都在 lock 内完成
+    async def _write(self, data):
+        if self.error is not None:
+            raise self.error
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def _send(self, data):
+        async with self.lock:
+            await self._write(data)
+
+    async def _wait(self, waiter):
+        await waiter.event.wait()
+        if self.error is not None and waiter.value is None:
+            raise self.error
+        return waiter.value
+
+    def _next_pid(self):
+        while 1:
+            self.pid = self.pid % 65535 + 1
+            if self.pid not in self.waiters:
+                return self.pid
+
+    async def publish(self, topic, msg, retain=False, qos=0, wait=True):
+        """
+        发布消息；QoS 1 等到 PUBACK，QoS 2 等到 PUBCOMP 才返回，等待期间其他任务照常运行。
+        wait 为 False 时写出后立即返回，不等待确认（确认仍由读取任务处理）。
+        """
+        if isinstance(msg, str):
+            msg = msg.encode()
+        pid = 0
+        waiter = None
+        if qos:
+            pid = self._next_pid()
+            waiter = self.waiters[pid] = _Waiter()
+        async with self.lock:
+            self.tx, n = mqttcodec.publish(self.tx, topic, msg, qos, retain, pid)
+            await self._write(memoryview(self.tx)[:n])
+        if waiter is not None and wait:
+            await self._wait(waiter)
+
+    async def subscribe(self, topic, qos=0):
+        pid = self._next_pid()
+        waiter = self.waiters[pid] = _Waiter()
+        async with self.lock:
+            self.tx, n = mqttcodec.subscribe(self.tx, pid, topic, qos)
+            await self._write(memoryview(self.tx)[:n])
+        granted = await self._wait(waiter)
+        if granted == 0x80:
+            raise MQTTException(granted)
+        return granted
+
+    # ---------------------------------------------------------------- 接收
+    async def _read_packet(self):
+        reader = self.reader
+        head = bytearray(await reader.readexactly(1))
+        while 1:
+            head += await reader.readexactly(1)
+            got = mqttcodec.get_len(head, 1, len(head))
+            if got is not None:
+                break
+        n = got[0]
+        return head[0], (await reader.readexactly(n) if n else b"")
+
+    async def _read_loop(self):
+        try:
+            while 1:
+                op, body = await self._read_packet()
+                await self._handle(op, body)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:      # EOFError（uasyncio）、IncompleteReadError、OSError、MQTTCodecError
+            self._fail(e if isinstance(e, OSError) else OSError(-1))
+
+    async def _handle(self, op, body):
+        kind = op & 0xF0
+        if kind == mqttcodec.PUBLISH:
+            topic, pid, msg = mqttcodec.parse_publish(op, body)
+            qos = op & 6
+            if qos == 4:
+                await self._send(mqttcodec.ack(mqttcodec.PUBREC, pid))
+                if pid in self.rx_qos2:
+                    return      # 重发的 QoS 2 报文只投递一次
+                self.rx_qos2.add(pid)
+            self._put((topic, msg))
+            # 让出一次调度，消费者有机会在突发消息把队列填满之前取走消息（只让出，不等待消费者）
+            await asyncio.sleep(0)
+            if qos == 2:
+                await self._send(mqttcodec.ack(mqttcodec.PUBACK, pid))
+        elif kind == mqttcodec.CONNACK:
+            self._done(0, mqttcodec.parse_connack(body))
+        elif kind == mqttcodec.PUBACK or kind == mqttcodec.PUBCOMP:
+            self._done(mqttcodec.parse_ack(body), True)
+        elif kind == mqttcodec.PUBREC:
+            await self._send(mqttcodec.ack(mqttcodec.PUBREL | 0x02, mqttcodec.parse_ack(body)))
+        elif kind == mqttcodec.PUBREL:
+            pid = mqttcodec.parse_ack(body)
+            self.rx_qos2.discard(pid)
+            await self._send(mqttcodec.ack(mqttcodec.PUBCOMP, pid))
+        elif kind == mqttcodec.SUBACK:
+            pid, granted = mqttcodec.parse_suback(body)
+            self._done(pid, granted[0])
+        elif kind == mqttcodec.UNSUBACK:
+            self._done(mqttcodec.parse_ack(body), True)
+        elif kind == mqttcodec.PINGRESP:
+            self.ping_sent = False
+
+    def _done(self, pid, value):
+        waiter = self.waiters.pop(pid, None)
+        if waiter is not None:
+            waiter.value = value
+            waiter.event.set()
+
+    async def _ping_loop(self):
+        # 每 keepalive/2 秒发送 PINGREQ，下一次发送前还没有收到 PINGRESP 视为断线
+        interval = self.keepalive / 2
+        while 1:
+            await asyncio.sleep(interval)
+            if self.ping_sent:
+                self._fail(OSError(-2))
+                return
+            self.ping_sent = True
+            await self._send(mqttcodec.PINGREQ_PACKET)
+
+    # ---------------------------------------------------------------- 消息队列
+    def _put(self, item):
+        # 读取任务调用，不等待：队列满时丢弃最早的消息
+        size = len(self.queue)
+        if self.q_len == size:
+            self.queue[self.q_head] = None
+            self.q_head = (self.q_head + 1) % size
+            self.q_len -= 1
+            self.dropped += 1
+        self.queue[(self.q_head + self.q_len) % size] = item
+        self.q_len += 1
+        self.q_put.set()
+
+    async def get(self):
+        """
+        取出下一条消息 (topic, msg)，没有消息时等待；连接断开且队列为空时抛出 OSError。
+        """
+        while not self.q_len:
+            if self.error is not None:
+                raise self.error
+            self.q_put.clear()
+            await self.q_put.wait()
+        item = self.queue[self.q_head]
+        self.queue[self.q_head] = None
+        self.q_head = (self.q_head + 1) % len(self.queue)
+        self.q_len -= 1
+        return item
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.get()
+        except OSError:
+            raise StopAsyncIteration
+
+
+# ---------------------------------------------------------------- 小车程序示例
+try:
+    import machine
+    import ubinascii
+    CAR_ID = ubinascii.hexlify(machine.unique_id())
+except ImportError:
+    CAR_ID = b"umqtt_async"
+CMD_TOPIC = b"car/" + CAR_ID + b"/cmd"
+ACK_TOPIC = b"car/" + CAR_ID + b"/ack"
+BROADCAST_TOPIC = b"car/all/cmd"
+BROKER = "10.223.47.2"
+KEEPALIVE = 30
+
+# 每个路口动作的持续时间（秒）和四个电机的占空比 (BAIN2, BBIN2, FAIN2, FBIN2)，
+# 与 legacy/main.py 的 turn_* / go_straight 相同；到达路口先停车 CROSS_S 秒（cross()）
+MANEUVER_S = {"straight": 0.0, "left": 0.65, "right": 0.8, "tiny_left": 0.3, "tiny_right": 0.4}
+DUTIES = {
+    "straight": (430, 400, 400, 430),
+    "left": (0, 1000, 1000, 0),
+    "right": (1000, 300, 200, 1000),
+    "tiny_left": (400, 900, 900, 400),
+    "tiny_right": (1000, 300, 200, 1000),
+}
+STOP = (0, 0, 0, 0)
+CROSS_S = 1.0
+MOTOR_PINS = (25, 26, 4, 18)    # BAIN2 / BBIN2 / FAIN2 / FBIN2
+
+
+def motors():
+    """
+    返回四个电机的 PWM（引脚与 legacy/main.py 一致）；CPython 上没有 machine 模块时返回 None。
+    """
+    try:
+        from machine import Pin, PWM
+    except ImportError:
+        return None
+    return [PWM(Pin(pin)) for pin in MOTOR_PINS]
+
+
+class Car:
+    """
+    小车的协作任务：handle() 处理指令并回复，drive() 依次执行动作。
+    stop 指令设置 stop 事件并立即停车，正在进行的动作在下一次调度时就结束，不用等 sleep 走完。
+    回复只写出不等待 PUBACK，指令处理不受网络往返时间影响。
+    """
+
+    def __init__(self, client, pwms=None):
+        self.client = client
+        self.pwms = pwms                # motors() 的返回值，None 时只模拟时序
+        self.tasks = []
+        self.stop = asyncio.Event()
+        self.new_tasks = asyncio.Event()
+
+    async def handle(self, topic, msg):
+        binary = carcodec is not None and carcodec.is_binary(msg)
+        data = carcodec.decode(msg) if binary else ujson.loads(msg)
+        kind = data.get("command-type")
+        if kind == "stop":
+            self.stop.set()         # 先停车再回复
+            self.set_duty(STOP)
+            self.tasks = []
+        elif kind == "task":
+            self.tasks = list(data["tasks"])
+            self.stop.clear()
+            self.new_tasks.set()
+        elif kind != "init":
+            return
+        data["command-type"] = "ack_" + kind
+        if kind == "init":
+            data["path-id"] = 1
+        payload = carcodec.encode(data) if binary else None
+        await self.client.publish(ACK_TOPIC, payload or ujson.dumps(data), qos=1, wait=False)
+
+    def set_duty(self, duties):
+        if self.pwms is not None:
+            for pwm, duty in zip(self.pwms, duties):
+                pwm.duty(duty)
+
+    async def hold(self, seconds):
+        # 保持当前动作 seconds 秒，期间收到 stop 时提前返回 False
+        if seconds <= 0:
+            return not self.stop.is_set()
+        try:
+            await asyncio.wait_for(self.stop.wait(), seconds)
+            return False
+        except asyncio.TimeoutError:
+            return True
+
+    async def drive(self):
+        while 1:
+            await self.new_tasks.wait()
+            self.new_tasks.clear()
+            while self.tasks and not self.stop.is_set():
+                action = self.tasks.pop(0)
+                if action == "end":
+                    break
+                self.set_duty(STOP)
+                if not await self.hold(CROSS_S):
+                    break
+                self.set_duty(DUTIES.get(action, STOP))
+                if not await self.hold(MANEUVER_S.get(action, 0.0)):
+                    break
+            self.set_duty(STOP)
+
+
+async def run(broker=BROKER, port=1883):
+    client = AsyncMQTTClient(CAR_ID, broker, port, keepalive=KEEPALIVE)
+    await client.connect()
+    await client.subscribe(CMD_TOPIC, 1)
+    await client.subscribe(BROADCAST_TOPIC, 1)
+    car = Car(client, motors())
+    driver = asyncio.create_task(car.drive())
+    try:
+        async for topic, msg in client:
+            try:
+                await car.handle(topic, msg)
+            except (ValueError, KeyError) as e:
+                print("Failed to parse message:", e)
+    finally:
+        driver.cancel()
+
+
+def main(broker=BROKER, port=1883):
+    asyncio.run(run(broker, port))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,17 +6,187 @@ import time
 # import network            # TODO 联网模块 上单片机需要加入
 
 
-import usocket as socket
-import ustruct as struct
-from ubinascii import hexlify
+# 在 CPython 上也能导入（用于本地 Broker 测试和性能基准）
+try:
+    import usocket as socket
+    import ujson
+    import uselect as select
+except ImportError:
+    import socket
+    import json as ujson
+    import select
+
+# MQTT 报文编解码（mqttcodec.py 与本文件一起上传）
+import mqttcodec
+
+# 指令的二进制编码（carcodec.py 与本文件一起上传），没有该模块时只使用 JSON
+try:
+    import carcodec
+except ImportError:
+    carcodec = None
 
-import ujson
+
+TX_INLINE_MAX = 512  # 负载不超过该长度时复制进发送缓冲区，与报文头一起发送
+RETRY_MS = 5000      # QoS>0 报文超过该时间未确认则置 DUP 重发
+BACKOFF_MIN_MS = 500     # 断线重连的初始退避时间
+BACKOFF_MAX_MS = 30000   # 断线重连的最大退避时间
+TICK_MS = 20             # run() 的控制循环周期，也是等待报文的最长时间
+ACK_OPS = (0x40, 0x50, 0x62, 0x70)  # PUBACK / PUBREC / PUBREL / PUBCOMP
+
+try:
+    ticks_ms = time.ticks_ms
+    ticks_diff = time.ticks_diff
+except AttributeError:
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_diff(a, b):
+        return a - b
+
+try:
+    ticks_add = time.ticks_add
+except AttributeError:
+    def ticks_add(a, b):
+        return a + b
+
+try:
+    sleep_ms = time.sleep_ms
+except AttributeError:
+    def sleep_ms(ms):
+        time.sleep(ms / 1000)
+
+try:
+    from urandom import getrandbits
+except ImportError:
+    from random import getrandbits
 
 
 class MQTTException(Exception):
     pass
 
 
+class _StreamSocket:
+    """
+    CPython 的 socket 没有 read/write，这里提供与 MicroPython socket 相同的接口。
+    read(n) 读满 n 字节才返回；非阻塞模式下没有数据时返回 None。
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        # 报文由多次小的 write 组成，关闭 Nagle 避免与延迟 ACK 叠加产生几十毫秒的等待
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def read(self, n):
+        try:
+            data = self.sock.recv(n)
+        except BlockingIOError:
+            return None
+        if len(data) == n or not data:
+            return data
+        buf = bytearray(data)
+        self.sock.setblocking(True)
+        while len(buf) < n:
+            chunk = self.sock.recv(n - len(buf))
+            if not chunk:
+                raise OSError(-1)
+            buf += chunk
+        return bytes(buf)
+
+    def readinto(self, buf, n=0):
+        try:
+            return self.sock.recv_into(buf, n)
+        except BlockingIOError:
+            return None
+
+    def write(self, buf, n=None):
+        if n is not None:
+            buf = memoryview(buf)[:n]
+        self.sock.sendall(buf)
+        return len(buf)
+
+    def setblocking(self, flag):
+        self.sock.setblocking(flag)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+
+class OutQueue:
+    """
+    固定容量的待发布队列（环形缓冲区），put() 从不阻塞：
+    带 key 的消息（遥测）与队列中 key 相同的旧消息合并，只保留最新的内容；
+    队列满时丢弃最早的 QoS 0 消息，全是 QoS>0 的消息时丢弃最早的一条。
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.topic = [None] * size
+        self.msg = [None] * size
+        self.key = [None] * size
+        self.flags = bytearray(size)    # qos << 1 | retain
+        self.head = 0
+        self.len = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return self.len
+
+    def put(self, topic, msg, qos=0, retain=False, key=None):
+        size = self.size
+        flags = qos << 1 | retain
+        if key is not None:
+            for i in range(self.len):
+                j = (self.head + i) % size
+                if self.key[j] == key:
+                    self.topic[j] = topic
+                    self.msg[j] = msg
+                    self.flags[j] = flags
+                    self.coalesced += 1
+                    return
+        if self.len == size:
+            self._evict()
+        j = (self.head + self.len) % size
+        self.topic[j] = topic
+        self.msg[j] = msg
+        self.key[j] = key
+        self.flags[j] = flags
+        self.len += 1
+
+    def _evict(self):
+        # 找到最早的 QoS 0 消息，把它之前的消息依次后移一格覆盖它，再丢弃队首
+        size = self.size
+        head = self.head
+        victim = 0
+        for i in range(self.len):
+            if not self.flags[(head + i) % size] & 6:
+                victim = i
+                break
+        for i in range(victim, 0, -1):
+            a = (head + i) % size
+            b = (head + i - 1) % size
+            self.topic[a] = self.topic[b]
+            self.msg[a] = self.msg[b]
+            self.key[a] = self.key[b]
+            self.flags[a] = self.flags[b]
+        self.pop()
+        self.dropped += 1
+
+    def pop(self):
+        """
+        取出队首的 (topic, msg, flags)。
+        """
+        j = self.head
+        item = (self.topic[j], self.msg[j], self.flags[j])
+        self.topic[j] = self.msg[j] = self.key[j] = None
+        self.head = (j + 1) % self.size
+        self.len -= 1
+        return item
+
+
 class MQTTClient:
     def __init__(
         self,
@@ -28,6 +198,9 @@ class MQTTClient:
         keepalive=0,
         ssl=False,
         ssl_params={},
+        rx_buf_size=0,
+        max_inflight=1,
+        out_queue=0,
     ):
         if port == 0:
             port = 8883 if ssl else 1883
@@ -46,23 +219,171 @@ class MQTTClient:
         self.lw_msg = None
         self.lw_qos = 0
         self.lw_retain = False
-
-    def _send_str(self, s):
-        self.sock.write(struct.pack("!H", len(s)))
-        self.sock.write(s)
+        self.cb_copy = False
+        # rx_buf_size > 0 时使用预分配的接收缓冲区：readinto 批量读入，
+        # 报文字段以 memoryview 切片的形式取出，不为每个字段分配新的 bytes
+        self.rx = None
+        if rx_buf_size:
+            self.rx = bytearray(rx_buf_size)
+            self.rxmv = memoryview(self.rx)
+        self.rx_start = 0
+        self.rx_end = 0
+        self.poller = None
+        self.wpoller = None     # 只关注可写事件，flush() 用来判断发送缓冲区是否还有空间
+        self.blocking = True    # socket 当前的阻塞模式，只在变化时调用 setblocking
+        self.tx = bytearray(128)  # 可复用的发送缓冲区，报文更大时由 mqttcodec 重新分配
+        # QoS 1/2 在途窗口：固定大小的表，每个槽位记录报文 ID、状态、发送时间和报文内容。
+        # 状态 1 等待 PUBACK，2 等待 PUBREC，3 已发 PUBREL 等待 PUBCOMP
+        # max_inflight 为 1 时与原来一样，publish 等到确认后才返回
+        self.inflight_max = max(1, max_inflight)
+        self.inflight = 0
+        self.if_pid = [0] * self.inflight_max
+        self.if_state = bytearray(self.inflight_max)
+        self.if_time = [0] * self.inflight_max
+        self.if_pkt = [None] * self.inflight_max
+        self.rx_qos2 = set()  # 已收到、尚未收到 PUBREL 的入站 QoS 2 报文 ID
+        self.last_tx = 0        # 最近一次发送报文的时间，用于判断何时需要 PINGREQ
+        self.ping_sent = None   # 已发送 PINGREQ、尚未收到 PINGRESP 时为发送时间
+        # out_queue > 0 时 enqueue() 把消息放进待发布队列，由 flush() 在 socket 可写时发送，
+        # 回调和控制循环不会因为网络拥塞而阻塞在 publish 上
+        self.outq = OutQueue(out_queue) if out_queue else None
+
+    def _fill(self):
+        # 把未处理的数据移到缓冲区开头，再从 socket 读入尽可能多的数据
+        start = self.rx_start
+        end = self.rx_end
+        if start:
+            if start < end:
+                self.rxmv[0:end - start] = self.rxmv[start:end]
+            end -= start
+            self.rx_start = 0
+            self.rx_end = end
+        n = self.sock.readinto(self.rxmv[end:])
+        if n is None:
+            return None
+        if n == 0:
+            raise OSError(-1)
+        self.rx_end = end + n
+        return n
+
+    def _read(self, n):
+        # 读取 n 字节。缓冲模式下返回接收缓冲区的 memoryview，
+        # 下一次 _read 之后内容可能被覆盖
+        if self.rx is None:
+            return self.sock.read(n)
+        if n > len(self.rx):
+            # 超过接收缓冲区的报文，退回到分配内存的读取方式
+            data = bytearray(n)
+            have = self.rx_end - self.rx_start
+            data[0:have] = self.rxmv[self.rx_start:self.rx_end]
+            self.rx_start = self.rx_end = 0
+            view = memoryview(data)
+            while have < n:
+                got = self.sock.readinto(view[have:])
+                if not got:
+                    raise OSError(-1)
+                have += got
+            return data
+        while self.rx_end - self.rx_start < n:
+            self._fill()
+        start = self.rx_start
+        self.rx_start = start + n
+        return self.rxmv[start:start + n]
+
+    def _next_pid(self):
+        # 报文 ID 在 1..65535 间循环，跳过仍在途的 ID
+        while 1:
+            self.pid = self.pid % 65535 + 1
+            if self._slot(self.pid) < 0:
+                return self.pid
+
+    def _slot(self, pid):
+        if self.inflight:
+            for i in range(self.inflight_max):
+                if self.if_pid[i] == pid:
+                    return i
+        return -1
+
+    def _track(self, pid, qos, pkt):
+        i = self._slot(0)
+        if i < 0:
+            i = self.if_pid.index(0)
+        self.if_pid[i] = pid
+        self.if_state[i] = 1 if qos == 1 else 2
+        self.if_time[i] = ticks_ms()
+        self.if_pkt[i] = pkt
+        self.inflight += 1
+
+    def _release(self, i):
+        self.if_pid[i] = 0
+        self.if_state[i] = 0
+        self.if_pkt[i] = None
+        self.inflight -= 1
+
+    def _on_ack(self, op, pid):
+        # 处理 PUBACK / PUBREC / PUBREL / PUBCOMP
+        if op == 0x62:
+            # 入站 QoS 2：收到 PUBREL 后回复 PUBCOMP
+            self.rx_qos2.discard(pid)
+            self.sock.write(mqttcodec.ack(mqttcodec.PUBCOMP, pid))
+            return
+        i = self._slot(pid)
+        if i < 0:
+            return
+        if op == 0x50:
+            if self.if_state[i] == 2:
+                rel = bytearray(mqttcodec.ack(mqttcodec.PUBREL | 0x02, pid))
+                self.if_pkt[i] = rel
+                self.if_state[i] = 3
+                self.if_time[i] = ticks_ms()
+                self.sock.write(rel)
+        elif (op == 0x40 and self.if_state[i] == 1) or (op == 0x70 and self.if_state[i] == 3):
+            self._release(i)
+
+    def retry(self, timeout_ms=RETRY_MS):
+        """
+        重发超时未确认的报文：PUBLISH 置 DUP 位重发，PUBREL 原样重发。
+        """
+        if not self.inflight:
+            return
+        now = ticks_ms()
+        for i in range(self.inflight_max):
+            if self.if_pid[i] and ticks_diff(now, self.if_time[i]) >= timeout_ms:
+                pkt = self.if_pkt[i]
+                if self.if_state[i] != 3:
+                    pkt[0] |= 0x08
+                self.if_time[i] = now
+                self.sock.write(pkt)
+                self.last_tx = now
+
+    def wait_inflight(self, limit=1):
+        """
+        处理收到的报文，直到在途报文数小于 limit（limit=1 即等待全部确认）。
+        """
+        while self.inflight >= limit:
+            if self._readable(100):
+                self.wait_msg()
+            self.retry()
+
+    def _set_blocking(self, flag):
+        if self.blocking is not flag:
+            self.sock.setblocking(flag)
+            self.blocking = flag
+
+    def _readable(self, timeout_ms):
+        # 接收缓冲区里还有未处理的数据，或 socket 在 timeout_ms 内变为可读
+        if self.rx_start != self.rx_end:
+            return True
+        return bool(self.poller.poll(timeout_ms))
 
     def _recv_len(self):
-        n = 0
-        sh = 0
-        while 1:
-            b = self.sock.read(1)[0]
-            n |= (b & 0x7F) << sh
-            if not b & 0x80:
-                return n
-            sh += 7
+        return mqttcodec.read_len(self._read)
 
-    def set_callback(self, f):
+    def set_callback(self, f, copy=False):
+        # 缓冲模式下回调收到的 topic/msg 是接收缓冲区的 memoryview，只在回调期间有效；
+        # 回调需要保存数据时设置 copy=True，回调将收到 bytes 副本
         self.cb = f
+        self.cb_copy = copy
 
     def set_last_will(self, topic, msg, retain=False, qos=0):
         assert 0 <= qos <= 2
@@ -76,107 +397,104 @@ class MQTTClient:
         self.sock = socket.socket()
         addr = socket.getaddrinfo(self.server, self.port)[0][-1]
         self.sock.connect(addr)
+        if not hasattr(self.sock, "read"):
+            self.sock = _StreamSocket(self.sock)
         if self.ssl:
             import ussl
 
             self.sock = ussl.wrap_socket(self.sock, **self.ssl_params)
-        premsg = bytearray(b"\x10\0\0\0\0\0")
-        msg = bytearray(b"\x04MQTT\x04\x02\0\0")
-
-        sz = 10 + 2 + len(self.client_id)
-        msg[6] = clean_session << 1
-        if self.user is not None:
-            sz += 2 + len(self.user) + 2 + len(self.pswd)
-            msg[6] |= 0xC0
-        if self.keepalive:
-            assert self.keepalive < 65536
-            msg[7] |= self.keepalive >> 8
-            msg[8] |= self.keepalive & 0x00FF
-        if self.lw_topic:
-            sz += 2 + len(self.lw_topic) + 2 + len(self.lw_msg)
-            msg[6] |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
-            msg[6] |= self.lw_retain << 5
-
-        i = 1
-        while sz > 0x7F:
-            premsg[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        premsg[i] = sz
-
-        self.sock.write(premsg, i + 2)
-        self.sock.write(msg)
-        # print(hex(len(msg)), hexlify(msg, ":"))
-        self._send_str(self.client_id)
-        if self.lw_topic:
-            self._send_str(self.lw_topic)
-            self._send_str(self.lw_msg)
-        if self.user is not None:
-            self._send_str(self.user)
-            self._send_str(self.pswd)
-        resp = self.sock.read(4)
-        assert resp[0] == 0x20 and resp[1] == 0x02
-        if resp[3] != 0:
-            raise MQTTException(resp[3])
-        return resp[2] & 1
+        self.rx_start = self.rx_end = 0
+        self.ping_sent = None
+        self.blocking = True
+        self.poller = select.poll()
+        self.poller.register(self.sock, select.POLLIN)
+        self.wpoller = select.poll()
+        self.wpoller.register(self.sock, select.POLLOUT)
+        # 整个 CONNECT 报文组装到发送缓冲区，一次 write 发出
+        self.tx, n = mqttcodec.connect(
+            self.tx, self.client_id, clean_session, self.keepalive, self.user, self.pswd,
+            self.lw_topic, self.lw_msg, self.lw_qos, self.lw_retain,
+        )
+        self.sock.write(self.tx, n)
+        self.last_tx = ticks_ms()
+        resp = self._read(4)
+        assert resp[0] == mqttcodec.CONNACK and resp[1] == 0x02
+        present, code = mqttcodec.parse_connack(resp[2:4])
+        if code != 0:
+            raise MQTTException(code)
+        return present
 
     def disconnect(self):
-        self.sock.write(b"\xe0\0")
+        self.sock.write(mqttcodec.DISCONNECT_PACKET)
         self.sock.close()
 
     def ping(self):
-        self.sock.write(b"\xc0\0")
+        self.sock.write(mqttcodec.PINGREQ_PACKET)
+        self.ping_sent = self.last_tx = ticks_ms()
 
     def publish(self, topic, msg, retain=False, qos=0):
-        pkt = bytearray(b"\x30\0\0\0")
-        pkt[0] |= qos << 1 | retain
-        sz = 2 + len(topic) + len(msg)
+        self._publish(topic, msg, retain, qos)
         if qos > 0:
-            sz += 2
-        assert sz < 2097152
-        i = 1
-        while sz > 0x7F:
-            pkt[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        pkt[i] = sz
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt, i + 1)
-        self._send_str(topic)
+            # 在途窗口满时等待确认
+            self.wait_inflight(self.inflight_max)
+
+    def _publish(self, topic, msg, retain, qos):
+        if isinstance(msg, str):
+            msg = msg.encode()  # ujson.dumps 返回 str，组装报文前转换为 bytes
+        assert 2 + len(topic) + len(msg) < 2097152
+        # 固定头、主题、报文 ID 和负载组装到发送缓冲区，一次 write 发出；
+        # 负载超过 TX_INLINE_MAX 时不复制，负载单独再 write 一次
+        inline = len(msg) <= TX_INLINE_MAX
+        pid = self._next_pid() if qos > 0 else 0
+        self.tx, n = mqttcodec.publish(self.tx, topic, msg, qos, retain, pid, inline=inline)
+        buf = self.tx
         if qos > 0:
-            self.pid += 1
-            pid = self.pid
-            struct.pack_into("!H", pkt, 0, pid)
-            self.sock.write(pkt, 2)
-        self.sock.write(msg)
-        if qos == 1:
-            while 1:
-                op = self.wait_msg()
-                if op == 0x40:
-                    sz = self.sock.read(1)
-                    assert sz == b"\x02"
-                    rcv_pid = self.sock.read(2)
-                    rcv_pid = rcv_pid[0] << 8 | rcv_pid[1]
-                    if pid == rcv_pid:
-                        return
-        elif qos == 2:
-            assert 0
+            # 先保存报文副本再发送，发送失败时报文仍在在途表中，重连后可以重发
+            pkt = bytearray(buf[:n])
+            if not inline:
+                pkt += msg
+            self._track(pid, qos, pkt)
+        self.sock.write(buf, n)
+        if not inline:
+            self.sock.write(msg)
+        self.last_tx = ticks_ms()
+
+    def enqueue(self, topic, msg, qos=0, retain=False, key=None):
+        """
+        不阻塞地发布：放进待发布队列，由 flush() 发送；没有启用队列（out_queue=0）时直接 publish。
+        key 不为 None 时与队列中相同 key 的消息合并（用于只关心最新值的遥测）。
+        """
+        if self.outq is None:
+            return self.publish(topic, msg, retain, qos)
+        self.outq.put(topic, msg, qos, retain, key)
+
+    def flush(self):
+        """
+        发送待发布队列中的消息，直到队列为空、socket 不可写或 QoS>0 的在途窗口已满，返回发送的条数。
+        """
+        q = self.outq
+        n = 0
+        while q is not None and q.len:
+            if q.flags[q.head] & 6 and self.inflight >= self.inflight_max:
+                break
+            if not self.wpoller.poll(0):
+                break
+            topic, msg, flags = q.pop()
+            self._publish(topic, msg, flags & 1, flags >> 1)
+            n += 1
+        return n
 
     def subscribe(self, topic, qos=0):
         assert self.cb is not None, "Subscribe callback is not set"
-        pkt = bytearray(b"\x82\0\0\0")
-        self.pid += 1
-        struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic) + 1, self.pid)
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt)
-        self._send_str(topic)
-        self.sock.write(qos.to_bytes(1, "little"))
+        self.tx, n = mqttcodec.subscribe(self.tx, self._next_pid(), topic, qos)
+        self.sock.write(self.tx, n)
+        self.last_tx = ticks_ms()
         while 1:
             op = self.wait_msg()
             if op == 0x90:
-                resp = self.sock.read(4)
+                resp = self._read(4)
                 # print(resp)
-                assert resp[1] == pkt[2] and resp[2] == pkt[3]
+                assert resp[1] << 8 | resp[2] == self.pid
                 if resp[3] == 0x80:
                     raise MQTTException(resp[3])
                 return
@@ -186,8 +504,10 @@ class MQTTClient:
     # set by .set_callback() method. Other (internal) MQTT
     # messages processed internally.
     def wait_msg(self):
+        if self.rx is not None:
+            return self._wait_msg_buffered()
         res = self.sock.read(1)
-        self.sock.setblocking(True)
+        self._set_blocking(True)
         if res is None:
             return None
         if res == b"":
@@ -195,39 +515,227 @@ class MQTTClient:
         if res == b"\xd0":  # PINGRESP
             sz = self.sock.read(1)[0]
             assert sz == 0
+            self.ping_sent = None
             return None
         op = res[0]
         if op & 0xF0 != 0x30:
+            if op in ACK_OPS:
+                ack = self.sock.read(3)
+                self._on_ack(op, ack[1] << 8 | ack[2])
             return op
         sz = self._recv_len()
         topic_len = self.sock.read(2)
         topic_len = (topic_len[0] << 8) | topic_len[1]
         topic = self.sock.read(topic_len)
         sz -= topic_len + 2
+        pid = 0
         if op & 6:
             pid = self.sock.read(2)
             pid = pid[0] << 8 | pid[1]
             sz -= 2
         msg = self.sock.read(sz)
-        self.cb(topic, msg)
-        if op & 6 == 2:
-            pkt = bytearray(b"\x40\x02\0\0")
-            struct.pack_into("!H", pkt, 2, pid)
-            self.sock.write(pkt)
-        elif op & 6 == 4:
-            assert 0
+        self._deliver(op, pid, topic, msg)
+
+    def _deliver(self, op, pid, topic, msg):
+        # 把消息交给回调并按 QoS 回复确认；重发的 QoS 2 报文只交给回调一次
+        qos = op & 6
+        if qos == 4:
+            if pid in self.rx_qos2:
+                self.sock.write(mqttcodec.ack(mqttcodec.PUBREC, pid))
+                return
+            self.rx_qos2.add(pid)
+        if self.cb_copy:
+            self.cb(bytes(topic), bytes(msg))
+        else:
+            self.cb(topic, msg)
+        if qos == 2:
+            self.sock.write(mqttcodec.ack(mqttcodec.PUBACK, pid))
+        elif qos == 4:
+            self.sock.write(mqttcodec.ack(mqttcodec.PUBREC, pid))
+
+    def _wait_msg_buffered(self):
+        # 与 wait_msg 相同，但整个报文体一次从接收缓冲区取出，
+        # topic 和 msg 是报文体的 memoryview 切片
+        if self.rx_start == self.rx_end and self._fill() is None:
+            return None
+        self._set_blocking(True)
+        op = self._read(1)[0]
+        if op == 0xD0:  # PINGRESP
+            sz = self._read(1)[0]
+            assert sz == 0
+            self.ping_sent = None
+            return None
+        if op & 0xF0 != 0x30:
+            if op in ACK_OPS:
+                ack = self._read(3)
+                self._on_ack(op, ack[1] << 8 | ack[2])
+            return op
+        topic, pid, msg = mqttcodec.parse_publish(op, self._read(self._recv_len()))
+        self._deliver(op, pid, topic, msg)
 
     # Checks whether a pending message from server is available.
     # If not, returns immediately with None. Otherwise, does
     # the same processing as wait_msg.
     def check_msg(self):
-        self.sock.setblocking(False)
+        self._set_blocking(False)
         return self.wait_msg()
 
+    def drain(self):
+        """
+        处理所有已经到达的报文，不等待新数据，返回处理的报文数。
+        """
+        n = 0
+        while self._readable(0):
+            self.wait_msg()
+            n += 1
+        return n
+
+    def service(self):
+        # run() 每次唤醒时调用：处理收到的报文，发送待发布队列，重发超时未确认的报文
+        self.drain()
+        self.flush()
+        self.retry()
+
+    def run(self, tick=None, tick_ms=TICK_MS):
+        """
+        事件循环：用 poll 等待 socket 可读，最长等到下一个控制周期，
+        每次唤醒处理完所有已到达的报文，每 tick_ms 毫秒调用一次 tick()（小车的运动逻辑）。
+        指令到达后几毫秒内交给回调，不必等固定的 sleep 结束；tick() 返回 False 时退出循环。
+        socket 保持阻塞模式，不再每次切换 setblocking。
+        """
+        next_tick = ticks_add(ticks_ms(), tick_ms)
+        while 1:
+            wait = ticks_diff(next_tick, ticks_ms())
+            if wait > 0 and self.rx_start == self.rx_end:
+                self.poller.poll(wait)
+            self.service()
+            now = ticks_ms()
+            if ticks_diff(now, next_tick) >= 0:
+                if tick is not None and tick() is False:
+                    return
+                next_tick = ticks_add(next_tick, tick_ms)
+                if ticks_diff(now, next_tick) >= 0:
+                    # tick() 运行超过一个周期时不补跑，从现在重新计时
+                    next_tick = ticks_add(now, tick_ms)
+
+
+class RobustMQTTClient(MQTTClient):
+    """
+    带保活和断线重连的客户端。
+    check_msg 按 keepalive 的一半定时发送 PINGREQ，同样时间内没有收到 PINGRESP 视为断线；
+    网络错误时按指数退避（带随机抖动）重连，不再重启单片机。
+    默认以 clean_session=False 连接，Broker 保留订阅和未确认的报文；
+    Broker 没有保留会话时重新订阅，重连后立即重发在途窗口中的报文。
+    """
+
+    def __init__(self, client_id, server, port=0, backoff_min_ms=BACKOFF_MIN_MS, backoff_max_ms=BACKOFF_MAX_MS, **kw):
+        MQTTClient.__init__(self, client_id, server, port, **kw)
+        self.backoff_min_ms = backoff_min_ms
+        self.backoff_max_ms = backoff_max_ms
+        self.clean_session = False
+        self.subs = []       # 已订阅的 (主题, QoS)，会话丢失时重新订阅
+        self.reconnects = 0
+
+    def connect(self, clean_session=False):
+        self.clean_session = clean_session
+        return MQTTClient.connect(self, clean_session)
+
+    def reconnect(self):
+        """
+        关闭旧连接并重连，直到成功为止，返回尝试的次数。
+        第一次立即重试，之后每次失败等待 [delay/2, delay) 毫秒，delay 从 backoff_min_ms 翻倍到 backoff_max_ms，
+        随机抖动避免整个车队在 Broker 恢复时同时重连。
+        """
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        delay = self.backoff_min_ms
+        attempt = 0
+        while 1:
+            attempt += 1
+            try:
+                if not MQTTClient.connect(self, self.clean_session):
+                    for topic, qos in self.subs:
+                        MQTTClient.subscribe(self, topic, qos)
+                MQTTClient.retry(self, 0)  # 立即重发所有在途报文
+                self.reconnects += 1
+                return attempt
+            except (OSError, MQTTException) as e:
+                print("重连失败:", attempt, e)
+            half = delay // 2
+            sleep_ms(half + getrandbits(16) * half // 65536)
+            delay = min(delay * 2, self.backoff_max_ms)
+
+    def _keepalive(self):
+        if not self.keepalive:
+            return
+        now = ticks_ms()
+        if self.ping_sent is not None:
+            if ticks_diff(now, self.ping_sent) >= self.keepalive * 500:
+                raise OSError(-2)  # PINGRESP 超时，连接已失效
+        elif ticks_diff(now, self.last_tx) >= self.keepalive * 500:
+            self.ping()
+
+    def subscribe(self, topic, qos=0):
+        if (topic, qos) not in self.subs:
+            self.subs.append((topic, qos))
+        while 1:
+            try:
+                return MQTTClient.subscribe(self, topic, qos)
+            except OSError as e:
+                print("连接断开:", e)
+                self.reconnect()
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        while 1:
+            pid = self.pid
+            try:
+                return MQTTClient.publish(self, topic, msg, retain, qos)
+            except OSError as e:
+                print("连接断开:", e)
+                self.reconnect()
+            if qos and self.pid != pid:
+                # 报文 ID 已分配说明报文已进入在途表，重连时已经重发，不能再发布一次
+                return self.wait_inflight(self.inflight_max)
+
+    def wait_inflight(self, limit=1):
+        while 1:
+            try:
+                return MQTTClient.wait_inflight(self, limit)
+            except OSError as e:
+                print("连接断开:", e)
+                self.reconnect()
+
+    def retry(self, timeout_ms=RETRY_MS):
+        try:
+            MQTTClient.retry(self, timeout_ms)
+        except OSError as e:
+            print("连接断开:", e)
+            self.reconnect()
+
+    def check_msg(self):
+        try:
+            self._keepalive()
+            return MQTTClient.check_msg(self)
+        except OSError as e:
+            print("连接断开:", e)
+            self.reconnect()
+
+    def service(self):
+        try:
+            self._keepalive()
+            MQTTClient.service(self)
+        except OSError as e:
+            print("连接断开:", e)
+            self.reconnect()
+
 
 
 
 def do_connect():
+    import network
     wlan = network.WLAN(network.STA_IF)
     wlan.active(True)
     if not wlan.isconnected():
@@ -242,86 +750,216 @@ def do_connect():
 
 
 
+# 二进制指令类型码对应的指令名，顺序与 carcodec.COMMANDS 一致（下标 0 不使用）
+_BINARY_TYPES = (None, b"init", b"task", b"stop", b"online", b"car-message")
+_ACK_CODES = {b"init": 1, b"task": 2, b"stop": 3}
+# JSON 回复模板：只带回后端用到的字段（指令类型、path-id、关联 ID），不再序列化整个收到的指令
+_ACK_JSON = {
+    b"init": b'{"command-type": "ack_init"',
+    b"task": b'{"command-type": "ack_task"',
+    b"stop": b'{"command-type": "ack_stop"',
+}
+
+
+def command_type(msg, binary):
+    """
+    不解析整条消息，直接从原始字节中取出指令类型（bytes），取不到时返回 None。
+    后端发送的 JSON 指令以 "command-type" 字段开头，只需查找一次。
+    """
+    if binary:
+        code = msg[1] & 0x7F if len(msg) > 2 else 0
+        return _BINARY_TYPES[code] if code < len(_BINARY_TYPES) else None
+    i = msg.find(b'"command-type"')
+    if i < 0:
+        return None
+    i = msg.find(b'"', msg.find(b":", i + 14) + 1)
+    j = msg.find(b'"', i + 1)
+    if i < 0 or j < 0:
+        return None
+    return msg[i + 1:j]
+
+
+def command_cid(msg, binary):
+    """
+    取出指令中的关联 ID（bytes，随回复原样带回后端），没有时返回 None。
+    """
+    if binary:
+        flags = msg[2]
+        if not flags & carcodec.F_CID:
+            return None
+        pos = 3
+        if flags & carcodec.F_PATH:
+            pos += 1
+        if flags & carcodec.F_TASKS:
+            pos += 1 + (msg[pos] + 1) // 2
+        return msg[pos + 1:pos + 1 + msg[pos]]
+    i = msg.find(b'"cid"')
+    if i < 0:
+        return None
+    i = msg.find(b'"', msg.find(b":", i + 5) + 1)
+    j = msg.find(b'"', i + 1)
+    if i < 0 or j < 0:
+        return None
+    return msg[i + 1:j]
+
+
+def ack_payload(kind, cid=None, path_id=None, binary=False):
+    """
+    按模板生成指令回复：kind 为收到的指令类型（b"init" 等）。
+    二进制无法表示的 path-id（不是 0~255 的整数）退回 JSON。
+    """
+    if binary and (path_id is None or isinstance(path_id, int) and 0 <= path_id <= 255):
+        out = bytearray((carcodec.VERSION, carcodec.ACK | _ACK_CODES[kind], 0))
+        if path_id is not None:
+            out[2] |= carcodec.F_PATH
+            out.append(path_id)
+        if cid is not None:
+            out[2] |= carcodec.F_CID
+            out.append(len(cid))
+            out.extend(cid)
+        return out
+    out = _ACK_JSON[kind]
+    if path_id is not None:
+        out += b', "path-id": ' + ujson.dumps(path_id).encode()
+    if cid is not None:
+        out += b', "cid": "' + cid + b'"'
+    return out + b"}"
+
+
+def on_init(msg, binary):
+    global path_id
+    try: 
+        import urandom
+        route = urandom.randint(1, 2)
+    except:
+        path_id += 1
+        if path_id > 2:
+            path_id = 1
+        route = path_id
+    reply(ack_payload(b"init", command_cid(msg, binary), route, binary))
+
+
+def on_task(msg, binary):
+    # 只有任务指令需要完整解析（动作列表）
+    global m
+    data = carcodec.decode(msg) if binary else ujson.loads(msg)
+    reply(ack_payload(b"task", command_cid(msg, binary), data.get("path-id"), binary))
+    m = data["tasks"]
+
+
+def on_stop(msg, binary):
+    # 停止指令不解析消息体，后端发送的 stop 总是带 ["end"]
+    global m
+    m = ["end"]
+    reply(ack_payload(b"stop", command_cid(msg, binary), None, binary))
+
+
+# 指令类型 -> 处理函数，每个处理函数负责回复
+HANDLERS = {b"init": on_init, b"task": on_task, b"stop": on_stop}
+
+
 def sub_cb(topic, msg): 
     """
     小车MQTT通信回调函数
+    先从原始字节取出指令类型，再交给 HANDLERS 中对应的处理函数，回复按模板生成。
+    topic / msg 为 memoryview（set_callback 未设置 copy）时先转换为 bytes，快速解析只处理 bytes。
     """
+    if not isinstance(topic, bytes):
+        topic = bytes(topic)
+    if not isinstance(msg, bytes):
+        msg = bytes(msg)
     print(topic, msg)
-    if topic.decode("utf-8") == "data":  # 订阅主题为data时，打印消息
+    if topic in CMD_TOPICS:  # 发给本车或所有车的指令
         try:
-            # 将消息反序列化为字典
-            data = ujson.loads(msg.decode("utf-8"))
-            # print("Parsed message:", data)
-
-            # 1. 处理 init 信息
-            if "command-type" in data and data["command-type"] == "init":
-                data["command-type"] = "ack_init"
-                try: 
-                    import urandom
-                    data["path-id"] = urandom.randint(1, 2)
-                except:
-                    global path_id
-                    path_id += 1
-                    if path_id > 2:
-                        path_id = 1
-                    data["path-id"] = path_id
-                data["command-type"] = "ack_init"
-                c.publish(b"server", ujson.dumps(data))
-
-            # 2. 处理 tasks 信息
-            if "command-type" in data and data["command-type"] == "task":
-                data["command-type"] = "ack_task"
-                c.publish(b"server", ujson.dumps(data))
-                # print("Published response:", data)
-                tasks_list = data["tasks"]
-                global m
-                m = tasks_list
-            
-            # 3. 处理 stop 信息
-            if "command-type" in data and data["command-type"] == "stop":
-                data["command-type"] = "ack_stop"
-                c.publish(b"server", ujson.dumps(data))
-                tasks_list = data["tasks"]
-                global m
-                m = tasks_list
-
-        except ValueError as e:
-            print("Failed to parse message:", e)
+            # 二进制编码的指令用同样的编码回复
+            binary = carcodec is not None and carcodec.is_binary(msg)
+            handler = HANDLERS.get(command_type(msg, binary))
+            if handler is not None:
+                handler(msg, binary)
+        except Exception as e:
+            # 一条格式错误的指令不能让 run() 退出
+            print("Failed to handle message:", e)
     # if topic.decode("utf-8") == "data" and msg.decode("utf-8") == "distance":
     #     c.publish(b"data", str(distance))
         
 
 
-def send_message(message_dict, command_type = "car-message"):
+def reply(payload):
+    """
+    发布指令回复（由 ack_payload 生成）。
+    """
+    c.enqueue(ACK_TOPIC, payload, ACK_QOS)
+
+
+def send_message(message_dict, command_type = "car-message", key=None):
     """
     这里我也提供小车的发送信息的函数
     message_dict: 字典类型
     command_type: 指令类型
+    key: 遥测类消息传入 key，发送前队列中 key 相同的旧消息被新消息替换
     !注意 每在这里加入一种与服务器通信的指令, 就需要在服务器端添加相应的处理逻辑(server.py/on_message函数)
     """
     send_data = {}
     send_data["command-type"] = command_type
-    send_data = send_data | message_dict
-    c.publish(b"server", ujson.dumps(send_data))
+    send_data.update(message_dict)
+    c.enqueue(ACK_TOPIC, ujson.dumps(send_data), key=key)
 
-    
-# 1. 联网
-try:
-    import network     # 单片机需要联网
-    do_connect()           
-except:
-    pass
 
-# 2. 创建mqtt客户端
+# 每辆车使用芯片唯一 ID 作为车号和 MQTT client_id，只订阅发给自己的指令和广播指令
+try:
+    import machine
+    import ubinascii
+    CAR_ID = ubinascii.hexlify(machine.unique_id())
+except ImportError:
+    CAR_ID = b"umqtt_client"
+CMD_TOPIC = b"car/" + CAR_ID + b"/cmd"
+ACK_TOPIC = b"car/" + CAR_ID + b"/ack"
+BROADCAST_TOPIC = b"car/all/cmd"
+CMD_TOPICS = (CMD_TOPIC, BROADCAST_TOPIC)
+ACK_QOS = 2  # 指令回复使用 QoS 2，保证后端恰好收到一次
+OUT_QUEUE = 16  # 待发布队列容量，回复和遥测先入队，由主循环在 socket 可写时发送
+KEEPALIVE = 30  # 保活间隔（秒），Broker 超过 1.5 倍该时间收不到报文会断开连接
+
+BROKER = "10.223.47.2"  # MQTT Broker 地址，本地测试可改为运行 broker.py 的机器
 m = []  # 任务列表
 path_id = 1  # 路径ID
-c = MQTTClient("umqtt_client", "10.223.47.2")  # 建立一个MQTT客户端
-c.set_callback(sub_cb)  # 设置回调函数
-c.connect()  # 建立连接
-c.subscribe(b"data") 
-
-while True:
-    c.check_msg()       # 读取服务器消息
-    time.sleep(1)
+c = None  # MQTT 客户端
+
+
+def control_tick():
+    """
+    小车的运动逻辑，每 TICK_MS 毫秒调用一次，不要在这里长时间 sleep（会推迟指令的处理）。
+    """
     # TODO 这里可以添加自己的小车自己运行逻辑代码
     pass
+
+
+def main(broker=BROKER, port=0):
+    global c
+    # 1. 联网
+    try:
+        do_connect()       # 单片机需要联网，CPython 上没有 network 模块时跳过
+    except ImportError:
+        pass
+
+    # 2. 创建mqtt客户端
+    # 建立一个带保活和断线重连的MQTT客户端，使用预分配的接收缓冲区
+    c = RobustMQTTClient(CAR_ID, broker, port, keepalive=KEEPALIVE, rx_buf_size=512, max_inflight=8, out_queue=OUT_QUEUE)
+    c.set_callback(sub_cb, copy=True)  # 设置回调函数（sub_cb 按 bytes 处理消息）
+    try:
+        c.connect()  # 建立连接（持久会话，断线后 Broker 保留订阅和未确认的报文）
+    except OSError as e:
+        print("连接失败:", e)
+        c.reconnect()
+    c.subscribe(CMD_TOPIC)
+    c.subscribe(BROADCAST_TOPIC)
+    # 通知后端本车上线，并声明是否支持二进制编码的指令
+    send_message({"codec": carcodec.CODEC_BINARY} if carcodec else {}, "online")
+
+    # 3. 事件循环：收到的指令立即处理，按需发送心跳、重发未确认的回复，断线时自动重连；
+    #    每个控制周期调用一次 control_tick
+    c.run(control_tick, TICK_MS)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""
+MQTT 3.1.1 控制报文的编码和解码，CPython 和 MicroPython 共用（上单片机时与 micro_py.py 一起上传）。
+
+编码函数把报文写进调用方提供的可复用 bytearray，返回 (缓冲区, 报文长度)；缓冲区不够大时
+分配新的缓冲区返回，调用方保存下来下次继续使用。只用一次的小报文（确认、CONNACK 等）直接返回 bytes。
+
+解码函数在已收到的缓冲区上工作：frame() 判断 [pos, end) 中是否已有完整报文并返回报文体的位置，
+数据不够时返回 None，调用方继续接收后再试；parse_*() 解析报文体，传入 memoryview 时
+主题、负载等字段都是原缓冲区的切片，不复制数据。报文格式错误时抛出 MQTTCodecError。
+"""
+# 控制报文类型（固定头高 4 位）
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+PUBREC = 0x50
+PUBREL = 0x60
+PUBCOMP = 0x70
+SUBSCRIBE = 0x80
+SUBACK = 0x90
+UNSUBSCRIBE = 0xA0
+UNSUBACK = 0xB0
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+PINGREQ_PACKET = b"\xc0\x00"
+PINGRESP_PACKET = b"\xd0\x00"
+DISCONNECT_PACKET = b"\xe0\x00"
+
+MAX_LENGTH = 268435455   # 剩余长度最多 4 字节
+MAX_HEADER = 5           # 固定头最多 5 字节
+
+
+class MQTTCodecError(ValueError):
+    pass
+
+
+def _grow(buf, size):
+    # 可复用的缓冲区，只在报文比当前缓冲区大时重新分配
+    if buf is None or len(buf) < size:
+        return bytearray(size)
+    return buf
+
+
+# ---------------------------------------------------------------- 字段
+def len_size(n):
+    """
+    剩余长度字段的字节数。
+    """
+    if n < 0x80:
+        return 1
+    if n < 0x4000:
+        return 2
+    if n < 0x200000:
+        return 3
+    return 4
+
+
+def put_len(buf, pos, n):
+    """
+    写入剩余长度（变长编码），返回下一个写入位置。
+    """
+    while n > 0x7F:
+        buf[pos] = (n & 0x7F) | 0x80
+        n >>= 7
+        pos += 1
+    buf[pos] = n
+    return pos + 1
+
+
+def put_str(buf, pos, s):
+    """
+    写入 2 字节长度前缀的字符串，返回下一个写入位置。
+    """
+    n = len(s)
+    buf[pos] = n >> 8
+    buf[pos + 1] = n & 0xFF
+    buf[pos + 2:pos + 2 + n] = s
+    return pos + 2 + n
+
+
+def encode_length(n):
+    buf = bytearray(len_size(n))
+    put_len(buf, 0, n)
+    return bytes(buf)
+
+
+def get_len(buf, pos, end):
+    """
+    从 buf[pos:end] 解码剩余长度，返回 (长度, 下一个位置)；字段还没有收全时返回 None。
+    """
+    n = 0
+    sh = 0
+    while pos < end:
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7F) << sh
+        if not b & 0x80:
+            return n, pos
+        sh += 7
+        if sh > 21:
+            raise MQTTCodecError("剩余长度字段过长")
+    return None
+
+
+def read_len(read):
+    """
+    用 read(1) 从流中逐字节读取剩余长度（没有接收缓冲区的客户端使用）。
+    """
+    n = 0
+    sh = 0
+    while 1:
+        b = read(1)[0]
+        n |= (b & 0x7F) << sh
+        if not b & 0x80:
+            return n
+        sh += 7
+        if sh > 21:
+            raise MQTTCodecError("剩余长度字段过长")
+
+
+def get_str(buf, pos, end=None):
+    """
+    读取 2 字节长度前缀的字符串，返回 (切片, 下一个位置)。
+    """
+    if end is None:
+        end = len(buf)
+    if pos + 2 > end:
+        raise MQTTCodecError("字符串长度字段不完整")
+    n = buf[pos] << 8 | buf[pos + 1]
+    pos += 2
+    if pos + n > end:
+        raise MQTTCodecError("字符串超出报文长度")
+    return buf[pos:pos + n], pos + n
+
+
+def frame(buf, pos, end):
+    """
+    buf[pos:end] 中第一个报文完整时返回 (固定头首字节, 报文体开始, 报文体结束)，否则返回 None。
+    """
+    if end - pos < 2:
+        return None
+    n = buf[pos + 1]
+    if n < 0x80:
+        start = pos + 2     # 常见的短报文，剩余长度只有 1 字节
+    else:
+        got = get_len(buf, pos + 1, end)
+        if got is None:
+            return None
+        n, start = got
+    if end - start < n:
+        return None
+    return buf[pos], start, start + n
+
+
+# ---------------------------------------------------------------- 编码
+def connect(buf, client_id, clean_session=True, keepalive=0, user=None, password=None,
+            lw_topic=None, lw_msg=None, lw_qos=0, lw_retain=False):
+    """
+    CONNECT 报文。user 不为 None 时同时写入用户名和密码。
+    """
+    sz = 10 + 2 + len(client_id)
+    flags = clean_session << 1
+    if user is not None:
+        sz += 2 + len(user) + 2 + len(password)
+        flags |= 0xC0
+    if lw_topic:
+        sz += 2 + len(lw_topic) + 2 + len(lw_msg)
+        flags |= 0x4 | (lw_qos & 0x1) << 3 | (lw_qos & 0x2) << 3
+        flags |= lw_retain << 5
+    assert 0 <= keepalive < 65536
+    buf = _grow(buf, 1 + len_size(sz) + sz)
+    buf[0] = CONNECT
+    pos = put_len(buf, 1, sz)
+    buf[pos:pos + 7] = b"\0\x04MQTT\x04"
+    buf[pos + 7] = flags
+    buf[pos + 8] = keepalive >> 8
+    buf[pos + 9] = keepalive & 0xFF
+    pos = put_str(buf, pos + 10, client_id)
+    if lw_topic:
+        pos = put_str(buf, pos, lw_topic)
+        pos = put_str(buf, pos, lw_msg)
+    if user is not None:
+        pos = put_str(buf, pos, user)
+        pos = put_str(buf, pos, password)
+    return buf, pos
+
+
+def publish(buf, topic, msg, qos=0, retain=False, pid=0, dup=False, inline=True):
+    """
+    PUBLISH 报文。inline 为 False 时只写固定头、主题和报文 ID，返回的长度不含负载，
+    负载由调用方另行发送（大负载不复制）。
+    """
+    sz = 2 + len(topic) + len(msg)
+    if qos > 0:
+        sz += 2
+    if sz > MAX_LENGTH:
+        raise MQTTCodecError("报文过长")
+    buf = _grow(buf, 9 + len(topic) + (len(msg) if inline else 0))
+    buf[0] = PUBLISH | dup << 3 | qos << 1 | retain
+    pos = put_len(buf, 1, sz)
+    pos = put_str(buf, pos, topic)
+    if qos > 0:
+        buf[pos] = pid >> 8
+        buf[pos + 1] = pid & 0xFF
+        pos += 2
+    if inline:
+        buf[pos:pos + len(msg)] = msg
+        pos += len(msg)
+    return buf, pos
+
+
+def publish_packet(topic, payload, qos=0, retain=False, pid=0, dup=False):
+    """
+    组装完整的 PUBLISH 报文，返回 bytes。
+    供 CPython 一侧（broker.py、legacy/mqtt_car.py）使用：只把固定头和主题长度写入小缓冲区，
+    其余字段直接拼接，CPython 上比逐字节写入整包的缓冲区更快；设备上用 publish() 复用缓冲区。
+    """
+    n = len(topic)
+    size = 2 + n + len(payload) + (2 if qos else 0)
+    if size > MAX_LENGTH:
+        raise MQTTCodecError("报文过长")
+    head = bytearray(7)
+    head[0] = PUBLISH | dup << 3 | qos << 1 | retain
+    pos = put_len(head, 1, size)
+    head[pos] = n >> 8
+    head[pos + 1] = n & 0xFF
+    if qos:
+        return bytes(head[:pos + 2]) + topic + bytes((pid >> 8, pid & 0xFF)) + payload
+    return bytes(head[:pos + 2]) + topic + payload
+
+
+def subscribe(buf, pid, topic, qos=0):
+    """
+    订阅一个主题的 SUBSCRIBE 报文。
+    """
+    sz = 2 + 2 + len(topic) + 1
+    buf = _grow(buf, 1 + len_size(sz) + sz)
+    buf[0] = SUBSCRIBE | 0x02
+    pos = put_len(buf, 1, sz)
+    buf[pos] = pid >> 8
+    buf[pos + 1] = pid & 0xFF
+    pos = put_str(buf, pos + 2, topic)
+    buf[pos] = qos
+    return buf, pos + 1
+
+
+def unsubscribe(buf, pid, topic):
+    sz = 2 + 2 + len(topic)
+    buf = _grow(buf, 1 + len_size(sz) + sz)
+    buf[0] = UNSUBSCRIBE | 0x02
+    pos = put_len(buf, 1, sz)
+    buf[pos] = pid >> 8
+    buf[pos + 1] = pid & 0xFF
+    return buf, put_str(buf, pos + 2, topic)
+
+
+def ack(op, pid):
+    """
+    PUBACK / PUBREC / PUBREL（op 传 0x62）/ PUBCOMP / UNSUBACK 报文。
+    """
+    return bytes((op, 2, pid >> 8, pid & 0xFF))
+
+
+def connack(present, code=0):
+    return bytes((CONNACK, 2, 1 if present else 0, code))
+
+
+def suback(pid, granted):
+    return bytes((SUBACK,)) + encode_length(2 + len(granted)) + bytes((pid >> 8, pid & 0xFF)) + bytes(granted)
+
+
+# ---------------------------------------------------------------- 解码
+def parse_publish(op, body):
+    """
+    返回 (主题, 报文 ID, 负载)，QoS 0 的报文 ID 为 0。
+    """
+    end = len(body)
+    if end < 2:
+        raise MQTTCodecError("PUBLISH 缺少主题")
+    pos = 2 + (body[0] << 8 | body[1])
+    if op & 6:
+        if pos + 2 > end:
+            raise MQTTCodecError("PUBLISH 缺少报文 ID")
+        return body[2:pos], body[pos] << 8 | body[pos + 1], body[pos + 2:]
+    if pos > end:
+        raise MQTTCodecError("主题超出报文长度")
+    return body[2:pos], 0, body[pos:]
+
+
+def parse_ack(body):
+    """
+    PUBACK / PUBREC / PUBREL / PUBCOMP / UNSUBACK 的报文 ID。
+    """
+    if len(body) != 2:
+        raise MQTTCodecError("确认报文长度错误")
+    return body[0] << 8 | body[1]
+
+
+def parse_connack(body):
+    """
+    返回 (会话是否存在, 返回码)。
+    """
+    if len(body) != 2:
+        raise MQTTCodecError("CONNACK 长度错误")
+    return body[0] & 1, body[1]
+
+
+def parse_suback(body):
+    """
+    返回 (报文 ID, 各主题授予的 QoS)。
+    """
+    if len(body) < 3:
+        raise MQTTCodecError("SUBACK 长度错误")
+    return body[0] << 8 | body[1], body[2:]
+
+
+def parse_subscribe(body):
+    """
+    返回 (报文 ID, [(主题, QoS)])。
+    """
+    if len(body) < 2:
+        raise MQTTCodecError("SUBSCRIBE 缺少报文 ID")
+    pid = body[0] << 8 | body[1]
+    pos = 2
+    end = len(body)
+    topics = []
+    while pos < end:
+        topic, pos = get_str(body, pos, end)
+        if pos >= end:
+            raise MQTTCodecError("SUBSCRIBE 缺少 QoS")
+        topics.append((topic, body[pos]))
+        pos += 1
+    if not topics:
+        raise MQTTCodecError("SUBSCRIBE 没有主题")
+    return pid, topics
+
+
+def parse_unsubscribe(body):
+    """
+    返回 (报文 ID, [主题])。
+    """
+    if len(body) < 2:
+        raise MQTTCodecError("UNSUBSCRIBE 缺少报文 ID")
+    pid = body[0] << 8 | body[1]
+    pos = 2
+    end = len(body)
+    topics = []
+    while pos < end:
+        topic, pos = get_str(body, pos, end)
+        topics.append(topic)
+    return pid, topics
+
+
+def parse_connect(body):
+    """
+    返回 (协议级别, 标志, keepalive, client_id, 遗嘱主题, 遗嘱消息, 用户名, 密码)，没有的字段为 None。
+    """
+    end = len(body)
+    name, pos = get_str(body, 0, end)
+    if pos + 4 > end:
+        raise MQTTCodecError("CONNECT 可变头不完整")
+    level = body[pos]
+    flags = body[pos + 1]
+    keepalive = body[pos + 2] << 8 | body[pos + 3]
+    client_id, pos = get_str(body, pos + 4, end)
+    will_topic = will_msg = user = password = None
+    if flags & 0x04:
+        will_topic, pos = get_str(body, pos, end)
+        will_msg, pos = get_str(body, pos, end)
+    if flags & 0x80:
+        user, pos = get_str(body, pos, end)
+    if flags & 0x40:
+        password, pos = get_str(body, pos, end)
+    return level, flags, keepalive, client_id, will_topic, will_msg, user, password
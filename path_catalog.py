@@ -0,0 +1,179 @@
+"""
+路径目录：从 JSON 文件加载小车路径，校验动作并建立 ID / 名称索引，文件变化时热加载。
+
+文件格式：
+    {"paths": [
+        {"id": 1, "name": "right-loop", "tasks": ["right", "straight", "right", "right", "right", "end"]},
+        ...
+    ]}
+
+每条路径的动作必须是小车认识的动作（carcodec.MANEUVERS），并以 "end" 结束。
+加载失败时保留原来的目录。查找只读取当前快照中的字典，不加锁。
+"""
+import json
+import os
+import threading
+
+from carcodec import MANEUVERS
+
+DEFAULT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "paths.json")
+
+
+class CatalogError(Exception):
+    pass
+
+
+class Route:
+    __slots__ = ("id", "name", "tasks")
+
+    def __init__(self, route_id, name, tasks):
+        self.id = route_id
+        self.name = name
+        self.tasks = tasks
+
+    def __repr__(self):
+        return f"Route({self.id}, {self.name}, {len(self.tasks)} 步)"
+
+
+def parse_routes(data):
+    """
+    校验路径列表，返回 (按 ID 索引, 按名称索引)，格式错误时抛出 CatalogError。
+    """
+    if not isinstance(data, dict) or not isinstance(data.get("paths"), list):
+        raise CatalogError("路径文件需要包含 paths 列表")
+    known = set(MANEUVERS)
+    by_id = {}
+    by_name = {}
+    for i, entry in enumerate(data["paths"]):
+        if not isinstance(entry, dict):
+            raise CatalogError(f"第 {i} 条路径不是对象")
+        route_id = entry.get("id")
+        if not isinstance(route_id, int) or isinstance(route_id, bool) or route_id < 0:
+            raise CatalogError(f"第 {i} 条路径的 id 无效: {route_id!r}")
+        name = entry.get("name", str(route_id))
+        if not isinstance(name, str) or not name or name.isdecimal():
+            raise CatalogError(f"路径 {route_id} 的名称无效: {name!r}")
+        tasks = entry.get("tasks")
+        if not isinstance(tasks, list) or not tasks:
+            raise CatalogError(f"路径 {route_id} 没有动作")
+        unknown = [task for task in tasks if task not in known]
+        if unknown:
+            raise CatalogError(f"路径 {route_id} 包含小车不认识的动作: {unknown}")
+        if tasks[-1] != "end" or "end" in tasks[:-1]:
+            raise CatalogError(f"路径 {route_id} 必须以 end 结束且只有一个 end")
+        if route_id in by_id:
+            raise CatalogError(f"路径 id 重复: {route_id}")
+        if name in by_name:
+            raise CatalogError(f"路径名称重复: {name}")
+        route = Route(route_id, name, tuple(tasks))
+        by_id[route_id] = route
+        by_name[name] = route
+    return by_id, by_name
+
+
+class PathCatalog:
+    """
+    路径目录。lookup() 按 ID（整数或数字字符串）或名称查找路径，
+    check() 发现文件变化时重新加载，watch() 在后台线程中定时检查。
+    """
+
+    def __init__(self, path=DEFAULT_FILE, on_reload=None):
+        self.path = path
+        self.on_reload = on_reload      # 加载成功后的回调 on_reload(catalog)
+        self.by_id = {}
+        self.by_name = {}
+        self.version = 0                # 每次成功加载加 1
+        self.stamp = None               # 已加载文件的 (mtime_ns, size)
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def load(self):
+        """
+        读取并校验路径文件，成功后整体替换索引。
+        """
+        st = os.stat(self.path)
+        with open(self.path, encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except ValueError as e:
+                raise CatalogError(f"路径文件不是有效的 JSON: {e}")
+        by_id, by_name = parse_routes(data)
+        # 两个索引一起替换，查找时不会看到新旧混合的状态
+        self.by_id, self.by_name = by_id, by_name
+        self.stamp = (st.st_mtime_ns, st.st_size)
+        self.version += 1
+        if self.on_reload is not None:
+            self.on_reload(self)
+        return self
+
+    def check(self):
+        """
+        文件变化时重新加载，返回是否加载了新目录；加载失败时保留原目录并抛出 CatalogError。
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        if (st.st_mtime_ns, st.st_size) == self.stamp:
+            return False
+        self.load()
+        return True
+
+    def watch(self, interval=2.0, on_error=None):
+        """
+        启动后台线程，每 interval 秒检查一次文件。
+        """
+        def run():
+            while not self.stopped.wait(interval):
+                try:
+                    if self.check():
+                        print(f"路径目录已重新加载: {len(self)} 条路径，版本 {self.version}")
+                except (CatalogError, OSError) as e:
+                    self.stamp = self._stat()  # 同一个错误的文件只报告一次
+                    if on_error is not None:
+                        on_error(e)
+                    else:
+                        print(f"路径目录加载失败，继续使用旧目录: {e}")
+
+        self.thread = threading.Thread(target=run, name="path-catalog", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def get(self, route_id):
+        return self.by_id.get(route_id)
+
+    def lookup(self, key):
+        """
+        按 ID 或名称查找路径，找不到或 key 不是 ID/名称（例如 None）时返回 None。
+        """
+        if isinstance(key, bool):
+            return None
+        if isinstance(key, int):
+            return self.by_id.get(key)
+        if not isinstance(key, str):
+            return None
+        key = key.strip()
+        if key.isdecimal():
+            return self.by_id.get(int(key))
+        return self.by_name.get(key)
+
+    def summary(self, limit=20):
+        routes = list(self.by_id.values())
+        return {
+            "paths": len(routes),
+            "version": self.version,
+            "sample": [repr(route) for route in routes[:limit]],
+        }
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
@@ -0,0 +1,78 @@
+"""
+预先编码的指令负载缓存。
+
+init / stop 的内容固定，task 只取决于路径，发送时没有必要每次都构造字典再 json.dumps。
+缓存以 (指令类型, path-id, 编码) 为键保存不含关联 ID 的编码结果，
+JSON 保存到 '"cid": "' 为止，二进制保存已置 F_CID 标志的前缀（cid 在报文末尾），
+发送时只需在末尾拼接本次的关联 ID。路径表变化时调用 clear() 使缓存失效。
+规划的路线也以路线参数为键缓存，条目数按 LRU 限制在 max_entries 以内。
+get() 会在定时器线程、dispatcher 线程和主线程中同时调用，缓存和计数都在锁内修改。
+"""
+import json
+import threading
+from collections import OrderedDict
+
+import carcodec
+from carcodec import CODEC_JSON, CODEC_BINARY
+
+
+class PayloadCache:
+
+    def __init__(self, build, max_entries=1024):
+        self.build = build      # build(指令类型, path_id) -> 不含 cid 的指令字典
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = 0     # clear() 时加一，清理前开始构造的负载不再写入缓存
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, command_type, path_id, codec, cid):
+        """
+        返回带关联 ID 的编码结果（bytes）。二进制无法表示的指令退回 JSON。
+        """
+        key = (command_type, path_id, codec)
+        with self.lock:
+            entry = self.entries.get(key)
+            generation = self.generation
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+        if entry is None:
+            # 构造负载（可能需要规划路线）在锁外进行，完成后再写入缓存
+            entry = self._encode(command_type, path_id, codec)
+            with self.lock:
+                if generation == self.generation:
+                    self.entries[key] = entry
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        prefix, codec = entry
+        cid = cid.encode()
+        if codec == CODEC_BINARY:
+            return prefix + bytes((len(cid),)) + cid
+        return prefix + cid + b'"}'
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+    def _encode(self, command_type, path_id, codec):
+        payload = self.build(command_type, path_id)
+        prefix = None
+        if codec == CODEC_BINARY:
+            prefix = carcodec.encode(payload)
+            if prefix is not None:
+                prefix = bytearray(prefix)
+                prefix[2] |= carcodec.F_CID
+                entry = (bytes(prefix), CODEC_BINARY)
+        if prefix is None:
+            text = json.dumps(payload)
+            entry = (text[:-1].encode() + b', "cid": "', CODEC_JSON)
+        return entry
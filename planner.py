@@ -0,0 +1,250 @@
+"""
+基于赛道地图的路线规划：求起点到终点的最短路线，并翻译成小车在路口执行的动作序列。
+
+地图文件格式（JSON）：
+    {
+        "nodes": {"A": [0, 0], "B": [1, 0], ...},          路口及坐标（坐标可省略，有坐标时使用 A*）
+        "edges": [
+            {"from": "A", "to": "B", "length": 1.0, "heading": 90, "arrive": 90, "both": true},
+            ...
+        ]
+    }
+heading 为离开 from 路口时的车头方向，arrive 为到达 to 路口时的方向（默认与 heading 相同，弯道可以不同），
+方向按罗盘角度：0 北，90 东，180 南，270 西。both 为 true 时同时加入反向边（方向加 180 度）。
+
+小车每经过一个路口执行一个动作（legacy/main.py 的 cross_counter 逐个路口取动作），
+动作由到达方向和离开方向的夹角决定：
+    |夹角| <= 20       straight
+    20 < |夹角| <= 60  tiny_right / tiny_left
+    60 < |夹角| <= 135 right / left
+    更大的夹角需要掉头，小车做不到，不作为可选路线
+到达终点路口时执行 end。
+"""
+import heapq
+import hashlib
+import json
+import math
+import threading
+from collections import OrderedDict
+
+STRAIGHT_MAX = 20
+TINY_MAX = 60
+TURN_MAX = 135
+
+# 路口动作的额外代价（与边长度同单位），同样长度时优先少转弯
+TURN_COST = {"straight": 0.0, "tiny_left": 0.1, "tiny_right": 0.1, "left": 0.3, "right": 0.3}
+
+
+class PlanError(Exception):
+    pass
+
+
+def maneuver(arrive, depart):
+    """
+    根据到达方向和离开方向返回路口动作，需要掉头时返回 None。
+    """
+    delta = (depart - arrive + 180) % 360 - 180
+    size = abs(delta)
+    if size <= STRAIGHT_MAX:
+        return "straight"
+    if size <= TINY_MAX:
+        return "tiny_right" if delta > 0 else "tiny_left"
+    if size <= TURN_MAX:
+        return "right" if delta > 0 else "left"
+    return None
+
+
+class TrackMap:
+    """
+    赛道地图：路口和带方向的有向边。version 由地图内容计算，内容不变版本就不变。
+    """
+
+    def __init__(self, nodes, edges):
+        self.nodes = nodes          # 路口 -> (x, y) 或 None
+        self.out = {name: [] for name in nodes}   # 路口 -> [(to, length, heading, arrive)]
+        for edge in edges:
+            self._add(edge["from"], edge["to"], edge["length"], edge["heading"], edge.get("arrive", edge["heading"]))
+            if edge.get("both"):
+                self._add(edge["to"], edge["from"], edge["length"],
+                          (edge.get("arrive", edge["heading"]) + 180) % 360, (edge["heading"] + 180) % 360)
+        canonical = json.dumps({"nodes": nodes, "edges": edges}, sort_keys=True)
+        self.version = hashlib.sha1(canonical.encode()).hexdigest()[:12]
+        self.geometric = all(pos is not None for pos in nodes.values())
+
+    @classmethod
+    def from_dict(cls, data):
+        try:
+            nodes = {str(name): (tuple(pos) if pos is not None else None) for name, pos in data["nodes"].items()}
+            edges = list(data["edges"])
+            for edge in edges:
+                for key in ("from", "to"):
+                    edge[key] = str(edge[key])
+                    if edge[key] not in nodes:
+                        raise PlanError(f"边引用了不存在的路口: {edge[key]}")
+                if edge["length"] <= 0:
+                    raise PlanError(f"边 {edge['from']}->{edge['to']} 的长度必须大于 0")
+        except (KeyError, TypeError, AttributeError) as e:
+            raise PlanError(f"地图格式错误: {e}")
+        return cls(nodes, edges)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    def _add(self, src, dst, length, heading, arrive):
+        self.out[src].append((dst, float(length), heading % 360, arrive % 360))
+
+    def distance(self, a, b):
+        (x1, y1), (x2, y2) = self.nodes[a], self.nodes[b]
+        return math.hypot(x2 - x1, y2 - y1)
+
+
+class Plan:
+    __slots__ = ("start", "goal", "heading", "nodes", "tasks", "cost")
+
+    def __init__(self, start, goal, heading, nodes, tasks, cost):
+        self.start = start
+        self.goal = goal
+        self.heading = heading
+        self.nodes = nodes      # 依次经过的路口
+        self.tasks = tasks      # 每个路口的动作，最后为 end
+        self.cost = cost
+
+    def __repr__(self):
+        return f"Plan({'->'.join(self.nodes)}, {list(self.tasks)})"
+
+
+class RoutePlanner:
+    """
+    路线规划器。状态为 (路口, 到达方向)，这样转弯限制（不能掉头）可以直接体现在搜索中；
+    地图带坐标时用直线距离作为 A* 的启发函数（要求边长度不小于两端路口的直线距离）。
+    结果按 (地图版本, 起点, 终点, 初始方向) 缓存在 LRU 中，precompute() 可为小地图预先算出所有起终点。
+    heading 为 None 表示小车停在起点路口上，沿第一条边出发，起点不执行动作。
+    plan() 会在定时器线程、dispatcher 线程和主线程中同时调用，缓存和计数都在锁内访问，
+    搜索在锁外进行。
+    """
+
+    def __init__(self, track, cache_size=4096, turn_cost=TURN_COST):
+        self.track = track
+        self.cache_size = cache_size
+        self.turn_cost = turn_cost
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def set_track(self, track):
+        """
+        替换地图。缓存键含地图版本，旧地图的结果不会再被命中，这里一并清理。
+        """
+        with self.lock:
+            self.track = track
+            self.cache.clear()
+
+    def plan(self, start, goal, heading=None):
+        """
+        返回 Plan，起点或终点不存在、或没有可行路线时返回 None。
+        """
+        with self.lock:
+            track = self.track
+            key = (track.version, start, goal, heading)
+            cache = self.cache
+            if key in cache:
+                self.hits += 1
+                cache.move_to_end(key)
+                return cache[key]
+            self.misses += 1
+        result = None
+        if start in track.nodes and goal in track.nodes:
+            result = self._search(track, start, heading, goal).get(goal)
+        self._store(key, result)
+        return result
+
+    def precompute(self, headings=True):
+        """
+        为所有起点（以及到达每个起点可能的方向）预先计算到所有终点的路线，返回计算的条目数。
+        每个 (起点, 方向) 只做一次单源搜索。
+        """
+        track = self.track
+        starts = {(node, None) for node in track.nodes}
+        if headings:
+            for edges in track.out.values():
+                for dst, _, _, arrive in edges:
+                    starts.add((dst, arrive))
+        count = 0
+        for start, heading in starts:
+            for goal, result in self._search(track, start, heading).items():
+                self._store((track.version, start, goal, heading), result)
+                count += 1
+        return count
+
+    def stats(self):
+        with self.lock:
+            return {"cached": len(self.cache), "hits": self.hits, "misses": self.misses, "version": self.track.version}
+
+    def _store(self, key, result):
+        with self.lock:
+            if key[0] != self.track.version:
+                return          # 搜索期间地图已被替换，结果不再缓存
+            self.cache[key] = result
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def _search(self, track, start, heading, goal=None):
+        """
+        从 (start, heading) 出发的 Dijkstra（指定 goal 且地图带坐标时为 A*），
+        返回 {终点: Plan}；指定 goal 时找到即停止。
+        """
+        use_astar = goal is not None and track.geometric
+        h = (lambda node: track.distance(node, goal)) if use_astar else (lambda node: 0.0)
+        start_state = (start, heading)
+        best = {start_state: 0.0}
+        parent = {start_state: None}     # 状态 -> (上一个状态, 在上一个路口执行的动作)
+        heap = [(h(start), 0.0, 0, start_state)]
+        tie = 1
+        plans = {}
+        while heap:
+            _, cost, _, state = heapq.heappop(heap)
+            if cost > best.get(state, math.inf):
+                continue
+            node, arrive = state
+            if node not in plans:
+                plans[node] = self._build(start, heading, state, parent, cost)
+                if node == goal:
+                    break
+            for dst, length, depart, next_arrive in track.out[node]:
+                if arrive is None:
+                    action = None
+                    extra = 0.0
+                else:
+                    action = maneuver(arrive, depart)
+                    if action is None:
+                        continue
+                    extra = self.turn_cost.get(action, 0.0)
+                next_state = (dst, next_arrive)
+                next_cost = cost + length + extra
+                if next_cost < best.get(next_state, math.inf):
+                    best[next_state] = next_cost
+                    parent[next_state] = (state, action)
+                    heapq.heappush(heap, (next_cost + h(dst), next_cost, tie, next_state))
+                    tie += 1
+        if goal is not None:
+            return {goal: plans[goal]} if goal in plans else {}
+        return plans
+
+    @staticmethod
+    def _build(start, heading, state, parent, cost):
+        nodes = [state[0]]
+        tasks = ["end"]
+        link = parent[state]
+        while link is not None:
+            prev, action = link
+            nodes.append(prev[0])
+            if action is not None:
+                tasks.append(action)
+            link = parent[prev]
+        nodes.reverse()
+        tasks.reverse()
+        return Plan(start, state[0], heading, tuple(nodes), tuple(tasks), cost)
@@ -0,0 +1,209 @@
+"""
+多车路口预约调度：按时间片为每个路口登记占用，给同时出发的小车分配互不冲突的出发时间。
+
+时间模型（与 legacy/main.py 的小车行为一致）：
+    边上的行驶时间 = 边长度 / speed
+    在路口停留的时间 = CROSS_S（压线后 cross() 停车 1 秒）+ 动作本身的时间（turn_left 0.65 秒等）
+小车一旦出发就按路线连续行驶，中途不能停下等待，所以冲突只能通过推迟出发来避免。
+每个路口在每个时间片内只允许一辆车占用，占用区间前后各留 margin 个时间片的余量。
+赛道是单车道，每条边（不分方向）在小车行驶其上的时间片内同样只允许一辆车占用，
+两辆车相向驶入同一条边会迎面相撞，只预约路口发现不了这种冲突。
+"""
+import math
+import threading
+import time
+
+CROSS_S = 1.0
+MANEUVER_S = {"straight": 0.0, "left": 0.65, "right": 0.8, "tiny_left": 0.3, "tiny_right": 0.4, "end": 0.0}
+
+
+def edge_key(a, b):
+    """
+    边在预约表中的键：与方向无关，a->b 和 b->a 是同一条车道。
+    """
+    return (a, b) if a <= b else (b, a)
+
+
+class Booking:
+    """
+    一辆车的预约：路线、出发时间和各路口占用的时间片。
+    """
+    __slots__ = ("car_id", "plan", "depart", "slots", "requested")
+
+    def __init__(self, car_id, plan, depart, slots, requested):
+        self.car_id = car_id
+        self.plan = plan
+        self.depart = depart        # 出发时间（time.monotonic）
+        self.slots = slots          # [(路口或边, 时间片)]
+        self.requested = requested  # 请求的最早出发时间，重新调度时从这里开始
+
+    def __repr__(self):
+        return f"Booking({self.car_id}, depart={self.depart:.2f}, {len(self.slots)} 片)"
+
+
+class ReservationScheduler:
+    """
+    预约表：table[路口或边][时间片] = 小车编号，边用 edge_key() 表示，两个方向共用一项。
+    schedule() 为小车找到最早的无冲突出发时间并登记；report_delay() 在小车报告延误时
+    把它剩余的占用整体后移，被挤占的尚未出发的小车重新调度，已经出发的小车作为冲突返回。
+    """
+
+    def __init__(self, track, speed=0.25, slot=0.25, margin=1, max_wait=60.0):
+        self.track = track
+        self.speed = speed          # 行驶速度（地图长度单位 / 秒）
+        self.slot = slot            # 时间片长度（秒）
+        self.margin = margin        # 占用区间前后的余量（时间片）
+        self.max_wait = max_wait    # 最多推迟出发的时间（秒）
+        self.table = {}
+        self.bookings = {}
+        self.lock = threading.Lock()
+        self.scheduled = 0
+        self.replans = 0
+
+    def timeline(self, plan):
+        """
+        返回 [(路口或边, 相对出发时间的驶入时间, 占用时间)]，路口和它驶出的边交替排列。
+        """
+        edges = self.track.out
+        result = []
+        t = 0.0
+        nodes = plan.nodes
+        # 起点不执行动作时 tasks 比 nodes 少一个
+        offset = len(nodes) - len(plan.tasks)
+        for i, node in enumerate(nodes):
+            action = plan.tasks[i - offset] if i >= offset else "straight"
+            dwell = CROSS_S + MANEUVER_S.get(action, 0.0)
+            result.append((node, t, dwell))
+            t += dwell
+            if i + 1 < len(nodes):
+                length = min(length for dst, length, _, _ in edges[node] if dst == nodes[i + 1])
+                result.append((edge_key(node, nodes[i + 1]), t, length / self.speed))
+                t += length / self.speed
+        return result
+
+    def schedule(self, car_id, plan, earliest=None):
+        """
+        为小车登记路线，返回出发时间（time.monotonic）；max_wait 内找不到无冲突的时间时返回 None。
+        小车已有的预约会先被取消。
+        """
+        now = time.monotonic()
+        earliest = max(now, earliest or now)
+        with self.lock:
+            self._release(car_id)
+            booking = self._place(car_id, plan, earliest, earliest)
+            if booking is None:
+                return None
+            self.scheduled += 1
+            return booking.depart
+
+    def report_delay(self, car_id, delay):
+        """
+        小车报告延误 delay 秒：剩余的占用整体后移。
+        返回 (重新调度的小车编号, 无法避让的已出发小车编号)。
+        """
+        now = time.monotonic()
+        moved = []
+        conflicts = []
+        with self.lock:
+            booking = self.bookings.get(car_id)
+            if booking is None:
+                return moved, conflicts
+            self.replans += 1
+            shift = int(math.ceil(delay / self.slot))
+            current = int(now / self.slot)
+            self._release(car_id)
+            slots = [(key, s + shift if s >= current else s) for key, s in booking.slots]
+            victims = {}
+            for key, s in slots:
+                other = self.table.get(key, {}).get(s)
+                if other is not None and other != car_id and other not in victims:
+                    victims[other] = self._release(other)
+            booking.slots = slots
+            self._book(booking)
+            for other in sorted(victims):
+                victim = victims[other]
+                if victim.depart > now:
+                    if self._place(other, victim.plan, victim.requested, now) is not None:
+                        moved.append(other)
+                        continue
+                conflicts.append(other)
+        return moved, conflicts
+
+    def booking(self, car_id):
+        """
+        返回小车当前预约的 (路线, 出发时间)，没有预约时返回 None。
+        """
+        with self.lock:
+            booking = self.bookings.get(car_id)
+            if booking is None:
+                return None
+            return booking.plan, booking.depart
+
+    def finish(self, car_id):
+        """
+        小车到达终点或停止，取消它的预约。
+        """
+        with self.lock:
+            self._release(car_id)
+
+    def expire(self):
+        """
+        清理已经过去的时间片和已经走完的预约。
+        """
+        current = int(time.monotonic() / self.slot) - self.margin
+        with self.lock:
+            for car_id in [car_id for car_id, b in self.bookings.items() if b.slots and b.slots[-1][1] < current]:
+                self._release(car_id)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "bookings": len(self.bookings),
+                "slots": sum(len(slots) for slots in self.table.values()),
+                "scheduled": self.scheduled,
+                "replans": self.replans,
+            }
+
+    def _place(self, car_id, plan, requested, now):
+        # 从 requested 起逐个时间片尝试出发时间，直到所有路口都没有冲突
+        timeline = self.timeline(plan)
+        first = int(math.ceil(max(requested, now) / self.slot))
+        last = first + int(self.max_wait / self.slot)
+        for start in range(first, last + 1):
+            slots = self._slots(timeline, start)
+            if slots is not None:
+                booking = Booking(car_id, plan, start * self.slot, slots, requested)
+                self._book(booking)
+                return booking
+        return None
+
+    def _slots(self, timeline, start):
+        # 出发时间片为 start 时各路口和边需要占用的时间片，有冲突时返回 None
+        # 路口前后留 margin 个时间片的余量；边只占小车在边上的时间，两端已由路口的余量覆盖
+        table = self.table
+        slots = []
+        for key, enter, duration in timeline:
+            occupied = table.get(key)
+            margin = self.margin if isinstance(key, str) else 0
+            first = start + int(enter / self.slot) - margin
+            last = start + int(math.ceil((enter + duration) / self.slot)) + margin
+            for s in range(first, last):
+                if occupied is not None and s in occupied:
+                    return None
+                slots.append((key, s))
+        return slots
+
+    def _book(self, booking):
+        for key, s in booking.slots:
+            self.table.setdefault(key, {})[s] = booking.car_id
+        self.bookings[booking.car_id] = booking
+
+    def _release(self, car_id):
+        booking = self.bookings.pop(car_id, None)
+        if booking is None:
+            return None
+        for key, s in booking.slots:
+            occupied = self.table.get(key)
+            if occupied is not None and occupied.get(s) == car_id:
+                del occupied[s]
+        return booking